@@ -0,0 +1,423 @@
+"""
+Benchmark do pipeline de dados do dashboard CEOP.
+
+Gera planilhas sintéticas (com semente fixa, sempre iguais) nos formatos que
+o dashboard aceita e mede o tempo e o pico de memória de cada etapa do
+pipeline, da leitura do CSV até os indicadores exibidos. A leitura das
+planilhas públicas (ler_sheet_publico) é medida contra um servidor HTTP local
+que reproduz a exportação CSV do Google Sheets, sem acesso à internet.
+
+Uso:
+    python benchmark_pipeline.py
+    python benchmark_pipeline.py --tamanhos 1000 10000000 --formatos nomes
+    python benchmark_pipeline.py --saida resultados.json --comparar resultados_anteriores.json
+
+Os resultados são gravados em JSON (--saida). Com --comparar, cada etapa é
+comparada com um arquivo anterior e o script termina com código 1 se alguma
+ficar mais lenta que o limite (--limite, padrão 1,2x).
+"""
+
+import argparse
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import re
+import subprocess
+import sys
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+# Memória residente do processo: psutil quando disponível, senão /proc (Linux)
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ceop_dashboard as dashboard
+
+# Sem os avisos do Streamlit por rodar fora de "streamlit run"
+for nome_logger in list(logging.root.manager.loggerDict):
+    if nome_logger.startswith("streamlit"):
+        logging.getLogger(nome_logger).setLevel(logging.ERROR)
+
+# As datas inválidas geradas de propósito caem na conversão genérica do pandas
+warnings.filterwarnings("ignore", message="Could not infer format")
+
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000, 1_000_000]
+
+# Cabeçalhos de cada formato de planilha aceito pelo dashboard
+CABECALHOS = {
+    # Cabeçalho da planilha dos formulários
+    "nomes": ["Recepção", "Timestamp", "Email", "Atendimento", "Recomendação", "Comentário"],
+    # Nomes alternativos reconhecidos (planilhas editadas à mão)
+    "nomes_alternativos": ["Recepção", "Data e hora", "E-mail", "Nota do atendimento", "Nota de recomendação", "Observações"],
+    # Cabeçalho não reconhecido: colunas lidas pela posição
+    "posicional": ["Coluna A", "Coluna B", "Coluna C", "Coluna D", "Coluna E", "Coluna F"],
+}
+
+RECEPCOES = ["Recepção Térreo", "Recepção 1º Andar", "Raio-X", "Tomografia", "Ressonância", "Laboratório"]
+
+FRASES_COMENTARIOS = [
+    "Atendimento excelente",
+    "a recepcionista foi muito atenciosa",
+    "demorou um pouco para chamar",
+    "sala de espera cheia, mas organizada",
+    'o médico explicou tudo "direitinho"',
+    "voltarei com certeza",
+    "o ar-condicionado estava muito frio",
+    "faltou informação sobre o resultado do exame",
+    "equipe educada e prestativa",
+    "estacionamento lotado;\nprecisei esperar",
+]
+
+# Formatos de data misturados na mesma planilha e a proporção de cada um
+FORMATOS_DATA = [
+    ("%d/%m/%Y %H:%M:%S", 0.90),
+    ("%d/%m/%Y %H:%M", 0.06),
+    ("%d/%m/%Y", 0.03),
+    ("%-d/%-m/%Y %H:%M:%S", 0.01),  # sem zeros à esquerda
+]
+
+# Distribuição das notas (0 a 10), concentrada nas notas altas como nos dados reais
+PESOS_NOTAS = np.array([2, 1, 1, 1, 2, 4, 5, 9, 16, 22, 37], dtype=float)
+
+def gerar_planilha(n_linhas, formato="nomes", semente=42, taxa_notas_ausentes=0.02,
+                   taxa_comentarios=0.3, taxa_datas_invalidas=0.001, anos=3):
+    """
+    Gera uma planilha sintética de avaliações, como sai da exportação CSV.
+
+    As linhas estão em ordem de envio (datas crescentes), com formatos de
+    data misturados, algumas datas inválidas, notas ausentes e comentários
+    longos com vírgulas, aspas e quebras de linha.
+
+    Args:
+        n_linhas: Número de linhas de dados
+        formato: Chave de CABECALHOS
+        semente: Semente do gerador (mesma semente, mesma planilha)
+
+    Returns:
+        DataFrame de textos (valores ausentes como NaN) com o cabeçalho do formato
+    """
+    rng = np.random.default_rng(semente)
+
+    # Datas: conjunto limitado de instantes distintos, em ordem crescente
+    n_distintas = min(n_linhas, 200_000)
+    inicio = pd.Timestamp(datetime.date.today()) - pd.DateOffset(years=anos)
+    segundos = np.sort(rng.integers(0, anos * 365 * 86400, n_distintas))
+    instantes = pd.Series(inicio + pd.to_timedelta(segundos, unit="s"))
+
+    formatos = rng.choice(len(FORMATOS_DATA), n_distintas, p=[p for _, p in FORMATOS_DATA])
+    textos_datas = np.empty(n_distintas, dtype=object)
+    for i, (formato_data, _) in enumerate(FORMATOS_DATA):
+        selecionadas = formatos == i
+        if formato_data.startswith("%-d"):
+            # strftime sem zeros à esquerda não é portátil; monta o texto direto
+            datas = instantes[selecionadas]
+            textos_datas[selecionadas] = [f"{d.day}/{d.month}/{d.year} {d:%H:%M:%S}" for d in datas]
+        else:
+            textos_datas[selecionadas] = instantes[selecionadas].dt.strftime(formato_data).to_numpy(dtype=object)
+
+    datas = textos_datas[np.sort(rng.integers(0, n_distintas, n_linhas))]
+    invalidas = rng.random(n_linhas) < taxa_datas_invalidas
+    datas[invalidas] = rng.choice(["ontem", "31/02/2024 10:00:00", "2024-13-01"], int(invalidas.sum()))
+
+    def notas():
+        valores = rng.choice(11, n_linhas, p=PESOS_NOTAS / PESOS_NOTAS.sum()).astype(str).astype(object)
+        valores[rng.random(n_linhas) < taxa_notas_ausentes] = np.nan
+        return valores
+
+    # Comentários: conjunto de textos de 1 a 8 frases, sorteados para as linhas com comentário
+    comentarios_possiveis = np.array([
+        ", ".join(rng.choice(FRASES_COMENTARIOS, rng.integers(1, 9)))
+        for _ in range(min(n_linhas, 5_000))
+    ], dtype=object)
+    comentarios = np.full(n_linhas, np.nan, dtype=object)
+    com_comentario = rng.random(n_linhas) < taxa_comentarios
+    comentarios[com_comentario] = comentarios_possiveis[rng.integers(0, len(comentarios_possiveis), int(com_comentario.sum()))]
+
+    valores = [
+        np.asarray(RECEPCOES, dtype=object)[rng.integers(0, len(RECEPCOES), n_linhas)],
+        datas,
+        np.full(n_linhas, np.nan, dtype=object),  # Email não é mais coletado
+        notas(),
+        notas(),
+        comentarios,
+    ]
+    return pd.DataFrame(dict(zip(CABECALHOS[formato], valores)))
+
+def planilha_para_csv(planilha):
+    return planilha.to_csv(index=False).encode("utf-8")
+
+# Servidor HTTP local que reproduz a exportação CSV do Google Sheets
+class ManipuladorExportacao(BaseHTTPRequestHandler):
+    """
+    Atende /spreadsheets/d/<id>/export?format=csv&gid=<gid>[&range=A<n>:F]
+    com as planilhas publicadas em self.server.planilhas. Com range, como no
+    Google, as linhas a partir de <n> vêm sem cabeçalho. Cada resposta leva um
+    ETag; com If-None-Match igual, a resposta é 304.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        correspondencia = re.match(r"^/spreadsheets/d/([^/]+)/export$", url.path)
+        planilha = self.server.planilhas.get(correspondencia.group(1)) if correspondencia else None
+        if planilha is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        intervalo = parse_qs(url.query).get("range", [""])[0]
+        linha_inicial = re.match(r"^A(\d+):", intervalo)
+        if linha_inicial:
+            # Linha 1 é o cabeçalho: a linha n da planilha é a linha de dados n - 2
+            corpo = planilha.iloc[int(linha_inicial.group(1)) - 2:].to_csv(index=False, header=False).encode("utf-8")
+        else:
+            corpo = self.server.csv[correspondencia.group(1)]
+
+        etag = '"' + hashlib.sha1(corpo).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/csv; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_exportacao_local():
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ManipuladorExportacao)
+    servidor.daemon_threads = True
+    servidor.planilhas = {}
+    servidor.csv = {}
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    # O dashboard passa a ler as planilhas públicas deste servidor
+    dashboard.URL_EXPORTACAO_PLANILHA = (
+        f"http://127.0.0.1:{servidor.server_port}/spreadsheets/d/{{sheet_id}}/export?format=csv&gid={{gid}}"
+    )
+    return servidor
+
+# Memória residente atual do processo, em bytes (None se não houver como medir)
+def memoria_residente():
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MedidorMemoria:
+    """Amostra a memória residente em segundo plano e guarda o pico"""
+
+    def __init__(self, intervalo=0.002):
+        self.intervalo = intervalo
+        self.inicial = memoria_residente()
+        self.pico = self.inicial
+        self.parar_evento = threading.Event()
+        self.thread = threading.Thread(target=self.amostrar, daemon=True)
+
+    def amostrar(self):
+        while not self.parar_evento.is_set():
+            atual = memoria_residente()
+            if atual is not None and atual > self.pico:
+                self.pico = atual
+            time.sleep(self.intervalo)
+
+    def __enter__(self):
+        if self.inicial is not None:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *excecao):
+        self.parar_evento.set()
+        if self.inicial is not None:
+            self.thread.join()
+            self.amostrar_final()
+
+    def amostrar_final(self):
+        atual = memoria_residente()
+        if atual is not None and atual > self.pico:
+            self.pico = atual
+
+    @property
+    def incremento_mb(self):
+        if self.inicial is None:
+            return None
+        return (self.pico - self.inicial) / 2**20
+
+def medir(etapa, funcao, repeticoes=1):
+    """
+    Executa uma etapa `repeticoes` vezes e retorna o resultado, o menor tempo
+    e o maior pico de memória (acréscimo sobre a memória no início da etapa).
+    """
+    tempos, picos, resultado = [], [], None
+    for _ in range(repeticoes):
+        resultado = None
+        with MedidorMemoria() as medidor:
+            inicio = time.perf_counter()
+            resultado = funcao()
+            tempos.append(time.perf_counter() - inicio)
+        picos.append(medidor.incremento_mb)
+
+    pico = None if any(p is None for p in picos) else max(picos)
+    return resultado, {"etapa": etapa, "segundos": min(tempos), "pico_memoria_mb": pico}
+
+def executar_pipeline(n_linhas, formato, semente, repeticoes, servidor=None):
+    """Mede cada etapa do pipeline para uma planilha sintética"""
+    medicoes = []
+
+    def etapa(nome, funcao):
+        resultado, medicao = medir(nome, funcao, repeticoes)
+        medicoes.append(medicao)
+        return resultado
+
+    planilha = gerar_planilha(n_linhas, formato, semente)
+    csv_bytes = planilha_para_csv(planilha)
+
+    bruto = etapa("leitura_csv", lambda: pd.read_csv(io.BytesIO(csv_bytes), dtype=str))
+    df = etapa("processar_dataframe", lambda: dashboard.processar_dataframe(bruto))
+    indice = etapa("construir_indice_temporal", lambda: dashboard.construir_indice_temporal(df))
+
+    ultimo_periodo = int(df['ano_mes'].dropna().astype(int).max())
+    etapa("filtrar_avaliacoes_periodo", lambda: dashboard.filtrar_avaliacoes(df, indice, ultimo_periodo))
+    etapa("filtrar_avaliacoes", lambda: dashboard.filtrar_avaliacoes(df, indice, ultimo_periodo, RECEPCOES[0]))
+    etapa("calcular_estatisticas_notas", lambda: dashboard.calcular_estatisticas_notas(df['atendimento'], df['recomendacao']))
+    etapa("calcular_distribuicao_notas", lambda: dashboard.calcular_distribuicao_notas(df))
+    cubo = etapa("calcular_cubo_agregados", lambda: dashboard.calcular_cubo_agregados(df))
+    etapa("estatisticas_do_cubo", lambda: dashboard.estatisticas_do_cubo(dashboard.filtrar_cubo(cubo, ultimo_periodo)))
+    etapa("calcular_evolucao_mensal", lambda: dashboard.calcular_evolucao_mensal(cubo))
+    etapa("calcular_tendencia_diaria", lambda: dashboard.calcular_tendencia_diaria(cubo))
+
+    if servidor is not None:
+        # Uma planilha por repetição: cada leitura completa começa sem estado de ingestão
+        contador = iter(range(repeticoes * 2))
+
+        def ler_completa():
+            sheet_id = f"bench-{formato}-{n_linhas}-{next(contador)}"
+            servidor.planilhas[sheet_id] = planilha
+            servidor.csv[sheet_id] = csv_bytes
+            ler_completa.sheet_id = sheet_id
+            return dashboard.ler_sheet_publico(f"https://docs.google.com/spreadsheets/d/{sheet_id}/edit")
+
+        etapa("ler_sheet_publico", ler_completa)
+
+        # Verificação incremental sem linhas novas (o caso de cada atualização automática)
+        url_incremental = f"https://docs.google.com/spreadsheets/d/{ler_completa.sheet_id}/edit"
+        etapa("ler_sheet_publico_incremental", lambda: dashboard.ler_sheet_publico(url_incremental))
+
+        # As planilhas do benchmark não ficam no cache HTTP em disco do dashboard
+        for sheet_id in list(servidor.planilhas):
+            for chave_cache in (f"{sheet_id}_0", f"{sheet_id}_0_intervalo"):
+                for caminho in dashboard.caminhos_cache_http(chave_cache):
+                    if os.path.exists(caminho):
+                        os.remove(caminho)
+            servidor.planilhas.pop(sheet_id)
+            servidor.csv.pop(sheet_id)
+
+    for medicao in medicoes:
+        medicao.update({"linhas": n_linhas, "formato": formato, "bytes_csv": len(csv_bytes)})
+    return medicoes
+
+def versao_do_codigo():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def comparar_resultados(atuais, anteriores, limite):
+    """
+    Compara os tempos com um arquivo de resultados anterior.
+
+    Returns:
+        Lista de textos, uma linha por etapa, e se houve regressão
+    """
+    referencia = {(r["linhas"], r["formato"], r["etapa"]): r for r in anteriores["resultados"]}
+    linhas, regressao = [], False
+    for r in atuais:
+        anterior = referencia.get((r["linhas"], r["formato"], r["etapa"]))
+        if anterior is None or anterior["segundos"] <= 0:
+            continue
+        razao = r["segundos"] / anterior["segundos"]
+        marcador = ""
+        # Etapas muito curtas oscilam demais para indicar regressão
+        if razao > limite and r["segundos"] > 0.005:
+            marcador = "  <-- mais lento"
+            regressao = True
+        linhas.append(f"{r['formato']:>18} {r['linhas']:>10} {r['etapa']:<30} {anterior['segundos']:>9.4f}s -> {r['segundos']:>9.4f}s ({razao:.2f}x){marcador}")
+    return linhas, regressao
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de dados do dashboard CEOP")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO, help="Números de linhas (padrão: 1k a 1M; 10M com --tamanhos 10000000)")
+    parser.add_argument("--formatos", nargs="+", choices=list(CABECALHOS), default=list(CABECALHOS), help="Formatos de planilha")
+    parser.add_argument("--semente", type=int, default=42, help="Semente do gerador de dados")
+    parser.add_argument("--repeticoes", type=int, default=None, help="Repetições por etapa (padrão: 5 até 10k linhas, 3 até 100k, 1 acima)")
+    parser.add_argument("--sem-http", action="store_true", help="Não mede a leitura das planilhas públicas pelo servidor local")
+    parser.add_argument("--saida", default=f"benchmark_{datetime.datetime.now():%Y%m%d_%H%M%S}.json", help="Arquivo JSON de resultados")
+    parser.add_argument("--comparar", help="Arquivo JSON de resultados anterior para comparação")
+    parser.add_argument("--limite", type=float, default=1.2, help="Razão de tempo a partir da qual uma etapa é considerada mais lenta")
+    args = parser.parse_args()
+
+    servidor = None if args.sem_http else iniciar_exportacao_local()
+
+    resultados = []
+    for n_linhas in args.tamanhos:
+        repeticoes = args.repeticoes or (5 if n_linhas <= 10_000 else 3 if n_linhas <= 100_000 else 1)
+        for formato in args.formatos:
+            print(f"{formato} - {n_linhas} linhas", flush=True)
+            for medicao in executar_pipeline(n_linhas, formato, args.semente, repeticoes, servidor):
+                pico = "-" if medicao["pico_memoria_mb"] is None else f"{medicao['pico_memoria_mb']:.1f} MB"
+                print(f"    {medicao['etapa']:<30} {medicao['segundos']:>9.4f}s  {pico:>10}", flush=True)
+                resultados.append(medicao)
+
+    relatorio = {
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": versao_do_codigo(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "versoes": {
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "pyarrow": dashboard.pa.__version__ if dashboard.PYARROW_AVAILABLE else None,
+        },
+        "semente": args.semente,
+        "resultados": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anteriores = json.load(f)
+        linhas, regressao = comparar_resultados(resultados, anteriores, args.limite)
+        print(f"\nComparação com {args.comparar} (commit {anteriores.get('commit')}):")
+        print("\n".join(linhas))
+        if regressao:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
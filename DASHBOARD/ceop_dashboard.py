@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
 import datetime
 import time
@@ -10,16 +11,36 @@ import os
 import sys
 from pathlib import Path
 import json
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+from dataclasses import dataclass, asdict
 import base64
 import requests
 import io
+import gzip
 import re
+import csv
+import hashlib
+import threading
+import shutil
+import uuid
+import asyncio
+import logging
+import functools
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as TempoEsgotadoFuturo
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Verifica se as bibliotecas opcionais estão disponíveis
 try:
     from google.oauth2.service_account import Credentials
     from google.oauth2 import service_account
+    from google.auth.transport.requests import Request as RequisicaoGoogle
     import gspread
     from gspread_pandas import Spread
     from gspread_dataframe import get_as_dataframe
@@ -33,6 +54,21 @@ try:
 except ImportError:
     STREAMLIT_GSHEETS_AVAILABLE = False
 
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pads
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
 # Configuração da página - DEVE ser o primeiro comando Streamlit
 st.set_page_config(
     page_title="Dashboard de Avaliações - CEOP",
@@ -40,6 +76,59 @@ st.set_page_config(
     layout="wide"
 )
 
+# Tempo limite padrão (segundos) para conectar e para ler a resposta das fontes online.
+# Podem ser ajustados por filial com "timeout_conexao" e "timeout_leitura" na configuração.
+TIMEOUT_CONEXAO_PADRAO = 5
+TIMEOUT_LEITURA_PADRAO = 30
+
+# Exportação CSV das planilhas públicas (o benchmark_pipeline.py a troca por um servidor local)
+URL_EXPORTACAO_PLANILHA = "https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
+
+# Metadados de um arquivo no Google Drive (revisão da planilha no modo gspread)
+URL_ARQUIVO_DRIVE = "https://www.googleapis.com/drive/v3/files/{file_id}"
+
+# Número máximo de filiais carregadas ao mesmo tempo em segundo plano
+MAX_CARREGAMENTOS_PARALELOS = 4
+
+# Validade (segundos) dos dados de uma filial em memória, por modo de conexão.
+# Pode ser ajustada com "ttl_por_modo" na configuração.
+TTL_PADRAO_POR_MODO = {"public": 30, "streamlit": 60, "gspread": 60, "file": 10, "servidor": 2}
+
+# Intervalo (segundos) entre as verificações do agendador de atualizações em segundo plano
+INTERVALO_AGENDADOR = 5
+
+# Intervalo (segundos) entre as atualizações do aviso exibido enquanto uma leitura é aguardada
+INTERVALO_AVISO_CARGA = 0.25
+
+# Porta padrão do servidor de ingestão local (formulários enviam as avaliações direto ao dashboard)
+PORTA_SERVIDOR_INGESTAO_PADRAO = 8502
+
+# Máximo de avaliações gravadas de uma só vez no registro local
+MAX_LOTE_GRAVACAO = 500
+
+# Intervalo padrão (segundos) entre os envios do registro local para o Google Sheets
+INTERVALO_ESPELHO_PADRAO = 15
+
+# Linhas lidas por chamada ao ler uma aba pelo gspread
+TAMANHO_BLOCO_GSPREAD = 5000
+
+# Leitura em fluxo das exportações CSV: bytes por leitura da resposta HTTP e
+# linhas por bloco processado (limita o pico de memória de planilhas grandes)
+TAMANHO_PEDACO_HTTP = 64 * 1024
+TAMANHO_BLOCO_CSV = 50000
+
+# Antecedência (segundos) com que o token de acesso do Google é renovado antes de expirar
+MARGEM_RENOVACAO_TOKEN = 300
+
+# Intervalo mínimo (segundos) entre duas atualizações manuais da mesma filial
+INTERVALO_MINIMO_ATUALIZACAO = 5
+
+# Medições de desempenho guardadas (as mais antigas são descartadas)
+HISTORICO_INSTRUMENTACAO = 1000
+
+# Memória máxima (MB) dos resultados de processamento memorizados
+LIMITE_MEMO_PROCESSAMENTO_MB = 512
+
 # Criar pasta para armazenar arquivos temporários e de configuração
 def setup_app_directories():
     """Configura os diretórios necessários para a aplicação"""
@@ -107,7 +196,8 @@ def carregar_configuracao_planilhas():
                 "connection_name": "gsheets_barcarena"
             }
         },
-        "modo_conexao": "public" # Opções: streamlit, gspread, file, public
+        "modo_conexao": "public", # Opções: streamlit, gspread, file, public
+        "pre_carregar_filiais": True # Carrega todas as filiais em segundo plano
     }
     
     # Verifica se o arquivo existe
@@ -147,35 +237,807 @@ def carregar_service_account():
     else:
         return None
 
+# Instrumentação: tempo, linhas, bytes e uso de cache de cada etapa do pipeline
+logger_desempenho = logging.getLogger("ceop_dashboard.desempenho")
+
+@st.cache_resource
+def obter_instrumentacao() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "historico": deque(maxlen=HISTORICO_INSTRUMENTACAO), "totais": {}}
+
+# Etapas em andamento na thread (a mais interna por último) e execução da página atual
+contexto_instrumentacao = threading.local()
+
+def etapas_em_andamento():
+    if not hasattr(contexto_instrumentacao, "pilha"):
+        contexto_instrumentacao.pilha = []
+    return contexto_instrumentacao.pilha
+
+def iniciar_execucao_instrumentada():
+    """Inicia uma execução da página; as etapas medidas nesta thread passam a ser associadas a ela"""
+    contexto_instrumentacao.execucao = uuid.uuid4().hex[:8]
+    return contexto_instrumentacao.execucao
+
+def registrar_medicao(medicao):
+    instrumentacao = obter_instrumentacao()
+    with instrumentacao["lock"]:
+        instrumentacao["historico"].append(medicao)
+        totais = instrumentacao["totais"].setdefault(medicao["etapa"], {
+            "execucoes": 0, "segundos": 0.0, "linhas": 0, "bytes": 0, "cache": {}, "ultima_duracao": 0.0
+        })
+        totais["execucoes"] += 1
+        totais["segundos"] += medicao["segundos"]
+        totais["linhas"] += medicao.get("linhas") or 0
+        totais["bytes"] += medicao.get("bytes") or 0
+        totais["ultima_duracao"] = medicao["segundos"]
+        if medicao.get("cache"):
+            totais["cache"][medicao["cache"]] = totais["cache"].get(medicao["cache"], 0) + 1
+    
+    # Log estruturado (uma linha JSON por etapa), quando habilitado
+    if logger_desempenho.isEnabledFor(logging.INFO):
+        logger_desempenho.info(json.dumps(medicao, ensure_ascii=False, default=str))
+
+@contextlib.contextmanager
+def medir_etapa(etapa, **campos):
+    """
+    Mede o tempo de um bloco como uma etapa do pipeline. O dicionário
+    retornado (ou anotar_etapa, em funções chamadas dentro do bloco) recebe
+    dados extras: linhas, bytes, cache ("acerto", "falha"...), filial...
+    """
+    medicao = {
+        "etapa": etapa,
+        "inicio": time.time(),
+        "execucao": getattr(contexto_instrumentacao, "execucao", None),
+        "thread": threading.current_thread().name,
+        **campos
+    }
+    pilha = etapas_em_andamento()
+    pilha.append(medicao)
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    finally:
+        medicao["segundos"] = time.perf_counter() - inicio
+        pilha.pop()
+        registrar_medicao(medicao)
+
+# Registra uma etapa medida sem bloco with (trechos longos da página)
+def registrar_tempo_etapa(etapa, inicio, **campos):
+    registrar_medicao({
+        "etapa": etapa,
+        "inicio": time.time() - (time.perf_counter() - inicio),
+        "execucao": getattr(contexto_instrumentacao, "execucao", None),
+        "thread": threading.current_thread().name,
+        "segundos": time.perf_counter() - inicio,
+        **campos
+    })
+
+# Acrescenta dados à etapa em andamento mais interna desta thread
+def anotar_etapa(**campos):
+    pilha = etapas_em_andamento()
+    if pilha:
+        pilha[-1].update(campos)
+
+def instrumentar(etapa):
+    """Decorador que mede cada chamada da função; linhas = tamanho do DataFrame retornado"""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def funcao_medida(*args, **kwargs):
+            with medir_etapa(etapa) as medicao:
+                resultado = funcao(*args, **kwargs)
+                dados = resultado[0] if isinstance(resultado, tuple) and resultado else resultado
+                if isinstance(dados, (pd.DataFrame, pd.Series)) and "linhas" not in medicao:
+                    medicao["linhas"] = len(dados)
+                return resultado
+        return funcao_medida
+    return decorador
+
+# Resumo do histórico de medições por etapa
+def resumo_instrumentacao(medicoes):
+    if not medicoes:
+        return pd.DataFrame()
+    
+    historico = pd.DataFrame(medicoes)
+    for coluna in ["linhas", "bytes", "cache"]:
+        if coluna not in historico.columns:
+            historico[coluna] = None
+    
+    por_etapa = historico.groupby("etapa", sort=False)
+    resumo = pd.DataFrame({
+        "Execuções": por_etapa.size(),
+        "Média (ms)": por_etapa["segundos"].mean() * 1000,
+        "p95 (ms)": por_etapa["segundos"].quantile(0.95) * 1000,
+        "Linhas": por_etapa["linhas"].sum(min_count=1),
+        "MB baixados": por_etapa["bytes"].sum(min_count=1) / 2**20,
+        "Acertos de cache (%)": por_etapa["cache"].apply(
+            lambda cache: (cache == "acerto").sum() / cache.notna().sum() * 100 if cache.notna().any() else None
+        )
+    })
+    return resumo.sort_values("Média (ms)", ascending=False).reset_index()
+
+# Métricas de desempenho no formato de texto do Prometheus
+def texto_prometheus():
+    instrumentacao = obter_instrumentacao()
+    with instrumentacao["lock"]:
+        totais = {etapa: dict(valores, cache=dict(valores["cache"])) for etapa, valores in instrumentacao["totais"].items()}
+    
+    metricas = [
+        ("ceop_etapa_execucoes_total", "counter", "Execuções de cada etapa do pipeline", "execucoes"),
+        ("ceop_etapa_segundos_total", "counter", "Tempo total gasto em cada etapa", "segundos"),
+        ("ceop_etapa_linhas_total", "counter", "Linhas processadas por cada etapa", "linhas"),
+        ("ceop_etapa_bytes_total", "counter", "Bytes baixados por cada etapa", "bytes"),
+        ("ceop_etapa_ultima_duracao_segundos", "gauge", "Duração da última execução de cada etapa", "ultima_duracao"),
+    ]
+    linhas = []
+    for nome, tipo, descricao, campo in metricas:
+        linhas += [f"# HELP {nome} {descricao}", f"# TYPE {nome} {tipo}"]
+        linhas += [f'{nome}{{etapa="{etapa}"}} {valores[campo]}' for etapa, valores in totais.items()]
+    
+    linhas += ["# HELP ceop_etapa_cache_total Consultas ao cache por etapa e resultado", "# TYPE ceop_etapa_cache_total counter"]
+    for etapa, valores in totais.items():
+        linhas += [f'ceop_etapa_cache_total{{etapa="{etapa}",resultado="{resultado}"}} {n}' for resultado, n in valores["cache"].items()]
+    
+    return "\n".join(linhas) + "\n"
+
+# Grava o log estruturado de desempenho em um arquivo (uma linha JSON por etapa)
+@st.cache_resource
+def configurar_log_desempenho(caminho: str) -> logging.Handler:
+    manipulador = logging.FileHandler(caminho, encoding="utf-8")
+    manipulador.setFormatter(logging.Formatter("%(message)s"))
+    logger_desempenho.addHandler(manipulador)
+    logger_desempenho.setLevel(logging.INFO)
+    logger_desempenho.propagate = False
+    return manipulador
+
+def exibir_diagnostico(execucao_anterior):
+    """Mostra as etapas da execução anterior da página e o resumo do histórico"""
+    instrumentacao = obter_instrumentacao()
+    with instrumentacao["lock"]:
+        medicoes = list(instrumentacao["historico"])
+    
+    with st.sidebar.expander("🩺 Diagnóstico de desempenho"):
+        etapas = [m for m in medicoes if execucao_anterior and m.get("execucao") == execucao_anterior]
+        if etapas:
+            st.markdown("**Execução anterior desta página**")
+            st.dataframe(pd.DataFrame([{
+                "Etapa": m["etapa"],
+                "ms": round(m["segundos"] * 1000, 1),
+                "Linhas": m.get("linhas"),
+                "Bytes": m.get("bytes"),
+                "Cache": m.get("cache")
+            } for m in etapas]), hide_index=True)
+        
+        resumo = resumo_instrumentacao(medicoes)
+        if not resumo.empty:
+            st.markdown(f"**Últimas {len(medicoes)} medições (todas as sessões e tarefas em segundo plano)**")
+            st.dataframe(resumo.round(1), hide_index=True)
+        else:
+            st.caption("Nenhuma medição ainda.")
+
+# Sessão HTTP compartilhada (reaproveita conexões e refaz requisições com backoff)
+@st.cache_resource
+def obter_sessao_http() -> requests.Session:
+    retentativas = Retry(
+        total=3,
+        connect=3,
+        read=2,
+        backoff_factor=0.5,  # 0,5 s, 1 s, 2 s entre as tentativas
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False
+    )
+    adaptador = HTTPAdapter(
+        pool_connections=MAX_CARREGAMENTOS_PARALELOS,
+        pool_maxsize=MAX_CARREGAMENTOS_PARALELOS * 2,
+        max_retries=retentativas
+    )
+    
+    sessao = requests.Session()
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    return sessao
+
+# Tempos limite (conexão, leitura) de uma filial
+def obter_timeout(filial_config=None) -> Tuple[float, float]:
+    filial_config = filial_config or {}
+    return (
+        float(filial_config.get("timeout_conexao", TIMEOUT_CONEXAO_PADRAO)),
+        float(filial_config.get("timeout_leitura", TIMEOUT_LEITURA_PADRAO))
+    )
+
+# Carregador em segundo plano compartilhado entre as sessões
+@st.cache_resource
+def obter_carregador_filiais() -> Dict[str, Any]:
+    return {
+        "executor": ThreadPoolExecutor(max_workers=MAX_CARREGAMENTOS_PARALELOS, thread_name_prefix="ceop-carga"),
+        "lock": threading.Lock(),
+        "tarefas": {}
+    }
+
+# Laço assíncrono das leituras das fontes, em uma thread própria (um por processo)
+@st.cache_resource
+def obter_laco_fontes() -> Dict[str, Any]:
+    laco = asyncio.new_event_loop()
+    threading.Thread(target=laco.run_forever, name="ceop-fontes", daemon=True).start()
+    return {
+        "laco": laco,
+        # Leituras bloqueantes (gspread, arquivos, processamento) rodam fora do laço
+        "executor": ThreadPoolExecutor(max_workers=MAX_CARREGAMENTOS_PARALELOS, thread_name_prefix="ceop-leitura"),
+        "cliente_http": None  # httpx.AsyncClient, criado dentro do laço
+    }
+
+def preparar_leitura_na_sessao(funcao, *args):
+    """
+    Prepara, sem iniciar, uma thread com o contexto da sessão atual do
+    Streamlit, para que as mensagens de erro da leitura apareçam na tela de
+    quem a pediu.
+    
+    Returns:
+        Tupla (Future com o resultado, função que inicia a thread e devolve
+        esse Future), ou None fora da thread de uma sessão (API, tarefas em
+        segundo plano). Enquanto a thread não começa a ler, o Future pode ser
+        cancelado; depois, a leitura vai até o fim.
+    """
+    contexto = get_script_run_ctx(suppress_warning=True)
+    if contexto is None:
+        return None
+    
+    futuro = Future()
+    execucao = getattr(contexto_instrumentacao, "execucao", None)
+    
+    def executar():
+        # Leitura cancelada antes de começar
+        if not futuro.set_running_or_notify_cancel():
+            return
+        contexto_instrumentacao.execucao = execucao
+        try:
+            futuro.set_result(funcao(*args))
+        except Exception as e:
+            futuro.set_exception(e)
+    
+    thread = add_script_run_ctx(threading.Thread(target=executar, name="ceop-leitura-sessao", daemon=True), contexto)
+    
+    def iniciar():
+        thread.start()
+        return futuro
+    return futuro, iniciar
+
+async def ler_fonte_assincrona(filial_config, modo_conexao, iniciar_leitura=None):
+    """
+    Interface comum de leitura de uma filial, para todos os modos de conexão.
+    
+    No modo de planilhas públicas, com o httpx instalado, a verificação de
+    linhas novas é feita no próprio laço, sem ocupar uma thread; se nada
+    mudou, os dados memorizados são devolvidos. As demais leituras
+    (gspread, Streamlit Sheets, arquivos locais, servidor local e o
+    processamento) são bloqueantes e rodam fora do laço: na thread preparada
+    por preparar_leitura_na_sessao, quando informada, ou no executor.
+    
+    Returns:
+        Dicionário com "df", "versao" e "cubo"
+    """
+    if modo_conexao == "public" and HTTPX_AVAILABLE:
+        try:
+            dados = await verificar_planilha_publica(filial_config)
+        except httpx.HTTPError:
+            # A leitura normal (com novas tentativas e mensagens de erro) decide
+            dados = None
+        if dados is not None:
+            return dados
+    
+    if iniciar_leitura is not None:
+        return await asyncio.wrap_future(iniciar_leitura())
+    
+    laco = asyncio.get_running_loop()
+    return await laco.run_in_executor(obter_laco_fontes()["executor"], buscar_dados_filial, filial_config, modo_conexao)
+
+def aquecer_cache_filiais(filiais, intervalo_minimo=30):
+    """
+    Agenda em segundo plano a leitura de todas as filiais configuradas, para
+    que a troca de filial no seletor encontre os dados já em cache.
+    
+    Cada filial é agendada no máximo uma vez a cada intervalo_minimo
+    segundos e nunca enquanto uma leitura anterior ainda está em andamento.
+    
+    Args:
+        filiais: Dicionário {nome da filial: configuração}
+        intervalo_minimo: Tempo mínimo (segundos) entre duas leituras da mesma filial
+    """
+    carregador = obter_carregador_filiais()
+    agora = time.time()
+    
+    with carregador["lock"]:
+        for nome, filial_config in filiais.items():
+            tarefa = carregador["tarefas"].get(nome)
+            if tarefa is not None:
+                futuro, agendado_em = tarefa
+                if not futuro.done() or agora - agendado_em < intervalo_minimo:
+                    continue
+            
+            futuro = carregador["executor"].submit(carregar_cubo_agregados, filial_config)
+            carregador["tarefas"][nome] = (futuro, agora)
+
+# Resultados do processamento memorizados pela impressão da fonte (LRU limitado pela memória)
+@st.cache_resource
+def obter_memo_processamento() -> Dict[str, Any]:
+    # O limite (em bytes) é atualizado pela página a partir da configuração já carregada
+    return {"lock": threading.Lock(), "entradas": OrderedDict(), "bytes": 0, "limite": LIMITE_MEMO_PROCESSAMENTO_MB * 2**20}
+
+# Ajusta o limite de memória do memo de processamento (limite_memo_processamento_mb)
+def definir_limite_memo_processamento(config):
+    memo = obter_memo_processamento()
+    memo["limite"] = float(config.get("limite_memo_processamento_mb", LIMITE_MEMO_PROCESSAMENTO_MB)) * 2**20
+
+# Memória ocupada por um resultado (DataFrame normalizado e cubo)
+def tamanho_dados_processados(dados):
+    total = int(dados["df"].memory_usage(deep=True).sum())
+    if isinstance(dados.get("cubo"), pd.DataFrame):
+        total += int(dados["cubo"].memory_usage(deep=True).sum())
+    return total
+
+def consultar_memo_processamento(impressao):
+    """Retorna o resultado guardado para a impressão da fonte ({"df", "versao", "cubo"}) ou None"""
+    memo = obter_memo_processamento()
+    with memo["lock"]:
+        entrada = memo["entradas"].get(impressao)
+        if entrada is not None:
+            memo["entradas"].move_to_end(impressao)
+    anotar_etapa(cache="acerto" if entrada is not None else "falha")
+    return entrada["dados"] if entrada is not None else None
+
+def guardar_memo_processamento(fonte, impressao, dados):
+    """
+    Guarda o resultado do processamento de uma fonte. Cada fonte (filial e
+    modo de conexão) tem no máximo uma entrada; quando a memória passa do
+    limite, as fontes usadas há mais tempo são descartadas.
+    """
+    tamanho = tamanho_dados_processados(dados)
+    
+    memo = obter_memo_processamento()
+    with memo["lock"]:
+        limite = memo["limite"]
+        for chave in [c for c, entrada in memo["entradas"].items() if entrada["fonte"] == fonte]:
+            memo["bytes"] -= memo["entradas"].pop(chave)["bytes"]
+        if tamanho > limite:
+            return
+        
+        memo["entradas"][impressao] = {"fonte": fonte, "dados": dados, "bytes": tamanho}
+        memo["bytes"] += tamanho
+        while memo["bytes"] > limite:
+            _, antiga = memo["entradas"].popitem(last=False)
+            memo["bytes"] -= antiga["bytes"]
+
+# Impressão de um arquivo (data de modificação e tamanho) ou de uma pasta (todos os arquivos)
+def impressao_caminho(caminho):
+    if os.path.isfile(caminho):
+        info = os.stat(caminho)
+        return f"{info.st_mtime_ns}-{info.st_size}"
+    if os.path.isdir(caminho):
+        arquivos = []
+        for pasta, _, nomes in os.walk(caminho):
+            for nome in nomes:
+                info = os.stat(os.path.join(pasta, nome))
+                arquivos.append((os.path.relpath(os.path.join(pasta, nome), caminho), info.st_mtime_ns, info.st_size))
+        return hashlib.sha1(repr(sorted(arquivos)).encode('utf-8')).hexdigest()[:16]
+    return ""
+
+# Impressão do conteúdo bruto lido da fonte (antes do processamento)
+def impressao_dataframe_bruto(df_original):
+    hashes = pd.util.hash_pandas_object(df_original, index=False).to_numpy()
+    conteudo = hashlib.sha1(repr(list(df_original.columns)).encode('utf-8'))
+    conteudo.update(hashes.tobytes())
+    return f"{len(df_original)}-{conteudo.hexdigest()[:16]}"
+
+def impressao_fonte(filial_config, modo_conexao):
+    """
+    Impressão da fonte obtida sem ler os dados: data de modificação e
+    tamanho dos arquivos locais ou revisão da planilha no Google Drive (modo
+    gspread). Retorna None quando a fonte não oferece uma impressão barata;
+    nesse caso os leitores informam a impressão em df.attrs['impressao_fonte'].
+    """
+    if modo_conexao == "file":
+        nome_filial = filial_config.get("connection_name", "")
+        dirs = setup_app_directories()
+        origem = (impressao_caminho(os.path.join(dirs["data_dir"], f"{nome_filial}.csv")) or
+                  impressao_caminho(os.path.join(dirs["data_dir"], f"{nome_filial}.xlsx")))
+        colunar = impressao_caminho(caminho_armazenamento_colunar(nome_filial)) if PYARROW_AVAILABLE else ""
+        return f"arquivo:{nome_filial}:{origem}|{colunar}"
+    
+    if modo_conexao == "gspread" and GOOGLE_LIBRARIES_AVAILABLE:
+        try:
+            revisao = revisao_planilha_gspread(filial_config.get("sheet_id", ""))
+        except Exception:
+            return None
+        return f"gspread:{filial_config.get('sheet_id', '')}:{filial_config.get('sheet_name', '')}:r{revisao}"
+    
+    return None
+
+# Processa os dados brutos, reaproveitando o resultado anterior se o conteúdo não mudou
+def processar_com_memo(df_original, chave_fonte):
+    impressao = f"{chave_fonte}:{impressao_dataframe_bruto(df_original)}"
+    dados = consultar_memo_processamento(impressao)
+    if dados is not None:
+        return dados["df"]
+    
+    df = processar_dataframe(df_original, chave_fonte)
+    df.attrs['impressao_fonte'] = impressao
+    return df
+
+# Mensagens das leituras em andamento, por thread (ver avisar_leitura)
+mensagens_leitura = threading.local()
+
+def avisar_leitura(tipo, texto):
+    """
+    Mensagem de uma leitura ("error", "warning" ou "info"). Durante
+    buscar_dados_filial ela é guardada e devolvida junto com os dados, pois a
+    leitura costuma rodar em uma thread sem sessão do Streamlit, onde
+    st.error e st.warning são descartados; fora dela é exibida na hora.
+    """
+    pendentes = getattr(mensagens_leitura, "pendentes", None)
+    if pendentes is not None:
+        pendentes.append((tipo, texto))
+    else:
+        getattr(st, tipo)(texto)
+
+@contextlib.contextmanager
+def coletar_avisos_leitura():
+    anteriores = getattr(mensagens_leitura, "pendentes", None)
+    mensagens_leitura.pendentes = []
+    try:
+        yield mensagens_leitura.pendentes
+    finally:
+        mensagens_leitura.pendentes = anteriores
+
 # Função para ler dados do Google Sheets usando diferentes métodos
-@st.cache_data(ttl=30)  # Cache por 30 segundos
-def ler_dados_google_sheets(filial_config: Dict[str, Any]) -> pd.DataFrame:
+@instrumentar("carga_filial")
+def buscar_dados_filial(filial_config: Dict[str, Any], modo_conexao: str) -> Dict[str, Any]:
     """
-    Lê dados do Google Sheets usando diferentes métodos.
+    Lê os dados de uma filial na fonte configurada. Use obter_dados_filial,
+    que evita leituras repetidas.
+    
+    Se a impressão da fonte (arquivo, revisão ou hash do conteúdo lido) for a
+    mesma de uma leitura anterior, o DataFrame normalizado, a versão e o cubo
+    dessa leitura são reaproveitados, sem novo processamento.
     
     Args:
         filial_config: Configurações da filial selecionada
+        modo_conexao: Modo de conexão em uso
     
     Returns:
-        DataFrame com os dados da planilha
+        Dicionário com o DataFrame ("df"), a versão dos dados ("versao"), o
+        cubo de agregados ("cubo") e as mensagens da leitura ("avisos", pares
+        (tipo, texto) exibidos pela página)
     """
-    config = carregar_configuracao_planilhas()
-    modo_conexao = config.get("modo_conexao", "file")
+    with coletar_avisos_leitura() as avisos:
+        dados = ler_dados_filial_na_fonte(filial_config, modo_conexao)
+    return dict(dados, avisos=tuple(avisos))
+
+def ler_dados_filial_na_fonte(filial_config, modo_conexao):
+    """Lê e processa os dados da filial (ou os obtém do memo); ver buscar_dados_filial"""
+    anotar_etapa(filial=filial_config.get("connection_name", ""), modo=modo_conexao)
+    
+    # Fonte inalterada desde a última leitura: nem lê os dados
+    fonte = chave_dados_filial(filial_config, modo_conexao)
+    impressao = impressao_fonte(filial_config, modo_conexao)
+    if impressao is not None:
+        dados = consultar_memo_processamento(impressao)
+        if dados is not None:
+            anotar_etapa(linhas=len(dados["df"]))
+            return dados
     
     # Tenta ler usando o método configurado
     if modo_conexao == "streamlit" and STREAMLIT_GSHEETS_AVAILABLE:
-        return ler_com_streamlit_gsheets(filial_config.get("connection_name", ""))
+        df = ler_com_streamlit_gsheets(filial_config.get("connection_name", ""))
     elif modo_conexao == "gspread" and GOOGLE_LIBRARIES_AVAILABLE:
-        return ler_com_gspread(filial_config.get("sheet_id", ""), filial_config.get("sheet_name", ""))
+        df = ler_com_gspread(filial_config.get("sheet_id", ""), filial_config.get("sheet_name", ""))
     elif modo_conexao == "file":
-        return ler_de_arquivo_local(filial_config.get("connection_name", ""))
+        df = ler_de_arquivo_local(filial_config.get("connection_name", ""))
     elif modo_conexao == "public":
-        return ler_sheet_publico(filial_config.get("sheet_url", ""), filial_config.get("sheet_gid", 0))
+        df = ler_sheet_publico(
+            filial_config.get("sheet_url", ""),
+            filial_config.get("sheet_gid", 0),
+            filial_config.get("connection_name", ""),
+            obter_timeout(filial_config)
+        )
+    elif modo_conexao == "servidor":
+        df = ler_do_servidor_local(filial_config.get("connection_name", ""))
     else:
-        st.error("Método de conexão não disponível ou não configurado corretamente")
-        return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+        avisar_leitura("error", "Método de conexão não disponível ou não configurado corretamente")
+        df = pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+    
+    if modo_conexao == "file" and impressao is not None:
+        # A leitura pode ter gravado o armazenamento colunar; vale a impressão
+        # de depois da leitura, se o arquivo de origem não mudou nesse meio tempo
+        depois = impressao_fonte(filial_config, modo_conexao)
+        impressao = depois if depois.split("|")[0] == impressao.split("|")[0] else None
+    elif impressao is None:
+        # Leitores que só conhecem a impressão depois de ler (hash do conteúdo, estado da ingestão)
+        impressao = df.attrs.get('impressao_fonte')
+        dados = consultar_memo_processamento(impressao) if impressao else None
+        if dados is not None:
+            anotar_etapa(linhas=len(dados["df"]))
+            return dados
+    
+    # Versão dos dados: índices derivados só são reconstruídos quando ela muda
+    df.attrs['versao'] = calcular_versao_dados(df)
+    
+    # No modo de planilhas públicas o cubo é mantido incrementalmente pela ingestão
+    cubo = None
+    if modo_conexao == "public":
+        sheet_id = extrair_id_sheet_da_url(filial_config.get("sheet_url", ""))
+        chave = f"{sheet_id}:{filial_config.get('sheet_gid', 0)}"
+        estado = obter_estado_ingestao()["planilhas"].get(chave)
+        if estado is not None and "cubo" in estado:
+            cubo = estado["cubo"]
+    elif modo_conexao == "servidor":
+        estado = obter_registro_avaliacoes()["filiais"].get(filial_config.get("connection_name", ""))
+        if estado is not None:
+            cubo = estado["cubo"]
+    if cubo is None:
+        cubo = calcular_cubo_agregados(df)
+    
+    anotar_etapa(linhas=len(df))
+    dados = {"df": df, "versao": df.attrs['versao'], "cubo": cubo}
+    if impressao and not df.empty:
+        guardar_memo_processamento(fonte, impressao, dados)
+    return dados
+
+# Gerenciador de dados compartilhado entre todas as sessões do processo
+@st.cache_resource
+def obter_gerenciador_dados() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "entradas": {}}
+
+# Validade dos dados em memória para o modo de conexão
+def obter_ttl(modo_conexao, config=None) -> float:
+    ttl_por_modo = dict(TTL_PADRAO_POR_MODO)
+    ttl_por_modo.update((config or {}).get("ttl_por_modo", {}))
+    return float(ttl_por_modo.get(modo_conexao, 30))
+
+async def executar_carga_filial(entrada, filial_config, modo_conexao, futuro, iniciar_leitura=None):
+    """Lê a filial no laço assíncrono e publica o resultado na entrada do gerenciador"""
+    gerenciador = obter_gerenciador_dados()
+    try:
+        dados = await ler_fonte_assincrona(filial_config, modo_conexao, iniciar_leitura)
+    except asyncio.CancelledError:
+        with gerenciador["lock"]:
+            if entrada["carregando"] is futuro:
+                entrada["carregando"] = None
+        futuro.cancel()
+        raise
+    except Exception as e:
+        dados = None
+        erro = e
+    
+    with gerenciador["lock"]:
+        if entrada["carregando"] is futuro:
+            entrada["carregando"] = None
+        entrada["carregado_em"] = time.time()
+        
+        # Falha ou leitura vazia com dados anteriores: continua servindo os
+        # dados anteriores até a próxima tentativa (após o ttl), com as
+        # mensagens da leitura que falhou
+        if dados is None or (dados["df"].empty and entrada.get("dados") is not None and not entrada["dados"]["df"].empty):
+            entrada["falhas"] = entrada.get("falhas", 0) + 1
+            if entrada.get("dados") is not None:
+                avisos = dados["avisos"] if dados is not None else (("error", f"Erro ao ler os dados da filial: {erro}"),)
+                entrada["dados"] = dict(entrada["dados"], avisos=avisos)
+        else:
+            entrada["dados"] = dados
+            entrada["falhas"] = 0
+    
+    # A leitura pode ter sido cancelada depois de concluída
+    if futuro.cancelled():
+        return
+    if dados is None and entrada.get("dados") is None:
+        futuro.set_exception(erro)
+    else:
+        futuro.set_result(entrada["dados"])
+
+def iniciar_carga_filial(entrada, filial_config, modo_conexao, na_sessao=False):
+    """
+    Agenda a leitura de uma filial no laço assíncrono (chamar com o lock do
+    gerenciador). Com na_sessao=True, a leitura roda com o contexto da sessão
+    atual e pode ser cancelada quando ninguém mais a aguarda, se ainda não
+    começou a ler a fonte.
+    
+    Returns:
+        Future com o resultado, compartilhado por quem aguarda a leitura
+    """
+    futuro = Future()
+    leitura = preparar_leitura_na_sessao(buscar_dados_filial, filial_config, modo_conexao) if na_sessao else None
+    entrada["leitura"], iniciar_leitura = leitura if leitura is not None else (None, None)
+    entrada["carregando"] = futuro
+    # Só a leitura na thread da sessão pode ser cancelada antes de começar;
+    # a do executor não tem como ser interrompida
+    entrada["cancelavel"] = leitura is not None
+    entrada["tarefa"] = asyncio.run_coroutine_threadsafe(
+        executar_carga_filial(entrada, filial_config, modo_conexao, futuro, iniciar_leitura),
+        obter_laco_fontes()["laco"]
+    )
+    return futuro
+
+def aguardar_carga_filial(entrada, futuro):
+    """
+    Aguarda a leitura de uma filial. Na thread de uma sessão, a espera é
+    feita em intervalos curtos, atualizando um aviso na tela: assim o
+    Streamlit consegue interrompê-la quando o usuário troca de filial.
+    
+    Se ninguém mais aguarda, a leitura é cancelada apenas se ainda não
+    começou a ler a fonte (verificação assíncrona ou thread por iniciar).
+    Uma leitura já em andamento não tem como ser interrompida: a entrada
+    continua marcada como carregando até ela terminar e publicar o
+    resultado, e quem voltar à filial aguarda essa mesma leitura.
+    """
+    gerenciador = obter_gerenciador_dados()
+    with gerenciador["lock"]:
+        entrada["interessados"] = entrada.get("interessados", 0) + 1
+    
+    na_sessao = get_script_run_ctx(suppress_warning=True) is not None
+    aviso = None
+    inicio = time.time()
+    try:
+        while True:
+            try:
+                return futuro.result(timeout=INTERVALO_AVISO_CARGA if na_sessao else None)
+            except TempoEsgotadoFuturo:
+                if aviso is None:
+                    aviso = st.empty()
+                aviso.caption(f"⏳ Lendo os dados da fonte... {time.time() - inicio:.0f} s")
+    finally:
+        with gerenciador["lock"]:
+            entrada["interessados"] -= 1
+            if (entrada["interessados"] == 0 and entrada.get("cancelavel") and
+                    entrada["carregando"] is futuro and not futuro.done() and entrada["leitura"].cancel()):
+                # Ninguém mais aguarda e a fonte ainda não começou a ser lida:
+                # a próxima consulta inicia uma nova leitura
+                entrada["carregando"] = None
+                entrada["tarefa"].cancel()
+                futuro.cancel()
+        if aviso is not None:
+            aviso.empty()
+
+async def agendador_atualizacoes():
+    """
+    Atualiza em segundo plano, a cada ttl do modo de conexão, as filiais já
+    carregadas, independentemente das páginas abertas (a API de métricas e as
+    telas encontram os dados sempre recentes).
+    """
+    while True:
+        try:
+            config = carregar_configuracao_planilhas()
+            if config.get("atualizacao_em_segundo_plano", True):
+                modo_conexao = config.get("modo_conexao", "file")
+                ttl = obter_ttl(modo_conexao, config)
+                configuradas = [chave_dados_filial(filial_config, modo_conexao) for filial_config in config.get("filiais", {}).values()]
+                
+                gerenciador = obter_gerenciador_dados()
+                agora = time.time()
+                with gerenciador["lock"]:
+                    for chave in configuradas:
+                        entrada = gerenciador["entradas"].get(chave)
+                        if (entrada is not None and entrada["dados"] is not None and
+                                entrada["carregando"] is None and agora - entrada["carregado_em"] >= ttl):
+                            iniciar_carga_filial(entrada, entrada["filial_config"], modo_conexao)
+        except Exception:
+            # Uma falha (configuração inválida, por exemplo) não interrompe o agendador
+            pass
+        await asyncio.sleep(INTERVALO_AGENDADOR)
+
+# Agendador de atualizações, iniciado uma única vez por processo
+@st.cache_resource
+def iniciar_agendador_atualizacoes():
+    return asyncio.run_coroutine_threadsafe(agendador_atualizacoes(), obter_laco_fontes()["laco"])
+
+# Chave de uma filial no gerenciador de dados
+def chave_dados_filial(filial_config, modo_conexao):
+    return f"{modo_conexao}:{json.dumps(filial_config, sort_keys=True, default=str)}"
+
+# Dados da filial já carregados no gerenciador, sem disparar uma leitura
+def obter_dados_em_memoria(filial_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    modo_conexao = carregar_configuracao_planilhas().get("modo_conexao", "file")
+    gerenciador = obter_gerenciador_dados()
+    with gerenciador["lock"]:
+        entrada = gerenciador["entradas"].get(chave_dados_filial(filial_config, modo_conexao))
+        return entrada["dados"] if entrada is not None else None
+
+@instrumentar("dados_filial")
+def obter_dados_filial(filial_config: Dict[str, Any], forcar: bool = False) -> Dict[str, Any]:
+    """
+    Retorna os dados da filial a partir do gerenciador compartilhado.
+    
+    - Leitura única: sessões que pedem a mesma filial ao mesmo tempo aguardam
+      a mesma leitura da fonte.
+    - Dados vencidos (mais antigos que o ttl do modo de conexão) continuam
+      sendo servidos enquanto uma nova leitura roda em segundo plano.
+    - forcar=True aguarda uma leitura nova da filial (botão "Atualizar agora"),
+      sem afetar as demais filiais.
+    - As leituras rodam no laço assíncrono das fontes (ler_fonte_assincrona);
+      uma leitura pedida por uma sessão é cancelada se o usuário troca de
+      filial antes de ela começar a ler a fonte e ninguém mais a aguarda.
+    
+    Args:
+        filial_config: Configurações da filial
+        forcar: Ignora a validade e aguarda uma nova leitura
+    
+    Returns:
+        Dicionário com "df", "versao" e "cubo"
+    """
+    config = carregar_configuracao_planilhas()
+    modo_conexao = config.get("modo_conexao", "file")
+    chave = chave_dados_filial(filial_config, modo_conexao)
+    
+    gerenciador = obter_gerenciador_dados()
+    agora = time.time()
+    
+    with gerenciador["lock"]:
+        entrada = gerenciador["entradas"].setdefault(chave, {
+            "dados": None, "carregado_em": 0.0, "carregando": None, "filial_config": dict(filial_config)
+        })
+        idade = agora - entrada["carregado_em"]
+        
+        if entrada["dados"] is not None and not forcar:
+            if idade >= obter_ttl(modo_conexao, config) and entrada["carregando"] is None:
+                # Serve os dados vencidos e atualiza em segundo plano
+                iniciar_carga_filial(entrada, filial_config, modo_conexao)
+                anotar_etapa(cache="vencido")
+            else:
+                anotar_etapa(cache="acerto")
+            return entrada["dados"]
+        
+        if forcar and entrada["dados"] is not None and idade < INTERVALO_MINIMO_ATUALIZACAO:
+            anotar_etapa(cache="acerto")
+            return entrada["dados"]
+        
+        futuro = entrada["carregando"]
+        if futuro is None:
+            # Primeira leitura (ou atualização manual): feita com o contexto desta
+            # sessão, para que mensagens de erro da fonte apareçam na tela
+            futuro = iniciar_carga_filial(entrada, filial_config, modo_conexao, na_sessao=True)
+            anotar_etapa(cache="falha")
+        else:
+            # Outra sessão já está lendo a filial
+            anotar_etapa(cache="espera")
+    
+    return aguardar_carga_filial(entrada, futuro)
+
+def ler_dados_google_sheets(filial_config: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Lê dados do Google Sheets usando diferentes métodos.
+    
+    Args:
+        filial_config: Configurações da filial selecionada
+    
+    Returns:
+        DataFrame com os dados da planilha, com a versão dos dados em
+        df.attrs['versao']. O DataFrame é compartilhado entre as sessões e
+        não deve ser alterado.
+    """
+    return obter_dados_filial(filial_config)["df"]
+
+# Calcula uma versão (hash do conteúdo) para um DataFrame normalizado
+def calcular_versao_dados(df):
+    if df.empty:
+        return "vazio"
+    colunas = [c for c in ['recepcao', 'timestamp', 'atendimento', 'recomendacao'] if c in df.columns]
+    hashes = pd.util.hash_pandas_object(df[colunas], index=False).to_numpy()
+    return f"{len(df)}-{hashlib.sha1(hashes.tobytes()).hexdigest()[:16]}"
+
+# Função para obter o cubo de agregados de uma filial
+def carregar_cubo_agregados(filial_config: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Retorna o cubo de agregados da filial. No modo de planilhas públicas o
+    cubo é mantido incrementalmente pela ingestão; nos demais modos é
+    calculado a partir dos dados lidos.
+    
+    Args:
+        filial_config: Configurações da filial selecionada
+    
+    Returns:
+        Cubo de agregados indexado por (recepcao, ano_mes, hora)
+    """
+    return obter_dados_filial(filial_config)["cubo"]
 
 # Método 1: Usando streamlit_gsheets
+@instrumentar("leitura_streamlit_gsheets")
 def ler_com_streamlit_gsheets(nome_conexao):
     try:
         # Conexão com o Google Sheets
@@ -184,63 +1046,437 @@ def ler_com_streamlit_gsheets(nome_conexao):
         # Leitura da planilha
         df_original = conn.read()
         
-        return processar_dataframe(df_original)
+        return processar_com_memo(df_original, f"streamlit:{nome_conexao}")
         
     except Exception as e:
-        st.error(f"Erro ao ler dados do Google Sheets (Streamlit): {e}")
+        avisar_leitura("error", f"Erro ao ler dados do Google Sheets (Streamlit): {e}")
         return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
 
 # Método 2: Usando gspread diretamente
-def ler_com_gspread(sheet_id, sheet_name):
-    try:
-        # Verifica se as credenciais foram carregadas
-        info_credencial = carregar_service_account()
-        if not info_credencial:
-            st.error("Credenciais do Google não encontradas")
-            return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
-        
-        # Configura as credenciais
-        credentials = service_account.Credentials.from_service_account_info(
-            info_credencial,
-            scopes=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        )
-        client = gspread.authorize(credentials)
-        
+# Clientes gspread e abas abertas, compartilhados entre as sessões
+@st.cache_resource
+def obter_pool_gspread() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "credencial": None, "clientes": {}, "abas": {}}
+
+# Credenciais do Service Account, relidas do disco só quando o arquivo muda
+def carregar_service_account_em_cache():
+    dirs = setup_app_directories()
+    creds_file = os.path.join(dirs["config_dir"], "credentials.json")
+    modificado_em = os.path.getmtime(creds_file) if os.path.exists(creds_file) else None
+    
+    pool = obter_pool_gspread()
+    with pool["lock"]:
+        if pool["credencial"] is None or pool["credencial"][0] != modificado_em:
+            pool["credencial"] = (modificado_em, carregar_service_account() if modificado_em else None)
+        return pool["credencial"][1]
+
+# Renova o token de acesso antes que ele expire (evita a renovação no meio de uma leitura)
+def renovar_token_gspread(cliente):
+    credenciais = cliente["credenciais"]
+    with cliente["lock"]:
+        agora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if (not credenciais.token or credenciais.expiry is None or
+                (credenciais.expiry - agora).total_seconds() < MARGEM_RENOVACAO_TOKEN):
+            credenciais.refresh(RequisicaoGoogle(obter_sessao_http()))
+
+def obter_cliente_gspread():
+    """
+    Retorna o cliente gspread autorizado da conta de serviço atual, criado uma
+    única vez por conta e com o token renovado antecipadamente.
+    
+    Returns:
+        Tupla (chave da conta de serviço, cliente gspread)
+    """
+    info_credencial = carregar_service_account_em_cache()
+    if not info_credencial:
+        raise ValueError("Credenciais do Google não encontradas")
+    
+    chave = f"{info_credencial.get('client_email', '')}:{info_credencial.get('private_key_id', '')}"
+    pool = obter_pool_gspread()
+    
+    with pool["lock"]:
+        cliente = pool["clientes"].get(chave)
+        if cliente is None:
+            # Configura as credenciais
+            credenciais = service_account.Credentials.from_service_account_info(
+                info_credencial,
+                scopes=['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+            )
+            cliente = {"gspread": gspread.authorize(credenciais), "credenciais": credenciais, "lock": threading.Lock()}
+            pool["clientes"][chave] = cliente
+    
+    renovar_token_gspread(cliente)
+    return chave, cliente["gspread"]
+
+# Abre a aba de uma planilha com as credenciais do Google Service Account
+def abrir_aba_gspread(sheet_id, sheet_name):
+    chave_cliente, client = obter_cliente_gspread()
+    chave = (chave_cliente, sheet_id, sheet_name)
+    pool = obter_pool_gspread()
+    
+    with pool["lock"]:
+        worksheet = pool["abas"].get(chave)
+    
+    if worksheet is None:
         # Abre a planilha
         sh = client.open_by_key(sheet_id)
         worksheet = sh.worksheet(sheet_name) if sheet_name else sh.sheet1
+        with pool["lock"]:
+            pool["abas"][chave] = worksheet
+    
+    return worksheet
+
+# Revisão da planilha no Google Drive (muda a cada edição), sem ler os valores
+def revisao_planilha_gspread(sheet_id):
+    chave_cliente, _ = obter_cliente_gspread()
+    credenciais = obter_pool_gspread()["clientes"][chave_cliente]["credenciais"]
+    response = obter_sessao_http().get(
+        URL_ARQUIVO_DRIVE.format(file_id=sheet_id),
+        params={"fields": "version,modifiedTime", "supportsAllDrives": "true"},
+        headers={"Authorization": f"Bearer {credenciais.token}"},
+        timeout=obter_timeout()
+    )
+    response.raise_for_status()
+    metadados = response.json()
+    return metadados.get("version") or metadados["modifiedTime"]
+
+# Descarta a aba em cache após um erro (a próxima leitura abre de novo)
+def descartar_aba_gspread(sheet_id, sheet_name):
+    pool = obter_pool_gspread()
+    with pool["lock"]:
+        for chave in [c for c in pool["abas"] if c[1:] == (sheet_id, sheet_name)]:
+            del pool["abas"][chave]
+
+def ler_aba_em_blocos(worksheet, tamanho_bloco=TAMANHO_BLOCO_GSPREAD):
+    """
+    Lê todos os valores de uma aba em blocos de linhas (get_values por
+    intervalo), convertendo cada bloco para DataFrame de texto à medida que
+    chega, sem montar a lista de dicionários do get_all_records.
+    
+    A leitura vai até a última linha da grade da aba (row_count): o
+    get_values omite as linhas vazias no fim do intervalo, então um bloco
+    curto não indica o fim dos dados.
+    
+    Args:
+        worksheet: Aba do gspread
+        tamanho_bloco: Número de linhas por chamada
         
-        # Obter todos os valores
-        df_original = pd.DataFrame(worksheet.get_all_records())
+    Returns:
+        DataFrame com as colunas do cabeçalho (linha 1) e valores em texto
+    """
+    cabecalho = worksheet.row_values(1)
+    if not cabecalho:
+        return pd.DataFrame()
+    
+    ultima_coluna = letra_coluna(len(cabecalho))
+    ultima_linha = worksheet.row_count
+    blocos = []
+    inicio = 2
+    
+    while inicio <= ultima_linha:
+        fim = min(inicio + tamanho_bloco - 1, ultima_linha)
+        valores = worksheet.get_values(f"A{inicio}:{ultima_coluna}{fim}")
         
-        return processar_dataframe(df_original)
+        if valores:
+            bloco = pd.DataFrame(valores, dtype=str)
+            bloco.columns = cabecalho[:bloco.shape[1]]
+            blocos.append(bloco.replace("", np.nan))
+        inicio = fim + 1
     
-    except Exception as e:
-        st.error(f"Erro ao ler dados do Google Sheets (gspread): {e}")
-        return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+    if not blocos:
+        return pd.DataFrame(columns=cabecalho)
+    
+    return pd.concat(blocos, ignore_index=True).reindex(columns=cabecalho)
 
-# Método 3: Leitura de arquivo local CSV ou Excel
-def ler_de_arquivo_local(nome_filial):
+@instrumentar("leitura_gspread")
+def ler_com_gspread(sheet_id, sheet_name):
     try:
-        dirs = setup_app_directories()
-        data_dir = dirs["data_dir"]
+        if not carregar_service_account_em_cache():
+            avisar_leitura("error", "Credenciais do Google não encontradas")
+            return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
         
-        # Tenta encontrar arquivos CSV ou Excel na pasta de dados
-        csv_path = os.path.join(data_dir, f"{nome_filial}.csv")
-        excel_path = os.path.join(data_dir, f"{nome_filial}.xlsx")
+        worksheet = abrir_aba_gspread(sheet_id, sheet_name)
         
-        if os.path.exists(csv_path):
-            df_original = pd.read_csv(csv_path)
+        # Obter todos os valores, em blocos
+        df_original = ler_aba_em_blocos(worksheet)
+        
+        return processar_com_memo(df_original, f"gspread:{sheet_id}:{sheet_name}")
+    
+    except Exception as e:
+        descartar_aba_gspread(sheet_id, sheet_name)
+        avisar_leitura("error", f"Erro ao ler dados do Google Sheets (gspread): {e}")
+        return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+
+# Nomes dos meses em português, indexados por (mês - 1)
+MESES_PT = [
+    'Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+    'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro'
+]
+MESES_PT_ABREV = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+# Chave inteira de período (AAAAMM), usada na coluna ano_mes
+def chave_periodo(ano, mes):
+    return ano * 100 + mes
+
+# Rótulo em português de uma chave de período ("Outubro/2025" ou "Out/25")
+def rotulo_periodo(chave, abreviado=False):
+    ano, mes = divmod(int(chave), 100)
+    if abreviado:
+        return f"{MESES_PT_ABREV[mes - 1]}/{ano % 100:02d}"
+    return f"{MESES_PT[mes - 1]}/{ano}"
+
+# Colunas do DataFrame normalizado, na ordem gerada por processar_dataframe
+COLUNAS_NORMALIZADAS = ['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario', 'timestamp_invalido', 'mes_nome', 'ano_mes']
+
+# Colunas categóricas do DataFrame normalizado (poucos valores distintos)
+COLUNAS_CATEGORICAS = ['recepcao', 'timestamp_invalido', 'mes_nome', 'ano_mes']
+
+# Texto dos comentários: coluna Arrow quando o pyarrow está disponível
+TIPO_TEXTO_COMPACTO = 'string[pyarrow]' if PYARROW_AVAILABLE else 'string'
+
+# Tipos das colunas de notas compactadas
+TIPOS_NOTAS = ('Int8', 'float32')
+
+# Converte notas para inteiros pequenos (Int8) quando todas são inteiras e cabem
+# nesse tipo; senão usa float32, que guarda notas fracionárias e fora da faixa
+# sem alterá-las (continuam contando como inválidas na distribuição)
+def compactar_notas(notas):
+    valores = pd.to_numeric(notas, errors='coerce')
+    presentes = valores.dropna()
+    if ((presentes % 1 == 0) & presentes.between(-128, 127)).all():
+        return valores.astype('Int8')
+    return pd.Series(valores.to_numpy(dtype='float32', na_value=np.nan), index=valores.index, name=valores.name)
+
+# Aplica os tipos compactos às colunas de um DataFrame normalizado
+def compactar_avaliacoes(df):
+    """
+    Converte as colunas de um DataFrame normalizado para os tipos compactos:
+    recepção, data inválida e período como categorias, notas como Int8 (ou
+    float32, se houver notas não inteiras) e comentários como texto Arrow.
+    Colunas já compactas não são copiadas.
+    """
+    for coluna in ['recepcao', 'timestamp_invalido']:
+        if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype('string').astype('category')
+    for coluna in ['atendimento', 'recomendacao']:
+        if coluna in df.columns and str(df[coluna].dtype) not in TIPOS_NOTAS:
+            df[coluna] = compactar_notas(df[coluna])
+    if 'comentario' in df.columns and df['comentario'].dtype != TIPO_TEXTO_COMPACTO:
+        df['comentario'] = df['comentario'].astype(TIPO_TEXTO_COMPACTO)
+    if 'mes_nome' in df.columns and not isinstance(df['mes_nome'].dtype, pd.CategoricalDtype):
+        df['mes_nome'] = pd.Categorical(df['mes_nome'], categories=MESES_PT)
+    if 'ano_mes' in df.columns and not isinstance(df['ano_mes'].dtype, pd.CategoricalDtype):
+        df['ano_mes'] = df['ano_mes'].astype('Int32').astype('category')
+    return df
+
+# Memória ocupada por coluna de um DataFrame normalizado
+def relatorio_memoria(df):
+    uso = df.memory_usage(index=False, deep=True)
+    return pd.DataFrame({
+        'Coluna': uso.index,
+        'Tipo': [str(df[coluna].dtype) for coluna in uso.index],
+        'MB': uso.to_numpy() / 2**20,
+        'Bytes por linha': uso.to_numpy() / max(len(df), 1)
+    })
+
+# Concatena DataFrames normalizados mantendo as colunas categóricas
+def concatenar_avaliacoes(frames):
+    """
+    Concatena DataFrames normalizados. As categorias de cada coluna são
+    unificadas antes, para que o resultado continue categórico (pd.concat
+    volta para object quando as categorias diferem).
+    """
+    nao_vazios = [f for f in frames if not f.empty]
+    if len(nao_vazios) <= 1:
+        if nao_vazios:
+            return nao_vazios[0]
+        return frames[0] if frames else pd.DataFrame(columns=COLUNAS_NORMALIZADAS)
+    
+    frames = [f.copy(deep=False) for f in nao_vazios]
+    for coluna in COLUNAS_CATEGORICAS:
+        if not all(coluna in f.columns and isinstance(f[coluna].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        categorias = union_categoricals([f[coluna].array for f in frames], ignore_order=True).categories
+        for f in frames:
+            f[coluna] = f[coluna].cat.set_categories(categorias)
+    resultado = pd.concat(frames, ignore_index=True)
+    
+    # Int8 com float32 resulta em Float32: volta ao tipo compacto
+    for coluna in ['atendimento', 'recomendacao']:
+        if coluna in resultado.columns and str(resultado[coluna].dtype) not in TIPOS_NOTAS:
+            resultado[coluna] = compactar_notas(resultado[coluna])
+    return resultado
+
+# Caminho do armazenamento colunar (Parquet particionado por ano_mes) de uma filial
+def caminho_armazenamento_colunar(nome_filial):
+    dirs = setup_app_directories()
+    return os.path.join(dirs["data_dir"], f"{nome_filial}.parquet")
+
+def existe_armazenamento_colunar(nome_filial):
+    return PYARROW_AVAILABLE and bool(nome_filial) and os.path.isdir(caminho_armazenamento_colunar(nome_filial))
+
+def particionamento_armazenamento():
+    return pads.partitioning(pa.schema([('ano_mes', pa.int32())]), flavor='hive')
+
+def escrever_particoes(df, caminho):
+    """
+    Escreve um DataFrame normalizado em arquivos Parquet particionados por
+    ano_mes. Arquivos existentes são preservados, o que permite anexar.
+    
+    As notas são gravadas sempre como float32, para que todos os arquivos
+    tenham o mesmo tipo; na leitura voltam a ser Int8 quando são inteiras.
+    """
+    df = df.reindex(columns=COLUNAS_NORMALIZADAS)
+    df['recepcao'] = df['recepcao'].astype('string')
+    df['atendimento'] = notas_para_array(df['atendimento']).astype('float32')
+    df['recomendacao'] = notas_para_array(df['recomendacao']).astype('float32')
+    df['comentario'] = df['comentario'].astype('string')
+    df['timestamp_invalido'] = df['timestamp_invalido'].astype('string')
+    df['mes_nome'] = df['mes_nome'].astype('string')
+    df['ano_mes'] = df['ano_mes'].astype('Int32')
+    
+    tabela = pa.Table.from_pandas(df, preserve_index=False)
+    pads.write_dataset(
+        tabela,
+        caminho,
+        format="parquet",
+        partitioning=particionamento_armazenamento(),
+        existing_data_behavior="overwrite_or_ignore",
+        basename_template=f"parte-{uuid.uuid4().hex}-{{i}}.parquet"
+    )
+
+# Salva (substituindo) os dados normalizados de uma filial no armazenamento colunar
+def salvar_armazenamento_colunar(df, nome_filial, estado=None):
+    """
+    Grava os dados normalizados de uma filial no armazenamento colunar,
+    substituindo o conteúdo anterior de forma atômica.
+    
+    Args:
+        df: DataFrame gerado por processar_dataframe
+        nome_filial: Nome da conexão/arquivo da filial
+        estado: Metadados opcionais da ingestão incremental a persistir junto
+    """
+    caminho = caminho_armazenamento_colunar(nome_filial)
+    caminho_temp = f"{caminho}.tmp-{uuid.uuid4().hex}"
+    
+    escrever_particoes(df, caminho_temp)
+    if estado is not None:
+        salvar_estado_armazenamento(caminho_temp, estado)
+    
+    # Troca o diretório antigo pelo novo para que leitores nunca vejam dados parciais
+    caminho_antigo = None
+    if os.path.exists(caminho):
+        caminho_antigo = f"{caminho}.old-{uuid.uuid4().hex}"
+        os.replace(caminho, caminho_antigo)
+    os.replace(caminho_temp, caminho)
+    if caminho_antigo:
+        shutil.rmtree(caminho_antigo, ignore_errors=True)
+
+# Anexa novas linhas normalizadas ao armazenamento colunar de uma filial
+def anexar_armazenamento_colunar(df, nome_filial, estado=None):
+    caminho = caminho_armazenamento_colunar(nome_filial)
+    if not df.empty:
+        escrever_particoes(df, caminho)
+    if estado is not None:
+        salvar_estado_armazenamento(caminho, estado)
+
+# Lê os dados normalizados de uma filial do armazenamento colunar
+def ler_armazenamento_colunar(nome_filial):
+    """
+    Lê os dados de uma filial do armazenamento colunar usando memory map.
+    
+    Args:
+        nome_filial: Nome da conexão/arquivo da filial
+        
+    Returns:
+        DataFrame no mesmo formato de processar_dataframe
+    """
+    caminho = caminho_armazenamento_colunar(nome_filial)
+    
+    # Armazenamentos antigos gravaram as notas como int8: lê tudo como float32
+    # (sem os metadados do pandas, que restaurariam o tipo do primeiro arquivo)
+    esquema = pads.dataset(caminho, format="parquet", partitioning=particionamento_armazenamento()).schema.remove_metadata()
+    for coluna in ['atendimento', 'recomendacao']:
+        indice = esquema.get_field_index(coluna)
+        if indice >= 0:
+            esquema = esquema.set(indice, pa.field(coluna, pa.float32()))
+    
+    tabela = pq.read_table(
+        caminho,
+        schema=esquema,
+        partitioning=particionamento_armazenamento(),
+        memory_map=True
+    )
+    # Armazenamentos antigos ainda têm as colunas ano e mes, descartadas aqui
+    df = tabela.to_pandas().reindex(columns=COLUNAS_NORMALIZADAS)
+    
+    # As notas gravadas em float32 voltam a ser Int8 quando todas são inteiras
+    # (compactar_avaliacoes mantém as colunas que já estão em float32)
+    df['atendimento'] = compactar_notas(df['atendimento'])
+    df['recomendacao'] = compactar_notas(df['recomendacao'])
+    df = compactar_avaliacoes(df)
+    
+    # As partições são lidas em ordem de diretório; restaura a ordem por data
+    return ordenar_por_timestamp(df)
+
+# Metadados da ingestão incremental guardados junto ao armazenamento
+def salvar_estado_armazenamento(caminho, estado):
+    # Arquivos iniciados com "_" são ignorados pelo leitor de Parquet
+    with open(os.path.join(caminho, "_estado_ingestao.json"), 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False)
+
+def ler_estado_armazenamento(nome_filial):
+    arquivo = os.path.join(caminho_armazenamento_colunar(nome_filial), "_estado_ingestao.json")
+    if not os.path.exists(arquivo):
+        return None
+    with open(arquivo, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# Método 3: Leitura de arquivo local CSV ou Excel
+@instrumentar("leitura_arquivo_local")
+def ler_de_arquivo_local(nome_filial):
+    try:
+        dirs = setup_app_directories()
+        data_dir = dirs["data_dir"]
+        
+        # Tenta encontrar arquivos CSV ou Excel na pasta de dados
+        csv_path = os.path.join(data_dir, f"{nome_filial}.csv")
+        excel_path = os.path.join(data_dir, f"{nome_filial}.xlsx")
+        
+        if os.path.exists(csv_path):
+            origem_path = csv_path
         elif os.path.exists(excel_path):
+            origem_path = excel_path
+        else:
+            origem_path = None
+        
+        # Usa o armazenamento colunar se ele for mais recente que o arquivo de origem
+        if existe_armazenamento_colunar(nome_filial):
+            caminho_colunar = caminho_armazenamento_colunar(nome_filial)
+            if origem_path is None or os.path.getmtime(caminho_colunar) >= os.path.getmtime(origem_path):
+                return ler_armazenamento_colunar(nome_filial)
+        
+        if origem_path == csv_path:
+            df_original = pd.read_csv(csv_path)
+        elif origem_path == excel_path:
             df_original = pd.read_excel(excel_path)
         else:
-            st.warning(f"Arquivo de dados para {nome_filial} não encontrado.")
+            avisar_leitura("warning", f"Arquivo de dados para {nome_filial} não encontrado.")
             return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
         
-        return processar_dataframe(df_original)
+        df = processar_dataframe(df_original, f"arquivo:{nome_filial}")
+        
+        # Converte para o armazenamento colunar para que as próximas leituras sejam imediatas
+        if PYARROW_AVAILABLE and not df.empty:
+            try:
+                salvar_armazenamento_colunar(df, nome_filial)
+            except Exception as e:
+                avisar_leitura("warning", f"Não foi possível gravar o armazenamento colunar: {e}")
+        
+        return df
     
     except Exception as e:
-        st.error(f"Erro ao ler dados do arquivo local: {e}")
+        avisar_leitura("error", f"Erro ao ler dados do arquivo local: {e}")
         return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
 
 # Função para extrair ID da planilha a partir da URL
@@ -275,14 +1511,420 @@ def extrair_id_sheet_da_url(url):
         
     return None
 
+# Estado da ingestão incremental das planilhas públicas
+@st.cache_resource
+def obter_estado_ingestao() -> Dict[str, Any]:
+    """
+    Retorna o estado compartilhado da ingestão incremental, mantido entre
+    sessões e reruns enquanto o processo do Streamlit estiver ativo.
+    
+    Para cada planilha (chave "sheet_id:gid") guarda o cabeçalho, o número de
+    linhas já lidas, os bytes recebidos, o hash da última linha, o
+    DataFrame normalizado acumulado e o cubo de agregados correspondente.
+    O lock global protege apenas os dicionários; cada planilha tem o seu
+    (ver obter_lock_planilha).
+    """
+    return {"lock": threading.Lock(), "locks": {}, "planilhas": {}}
+
+# Lock de uma planilha na ingestão incremental
+def obter_lock_planilha(chave):
+    """
+    Retorna o lock da planilha indicada (chave "sheet_id:gid"), criado na
+    primeira chamada. Ele protege apenas a leitura e a atualização do estado
+    da planilha, nunca a requisição HTTP, para que planilhas diferentes sejam
+    lidas em paralelo.
+    """
+    estado_ingestao = obter_estado_ingestao()
+    with estado_ingestao["lock"]:
+        return estado_ingestao["locks"].setdefault(chave, threading.Lock())
+
+# Calcula o hash de uma linha da planilha para detectar alterações na cauda
+def calcular_hash_linha(valores):
+    """
+    Gera um hash estável para os valores de uma linha.
+    
+    Args:
+        valores: Sequência com os valores (texto) da linha
+        
+    Returns:
+        Hash SHA-1 em hexadecimal
+    """
+    texto = "\x1f".join("" if pd.isna(v) else str(v) for v in valores)
+    return hashlib.sha1(texto.encode('utf-8')).hexdigest()
+
+# Converte o número de uma coluna (1 = A) para a letra usada em intervalos A1
+def letra_coluna(numero):
+    letras = ""
+    while numero > 0:
+        numero, resto = divmod(numero - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+# Cache em disco das exportações CSV: corpo (gzip) e validadores da última resposta
+@st.cache_resource
+def obter_lock_cache_http() -> threading.Lock:
+    return threading.Lock()
+
+def caminhos_cache_http(chave_cache):
+    """Caminhos (metadados, corpo) de uma entrada do cache, por exemplo "<sheet_id>_<gid>"""
+    dirs = setup_app_directories()
+    pasta = os.path.join(dirs["data_dir"], "cache_http")
+    os.makedirs(pasta, exist_ok=True)
+    nome = re.sub(r'[^A-Za-z0-9_-]', '_', chave_cache)
+    return os.path.join(pasta, f"{nome}.json"), os.path.join(pasta, f"{nome}.csv.gz")
+
+def ler_cache_http(chave_cache, url):
+    """
+    Retorna os metadados da última resposta guardada (url, etag,
+    last_modified, hash...), ou None se não houver corpo guardado para a URL
+    """
+    caminho_metadados, caminho_corpo = caminhos_cache_http(chave_cache)
+    with obter_lock_cache_http():
+        try:
+            with open(caminho_metadados, encoding='utf-8') as f:
+                metadados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if metadados.get("url") != url or not os.path.exists(caminho_corpo):
+            return None
+        return metadados
+
+def ler_corpo_cache_http(chave_cache):
+    with gzip.open(caminhos_cache_http(chave_cache)[1], 'rb') as arquivo:
+        return arquivo.read()
+
+def atualizar_cache_http(chave_cache, **campos):
+    """Acrescenta campos aos metadados guardados (gravação atômica)"""
+    caminho_metadados = caminhos_cache_http(chave_cache)[0]
+    with obter_lock_cache_http():
+        try:
+            with open(caminho_metadados, encoding='utf-8') as f:
+                metadados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        metadados.update(campos)
+        temporario = f"{caminho_metadados}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(metadados, f)
+        os.replace(temporario, caminho_metadados)
+        return metadados
+
+# Cabeçalhos de uma requisição condicional a partir da última resposta guardada
+def cabecalhos_condicionais(metadados):
+    cabecalhos = {"Accept-Encoding": "gzip"}
+    if metadados:
+        if metadados.get("etag"):
+            cabecalhos["If-None-Match"] = metadados["etag"]
+        if metadados.get("last_modified"):
+            cabecalhos["If-Modified-Since"] = metadados["last_modified"]
+    return cabecalhos
+
+class GravadorCacheHttp:
+    """
+    Copia o corpo de uma resposta para o cache em disco enquanto ele é lido,
+    calculando o hash do conteúdo. O corpo e os metadados só substituem a
+    entrada anterior em concluir().
+    """
+    
+    def __init__(self, chave_cache, url, response):
+        self.chave_cache = chave_cache
+        self.caminho_metadados, self.caminho_corpo = caminhos_cache_http(chave_cache)
+        self.temporario = f"{self.caminho_corpo}.{uuid.uuid4().hex[:8]}.tmp"
+        self.arquivo = gzip.open(self.temporario, 'wb', compresslevel=1)
+        self.hash = hashlib.sha1()
+        self.metadados = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+    
+    def copiar(self, pedacos):
+        for pedaco in pedacos:
+            self.arquivo.write(pedaco)
+            self.hash.update(pedaco)
+            yield pedaco
+    
+    def concluir(self, **campos):
+        self.arquivo.close()
+        metadados = dict(self.metadados, hash=self.hash.hexdigest(), atualizado_em=time.time(), **campos)
+        temporario_metadados = f"{self.caminho_metadados}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(temporario_metadados, 'w', encoding='utf-8') as f:
+            json.dump(metadados, f)
+        with obter_lock_cache_http():
+            os.replace(self.temporario, self.caminho_corpo)
+            os.replace(temporario_metadados, self.caminho_metadados)
+        return metadados
+    
+    def descartar(self):
+        self.arquivo.close()
+        if os.path.exists(self.temporario):
+            os.remove(self.temporario)
+
+@dataclass(frozen=True)
+class RespostaExportacao:
+    """Resultado de uma requisição condicional à exportação CSV"""
+    status: int
+    conteudo: Optional[bytes]         # None quando inalterado (304): ver ler_corpo_cache_http
+    inalterado: bool                  # 304 ou mesmo hash da última resposta guardada
+    metadados: Optional[Dict[str, Any]]
+
+def baixar_exportacao(url, chave_cache, timeout=None):
+    """
+    Baixa uma exportação CSV com requisição condicional (If-None-Match /
+    If-Modified-Since) e guarda o corpo e os validadores em disco.
+    
+    Se o servidor responder 304, ou se o corpo tiver o mesmo hash do que está
+    guardado, a resposta é marcada como inalterada e o chamador pode
+    reaproveitar o que já calculou a partir dela.
+    """
+    metadados = ler_cache_http(chave_cache, url)
+    response = obter_sessao_http().get(
+        url, timeout=timeout or obter_timeout(), headers=cabecalhos_condicionais(metadados)
+    )
+    
+    if response.status_code == 304 and metadados:
+        return RespostaExportacao(200, None, True, metadados)
+    if response.status_code != 200:
+        return RespostaExportacao(response.status_code, None, False, metadados)
+    
+    if metadados and metadados.get("hash") == hashlib.sha1(response.content).hexdigest():
+        # Mesmo conteúdo; só os validadores podem ter mudado
+        validadores = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        if any(metadados.get(campo) != valor for campo, valor in validadores.items()):
+            metadados = atualizar_cache_http(chave_cache, **validadores) or metadados
+        return RespostaExportacao(200, response.content, True, metadados)
+    
+    gravador = GravadorCacheHttp(chave_cache, url, response)
+    try:
+        for _ in gravador.copiar([response.content]):
+            pass
+        metadados = gravador.concluir()
+    except Exception:
+        gravador.descartar()
+        raise
+    return RespostaExportacao(200, response.content, False, metadados)
+
+# URL do intervalo que começa na última linha conhecida e sua chave no cache em disco
+def url_linhas_novas(sheet_id, sheet_gid, estado):
+    # Linha 1 é o cabeçalho, então a última linha de dados conhecida é n + 1
+    linha_inicial = estado["n_linhas"] + 1
+    intervalo = f"A{linha_inicial}:{letra_coluna(len(estado['colunas']))}"
+    csv_url = URL_EXPORTACAO_PLANILHA.format(sheet_id=sheet_id, gid=sheet_gid) + f"&range={intervalo}"
+    return csv_url, f"{sheet_id}_{sheet_gid}_intervalo"
+
+# Cliente httpx do laço das fontes (reaproveita as conexões entre as verificações)
+def obter_cliente_http_assincrono():
+    fontes = obter_laco_fontes()
+    if fontes["cliente_http"] is None:
+        fontes["cliente_http"] = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=MAX_CARREGAMENTOS_PARALELOS * 2)
+        )
+    return fontes["cliente_http"]
+
+async def verificar_planilha_publica(filial_config):
+    """
+    Verifica no laço assíncrono (httpx) se uma planilha pública já lida tem
+    linhas novas, com a mesma requisição condicional de buscar_linhas_novas.
+    
+    Returns:
+        Os dados memorizados da planilha, se o intervalo depois da última
+        linha conhecida não mudou (304 ou mesmo hash); None se é preciso ler
+        a planilha (primeira leitura, linhas novas, edição ou leitura em andamento)
+    """
+    sheet_id = extrair_id_sheet_da_url(filial_config.get("sheet_url", ""))
+    if not sheet_id:
+        return None
+    sheet_gid = filial_config.get("sheet_gid", 0)
+    chave = f"{sheet_id}:{sheet_gid}"
+    
+    # Não espera pelo lock: se o estado desta planilha está sendo atualizado, a leitura segue fora do laço
+    estado_ingestao = obter_estado_ingestao()
+    lock_planilha = obter_lock_planilha(chave)
+    if not lock_planilha.acquire(blocking=False):
+        return None
+    try:
+        estado = estado_ingestao["planilhas"].get(chave)
+        if estado is None:
+            return None
+        hash_cauda = estado["hash_cauda"]
+        impressao = f"publico:{chave}:{estado['n_linhas']}:{hash_cauda}"
+        csv_url, chave_cache = url_linhas_novas(sheet_id, sheet_gid, estado)
+    finally:
+        lock_planilha.release()
+    
+    dados = consultar_memo_processamento(impressao)
+    metadados = ler_cache_http(chave_cache, csv_url)
+    if dados is None or metadados is None or metadados.get("hash_cauda") != hash_cauda:
+        return None
+    
+    inicio = time.perf_counter()
+    conexao, leitura = obter_timeout(filial_config)
+    response = await obter_cliente_http_assincrono().get(
+        csv_url, headers=cabecalhos_condicionais(metadados), timeout=httpx.Timeout(leitura, connect=conexao)
+    )
+    inalterado = response.status_code == 304 or (
+        response.status_code == 200 and hashlib.sha1(response.content).hexdigest() == metadados.get("hash")
+    )
+    registrar_tempo_etapa(
+        "verificacao_assincrona", inicio, bytes=len(response.content), cache="acerto" if inalterado else "falha"
+    )
+    return dados if inalterado else None
+
+# Busca apenas as linhas adicionadas desde a última leitura
+def buscar_linhas_novas(sheet_id, sheet_gid, estado, timeout=None):
+    """
+    Baixa somente as linhas novas de uma planilha pública usando o parâmetro
+    range= da exportação CSV.
+    
+    O intervalo pedido começa na última linha já conhecida; se o hash dessa
+    linha não confere com o guardado, a planilha foi editada e é preciso
+    recarregar tudo. A requisição é condicional: se o intervalo não mudou
+    desde a última resposta aceita (304 ou mesmo hash), nada é processado.
+    
+    O estado não é alterado aqui: quem chama aplica o avanço (e o registra no
+    cache HTTP com registrar_linhas_novas) só depois de processar e anexar
+    as linhas, para que uma falha no meio do caminho não as pule.
+    
+    Args:
+        sheet_id: ID da planilha
+        sheet_gid: GID da aba
+        estado: Estado incremental da planilha
+        timeout: Tupla (conexão, leitura) em segundos
+        
+    Returns:
+        Tupla (DataFrame possivelmente vazio com as linhas novas ainda sem
+        processamento, avanço do estado com n_linhas, bytes_lidos e
+        hash_cauda, ou None se o intervalo não mudou), ou None se for
+        necessária uma recarga completa
+    """
+    colunas = estado["colunas"]
+    csv_url, chave_cache = url_linhas_novas(sheet_id, sheet_gid, estado)
+    
+    resposta = baixar_exportacao(csv_url, chave_cache, timeout)
+    if resposta.status != 200:
+        return None
+    
+    # Intervalo igual ao da última resposta aceita para esta mesma cauda: sem linhas novas
+    if resposta.inalterado and resposta.metadados.get("hash_cauda") == estado["hash_cauda"]:
+        anotar_etapa(bytes=len(resposta.conteudo or b""), incremental=True, cache="acerto")
+        return pd.DataFrame(columns=colunas), None
+    
+    conteudo = resposta.conteudo if resposta.conteudo is not None else ler_corpo_cache_http(chave_cache)
+    if not conteudo:
+        return None
+    
+    df_intervalo = pd.read_csv(
+        io.BytesIO(conteudo), header=None, names=colunas, dtype=str
+    )
+    if df_intervalo.empty or calcular_hash_linha(df_intervalo.iloc[0].tolist()) != estado["hash_cauda"]:
+        return None
+    
+    anotar_etapa(bytes=len(resposta.conteudo or b""), incremental=True, cache="falha")
+    df_novas = df_intervalo.iloc[1:].reset_index(drop=True)
+    avanco = {"n_linhas": estado["n_linhas"], "bytes_lidos": estado["bytes_lidos"], "hash_cauda": estado["hash_cauda"]}
+    if not df_novas.empty:
+        avanco["n_linhas"] += len(df_novas)
+        avanco["bytes_lidos"] += len(conteudo)
+        avanco["hash_cauda"] = calcular_hash_linha(df_novas.iloc[-1].tolist())
+    
+    return df_novas, avanco
+
+# Registra no cache HTTP a resposta incremental já aplicada ao estado
+def registrar_linhas_novas(sheet_id, sheet_gid, estado_anterior, avanco):
+    # Da próxima vez, o mesmo conteúdo para esta cauda dispensa o processamento
+    _, chave_cache = url_linhas_novas(sheet_id, sheet_gid, estado_anterior)
+    atualizar_cache_http(chave_cache, hash_cauda=avanco["hash_cauda"])
+
+class FluxoResposta(io.RawIOBase):
+    """Arquivo somente leitura sobre os pedaços de uma resposta (response.iter_content), para lê-la sem copiá-la inteira"""
+    
+    def __init__(self, pedacos):
+        self.pedacos = iter(pedacos)
+        self.pedaco = b""
+        self.posicao = 0
+        self.bytes_lidos = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        while self.posicao >= len(self.pedaco):
+            self.pedaco = next(self.pedacos, None)
+            self.posicao = 0
+            if self.pedaco is None:
+                self.pedaco = b""
+                return 0
+        
+        n = min(len(buffer), len(self.pedaco) - self.posicao)
+        buffer[:n] = self.pedaco[self.posicao:self.posicao + n]
+        self.posicao += n
+        self.bytes_lidos += n
+        return n
+
+def ler_csv_em_fluxo(pedacos, chave_fonte, tamanho_bloco=TAMANHO_BLOCO_CSV):
+    """
+    Lê uma exportação CSV diretamente do fluxo da resposta, em blocos de
+    linhas como texto, normalizando cada bloco assim que ele é lido. Apenas um
+    bloco bruto fica em memória por vez.
+    
+    Args:
+        pedacos: Pedaços (bytes) do corpo, como response.iter_content de uma
+            resposta aberta com stream=True
+        chave_fonte: Identificador da fonte para processar_dataframe
+        tamanho_bloco: Linhas por bloco
+        
+    Returns:
+        Tupla (DataFrame normalizado, colunas do cabeçalho, número de linhas,
+        valores da última linha, bytes lidos)
+    """
+    fluxo = FluxoResposta(pedacos)
+    colunas, n_linhas, ultima_linha = [], 0, None
+    blocos = []
+    
+    with io.BufferedReader(fluxo, buffer_size=TAMANHO_PEDACO_HTTP) as arquivo:
+        for bloco in pd.read_csv(arquivo, dtype=str, chunksize=tamanho_bloco):
+            colunas = list(bloco.columns)
+            if bloco.empty:
+                continue
+            n_linhas += len(bloco)
+            ultima_linha = bloco.iloc[-1].tolist()
+            blocos.append(processar_dataframe(bloco, chave_fonte))
+    
+    if not blocos:
+        return processar_dataframe(pd.DataFrame(columns=colunas), chave_fonte), colunas, 0, None, fluxo.bytes_lidos
+    
+    df = blocos[0] if len(blocos) == 1 else ordenar_por_timestamp(concatenar_avaliacoes(blocos))
+    return df, colunas, n_linhas, ultima_linha, fluxo.bytes_lidos
+
+# Metadados serializáveis do estado incremental (sem o DataFrame)
+def metadados_ingestao(chave, estado):
+    metadados = {k: v for k, v in estado.items() if k not in ("dados", "cubo")}
+    metadados["chave"] = chave
+    return metadados
+
 # Método 4: Ler planilha pública diretamente via URL
-def ler_sheet_publico(sheet_url, sheet_gid=0):
+@instrumentar("leitura_planilha_publica")
+def ler_sheet_publico(sheet_url, sheet_gid=0, nome_armazenamento=None, timeout=None):
     """
     Lê uma planilha pública do Google Sheets diretamente pela URL.
     
+    Na primeira leitura a planilha inteira é baixada; nas seguintes apenas as
+    linhas acrescentadas desde a última leitura são buscadas, processadas e
+    anexadas aos dados já normalizados. Se a cauda da planilha mudar, os
+    dados são recarregados por completo.
+    
+    A exportação completa é guardada em disco (data/cache_http) com o ETag,
+    o Last-Modified e o hash do conteúdo; se a planilha não mudou (304), o
+    corpo é lido do disco em vez de ser baixado de novo.
+    
     Args:
         sheet_url: URL ou ID da planilha
         sheet_gid: GID da aba específica (0 para primeira aba)
+        nome_armazenamento: Nome da filial no armazenamento colunar; quando
+            informado, os dados são persistidos e a ingestão incremental é
+            retomada a partir deles após um reinício
+        timeout: Tupla (conexão, leitura) em segundos
         
     Returns:
         DataFrame com os dados
@@ -291,357 +1933,1737 @@ def ler_sheet_publico(sheet_url, sheet_gid=0):
         # Extrair ID da planilha se for uma URL
         sheet_id = extrair_id_sheet_da_url(sheet_url)
         if not sheet_id:
-            st.error("URL da planilha inválida")
+            avisar_leitura("error", "URL da planilha inválida")
             return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
         
+        estado_ingestao = obter_estado_ingestao()
+        chave = f"{sheet_id}:{sheet_gid}"
+        lock_planilha = obter_lock_planilha(chave)
+        persistir = PYARROW_AVAILABLE and bool(nome_armazenamento)
+        
+        with lock_planilha:
+            estado = estado_ingestao["planilhas"].get(chave)
+            
+            # Após um reinício, retoma o estado a partir do armazenamento colunar
+            if estado is None and persistir and existe_armazenamento_colunar(nome_armazenamento):
+                estado_salvo = ler_estado_armazenamento(nome_armazenamento)
+                if estado_salvo and estado_salvo.get("chave") == chave:
+                    dados = ler_armazenamento_colunar(nome_armazenamento)
+                    estado = dict(estado_salvo, dados=dados, cubo=calcular_cubo_agregados(dados))
+                    estado_ingestao["planilhas"][chave] = estado
+            
+            # Cópia do ponto de leitura: a requisição é feita fora do lock
+            referencia = None
+            if estado is not None:
+                referencia = {campo: estado[campo] for campo in ("colunas", "n_linhas", "bytes_lidos", "hash_cauda")}
+        
+        # Leitura incremental quando já existe um estado para esta planilha
+        if referencia is not None:
+            resultado = buscar_linhas_novas(sheet_id, sheet_gid, referencia, timeout)
+            if resultado is not None:
+                df_novas, avanco = resultado
+                if not df_novas.empty:
+                    df_novas = processar_dataframe(df_novas, f"publico:{chave}")
+                with lock_planilha:
+                    estado = estado_ingestao["planilhas"].get(chave)
+                    if estado is not None and (estado["n_linhas"], estado["hash_cauda"]) != (referencia["n_linhas"], referencia["hash_cauda"]):
+                        # Outra leitura desta planilha avançou o estado enquanto esta baixava
+                        return estado["dados"]
+                    if estado is not None:
+                        if not df_novas.empty:
+                            dados = ordenar_por_timestamp(concatenar_avaliacoes([estado["dados"], df_novas]))
+                            cubo = combinar_cubos(estado["cubo"], calcular_cubo_agregados(df_novas))
+                            if persistir:
+                                # O estado gravado junto às linhas só avança se elas forem anexadas;
+                                # após um reinício, as que faltarem no disco são buscadas de novo
+                                try:
+                                    anexar_armazenamento_colunar(df_novas, nome_armazenamento, metadados_ingestao(chave, dict(estado, **avanco)))
+                                except Exception as e:
+                                    avisar_leitura("warning", f"Não foi possível gravar o armazenamento colunar: {e}")
+                            # A concatenação descarta os attrs que diferem entre as partes
+                            if 'avisos_colunas' in df_novas.attrs:
+                                dados.attrs['avisos_colunas'] = df_novas.attrs['avisos_colunas']
+                            estado.update(avanco, dados=dados, cubo=cubo)
+                        if avanco is not None:
+                            registrar_linhas_novas(sheet_id, sheet_gid, referencia, avanco)
+                        estado["dados"].attrs['impressao_fonte'] = f"publico:{chave}:{estado['n_linhas']}:{estado['hash_cauda']}"
+                        return estado["dados"]
+        
         # Construir URL para exportação como CSV
-        csv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={sheet_gid}"
+        csv_url = URL_EXPORTACAO_PLANILHA.format(sheet_id=sheet_id, gid=sheet_gid)
+        chave_cache = f"{sheet_id}_{sheet_gid}"
+        metadados = ler_cache_http(chave_cache, csv_url)
         
-        # Fazer requisição para a URL
-        response = requests.get(csv_url)
-        if response.status_code != 200:
-            st.error(f"Erro ao acessar planilha: {response.status_code}")
-            return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+        # Fazer requisição condicional para a URL (resposta lida em fluxo)
+        with obter_sessao_http().get(
+            csv_url, timeout=timeout or obter_timeout(), stream=True, headers=cabecalhos_condicionais(metadados)
+        ) as response:
+            if response.status_code == 304 and metadados:
+                # Planilha inalterada: lê o corpo guardado em disco
+                with gzip.open(caminhos_cache_http(chave_cache)[1], 'rb') as arquivo:
+                    pedacos = iter(functools.partial(arquivo.read, TAMANHO_PEDACO_HTTP), b"")
+                    df, colunas, n_linhas, ultima_linha, bytes_lidos = ler_csv_em_fluxo(pedacos, f"publico:{chave}")
+                anotar_etapa(bytes=0, incremental=False, cache="acerto")
+            elif response.status_code != 200:
+                avisar_leitura("error", f"Erro ao acessar planilha: {response.status_code}")
+                return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+            else:
+                # Ler CSV em blocos (como texto, para que o hash da cauda seja
+                # comparável), copiando o corpo para o cache em disco
+                gravador = GravadorCacheHttp(chave_cache, csv_url, response)
+                try:
+                    pedacos = gravador.copiar(response.iter_content(chunk_size=TAMANHO_PEDACO_HTTP))
+                    df, colunas, n_linhas, ultima_linha, bytes_lidos = ler_csv_em_fluxo(pedacos, f"publico:{chave}")
+                    gravador.concluir(linhas=n_linhas, colunas=len(colunas))
+                except Exception:
+                    gravador.descartar()
+                    raise
+                anotar_etapa(bytes=bytes_lidos, incremental=False, cache="falha")
         
-        # Ler CSV da resposta
-        df_original = pd.read_csv(io.StringIO(response.content.decode('utf-8')))
+        # Guardar o estado para as próximas leituras incrementais
+        with lock_planilha:
+            if n_linhas > 0:
+                estado = {
+                    "colunas": colunas,
+                    "n_linhas": n_linhas,
+                    "bytes_lidos": bytes_lidos,
+                    "hash_cauda": calcular_hash_linha(ultima_linha),
+                    "dados": df,
+                    "cubo": calcular_cubo_agregados(df)
+                }
+                estado_ingestao["planilhas"][chave] = estado
+                df.attrs['impressao_fonte'] = f"publico:{chave}:{n_linhas}:{estado['hash_cauda']}"
+                if persistir and not df.empty:
+                    try:
+                        salvar_armazenamento_colunar(df, nome_armazenamento, metadados_ingestao(chave, estado))
+                    except Exception as e:
+                        avisar_leitura("warning", f"Não foi possível gravar o armazenamento colunar: {e}")
+            else:
+                estado_ingestao["planilhas"].pop(chave, None)
         
-        return processar_dataframe(df_original)
+        return df
     
     except Exception as e:
-        st.error(f"Erro ao ler planilha pública: {e}")
+        avisar_leitura("error", f"Erro ao ler planilha pública: {e}")
         return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
 
-# Função para processar o DataFrame independentemente da origem
-def processar_dataframe(df_original):
-    try:
-        # Verificar se há dados na planilha
-        if df_original.empty:
-            st.error("A planilha não contém dados")
-            return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
-        
-        # Mapear corretamente as colunas conforme a estrutura real da planilha
-        # A: Recepção, B: Timestamp, C: E-mail, D: Atendimento, E: Recomendação, F: Comentário
-        col_recepcao = 0    # Coluna A
-        col_timestamp = 1   # Coluna B
-        col_email = 2       # Coluna C
-        col_atendimento = 3 # Coluna D
-        col_recomendacao = 4 # Coluna E
-        col_comentario = 5   # Coluna F
-        
-        # Se os dados já vieram com nomes de colunas corretos
-        if isinstance(df_original.columns[0], str):
-            colunas_possiveis = {
-                'recepcao': ['recepcao', 'recepção', 'recepçao', 'recepção'],
-                'timestamp': ['timestamp', 'data', 'data/hora', 'data e hora'],
-                'email': ['email', 'e-mail', 'email', 'e-mail'],
-                'atendimento': ['atendimento', 'nota do atendimento', 'avaliação do atendimento'],
-                'recomendacao': ['recomendacao', 'recomendação', 'nota de recomendação'],
-                'comentario': ['comentario', 'comentário', 'observações', 'observacoes']
-            }
-            
-            # Tentar mapear as colunas por nome
-            cols_mapeadas = {}
-            for col_destino, nomes_possiveis in colunas_possiveis.items():
-                for col_nome in df_original.columns:
-                    if col_nome.lower() in nomes_possiveis:
-                        cols_mapeadas[col_destino] = col_nome
-                        break
-            
-            # Se encontrou todas as colunas principais
-            if 'recepcao' in cols_mapeadas and 'timestamp' in cols_mapeadas and 'atendimento' in cols_mapeadas and 'recomendacao' in cols_mapeadas:
-                df = pd.DataFrame()
-                df['recepcao'] = df_original[cols_mapeadas.get('recepcao')].fillna('Não informado')
-                df['timestamp'] = df_original[cols_mapeadas.get('timestamp')]
-                df['atendimento'] = df_original[cols_mapeadas.get('atendimento')]
-                df['recomendacao'] = df_original[cols_mapeadas.get('recomendacao')]
-                
-                if 'comentario' in cols_mapeadas:
-                    df['comentario'] = df_original[cols_mapeadas.get('comentario')]
-                else:
-                    df['comentario'] = ""
-            else:
-                # Usar o método baseado em posição se não encontrou as colunas por nome
-                df = pd.DataFrame()
-                
-                if len(df_original.columns) > col_recepcao:
-                    df['recepcao'] = df_original.iloc[:, col_recepcao].fillna('Não informado')
-                else:
-                    df['recepcao'] = 'Não informado'
-                
-                if len(df_original.columns) > col_timestamp:
-                    df['timestamp'] = df_original.iloc[:, col_timestamp]
-                else:
-                    df['timestamp'] = pd.NaT
-                
-                if len(df_original.columns) > col_atendimento:
-                    df['atendimento'] = df_original.iloc[:, col_atendimento]
-                else:
-                    df['atendimento'] = np.nan
-                
-                if len(df_original.columns) > col_recomendacao:
-                    df['recomendacao'] = df_original.iloc[:, col_recomendacao]
-                else:
-                    df['recomendacao'] = np.nan
-                
-                if len(df_original.columns) > col_comentario:
-                    df['comentario'] = df_original.iloc[:, col_comentario]
-                else:
-                    df['comentario'] = ""
-        else:
-            # Usar o método original baseado em posição
-            df = pd.DataFrame()
-            
-            if len(df_original.columns) > col_recepcao:
-                df['recepcao'] = df_original.iloc[:, col_recepcao].fillna('Não informado')
-            else:
-                df['recepcao'] = 'Não informado'
-            
-            if len(df_original.columns) > col_timestamp:
-                df['timestamp'] = df_original.iloc[:, col_timestamp]
-            else:
-                df['timestamp'] = pd.NaT
-            
-            if len(df_original.columns) > col_atendimento:
-                df['atendimento'] = df_original.iloc[:, col_atendimento]
-            else:
-                df['atendimento'] = np.nan
-            
-            if len(df_original.columns) > col_recomendacao:
-                df['recomendacao'] = df_original.iloc[:, col_recomendacao]
-            else:
-                df['recomendacao'] = np.nan
-            
-            if len(df_original.columns) > col_comentario:
-                df['comentario'] = df_original.iloc[:, col_comentario]
-            else:
-                df['comentario'] = ""
-        
-        # Converter timestamp para datetime
-        # Primeiro tenta formatos brasileiros (dd/mm/yyyy)
+# Cabeçalho da planilha de avaliações (mesma ordem do initialSetup do script.gs)
+CABECALHO_AVALIACOES = ["Recepção", "Timestamp", "Email", "Atendimento", "Recomendação", "Comentário"]
+
+# O registro local acrescenta uma chave única por avaliação (coluna G na planilha),
+# usada para não duplicar linhas quando um envio ao Google Sheets é repetido
+CABECALHO_REGISTRO = CABECALHO_AVALIACOES + ["Chave"]
+
+# Caminho do registro local (somente acréscimo) de avaliações de uma filial
+def caminho_registro_avaliacoes(nome_filial):
+    dirs = setup_app_directories()
+    return os.path.join(dirs["data_dir"], f"{nome_filial}.avaliacoes.csv")
+
+# Registro de avaliações recebidas pelo servidor local, compartilhado entre as sessões
+@st.cache_resource
+def obter_registro_avaliacoes() -> Dict[str, Any]:
+    lock = threading.Lock()
+    return {
+        "lock": lock,                       # protege a fila de pendentes
+        "condicao": threading.Condition(lock),
+        "pendentes": [],                    # (nome da filial, linha, resultado)
+        "lock_dados": threading.Lock(),     # protege os arquivos e os dados em memória
+        "filiais": {},                      # nome da filial -> {"dados", "cubo"}
+        "gravador": None,
+        "espelho": {}                       # nome da filial -> situação do último envio ao Google Sheets
+    }
+
+def carregar_registro_filial(nome_filial):
+    """
+    Lê o registro local de uma filial para a memória (chamar com lock_dados).
+    
+    Returns:
+        Dicionário com os dados normalizados ("dados") e o cubo ("cubo")
+    """
+    caminho = caminho_registro_avaliacoes(nome_filial)
+    if os.path.exists(caminho) and os.path.getsize(caminho) > 0:
+        df_original = pd.read_csv(caminho, dtype=str, keep_default_na=False, na_values=[""])
+    else:
+        df_original = pd.DataFrame(columns=CABECALHO_REGISTRO)
+    
+    if df_original.empty:
+        dados = pd.DataFrame(columns=COLUNAS_NORMALIZADAS)
+    else:
+        dados = processar_dataframe(df_original, f"servidor:{nome_filial}")
+    
+    return {"dados": dados, "cubo": calcular_cubo_agregados(dados)}
+
+def gravar_lote_avaliacoes(lote):
+    """
+    Grava um lote de avaliações: uma escrita e um único fsync por filial para
+    todas as avaliações que chegaram enquanto o lote anterior era gravado
+    (group commit). Em seguida, acrescenta as avaliações aos dados em memória.
+    """
+    registro = obter_registro_avaliacoes()
+    por_filial = {}
+    for nome_filial, linha, resultado in lote:
+        por_filial.setdefault(nome_filial, []).append((linha, resultado))
+    
+    for nome_filial, itens in por_filial.items():
+        linhas = [linha for linha, _ in itens]
         try:
-            # Tenta primeiro o formato completo dd/mm/yyyy HH:MM:SS
-            df['timestamp'] = pd.to_datetime(df['timestamp'], format='%d/%m/%Y %H:%M:%S', errors='coerce')
-            
-            # Se ainda tem valores NaT, tenta o formato dd/mm/yyyy HH:MM
-            mascara_nat = df['timestamp'].isna()
-            if mascara_nat.any():
-                df.loc[mascara_nat, 'timestamp'] = pd.to_datetime(
-                    df.loc[mascara_nat, 'timestamp'], format='%d/%m/%Y %H:%M', errors='coerce'
-                )
+            with registro["lock_dados"]:
+                caminho = caminho_registro_avaliacoes(nome_filial)
+                novo_arquivo = not os.path.exists(caminho) or os.path.getsize(caminho) == 0
+                with open(caminho, "a", encoding="utf-8", newline="") as f:
+                    escritor = csv.writer(f)
+                    if novo_arquivo:
+                        escritor.writerow(CABECALHO_REGISTRO)
+                    escritor.writerows(linhas)
+                    f.flush()
+                    os.fsync(f.fileno())
                 
-            # Se ainda tem valores NaT, tenta apenas o formato dd/mm/yyyy
-            mascara_nat = df['timestamp'].isna()
-            if mascara_nat.any():
-                df.loc[mascara_nat, 'timestamp'] = pd.to_datetime(
-                    df.loc[mascara_nat, 'timestamp'], format='%d/%m/%Y', errors='coerce'
-                )
-            
-            # Para valores ainda nulos, tenta o formato automático do pandas
-            mascara_nat = df['timestamp'].isna()
-            if mascara_nat.any():
-                df.loc[mascara_nat, 'timestamp'] = pd.to_datetime(
-                    df.loc[mascara_nat, 'timestamp'], errors='coerce'
-                )
+                # Dados em memória já carregados: acrescentar só o lote
+                estado = registro["filiais"].get(nome_filial)
+                if estado is not None:
+                    df_novas = processar_dataframe(pd.DataFrame(linhas, columns=CABECALHO_REGISTRO), f"servidor:{nome_filial}")
+                    if not df_novas.empty:
+                        estado["dados"] = ordenar_por_timestamp(concatenar_avaliacoes([estado["dados"], df_novas]))
+                        estado["cubo"] = combinar_cubos(estado["cubo"], calcular_cubo_agregados(df_novas))
+            erro = None
         except Exception as e:
-            # Em caso de erro, volta para o método padrão
-            st.warning(f"Erro ao processar datas no formato brasileiro: {e}. Tentando formato automático.")
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+            erro = e
         
-        # Converter notas para inteiro
-        df['atendimento'] = pd.to_numeric(df['atendimento'], errors='coerce')
-        df['recomendacao'] = pd.to_numeric(df['recomendacao'], errors='coerce')
-        
-        # Adicionar colunas de ano e mês para facilitar filtragem
-        df['ano'] = df['timestamp'].dt.year
-        df['mes'] = df['timestamp'].dt.month
-        df['mes_nome'] = df['timestamp'].dt.strftime('%B')  # Nome do mês
-        df['ano_mes'] = df['timestamp'].dt.strftime('%Y-%m')  # Formato YYYY-MM
-        
-        return df
+        for _, resultado in itens:
+            resultado["erro"] = erro
+            resultado["gravado"].set()
+
+def executar_gravador_avaliacoes():
+    """Laço do gravador: aguarda avaliações pendentes e grava em lotes"""
+    registro = obter_registro_avaliacoes()
+    while True:
+        with registro["condicao"]:
+            while not registro["pendentes"]:
+                registro["condicao"].wait()
+            lote = registro["pendentes"][:MAX_LOTE_GRAVACAO]
+            registro["pendentes"] = registro["pendentes"][MAX_LOTE_GRAVACAO:]
         
+        gravar_lote_avaliacoes(lote)
+
+def registrar_avaliacao(nome_filial, linha, timeout=10):
+    """
+    Enfileira uma avaliação para gravação e aguarda a confirmação em disco.
+    
+    Args:
+        nome_filial: Nome da conexão da filial (connection_name)
+        linha: Valores na ordem de CABECALHO_REGISTRO
+        timeout: Tempo máximo de espera pela gravação, em segundos
+    """
+    registro = obter_registro_avaliacoes()
+    resultado = {"gravado": threading.Event(), "erro": None}
+    
+    with registro["condicao"]:
+        if registro["gravador"] is None or not registro["gravador"].is_alive():
+            registro["gravador"] = threading.Thread(
+                target=executar_gravador_avaliacoes, name="ceop-gravador", daemon=True
+            )
+            registro["gravador"].start()
+        registro["pendentes"].append((nome_filial, linha, resultado))
+        registro["condicao"].notify()
+    
+    if not resultado["gravado"].wait(timeout):
+        raise TimeoutError("Tempo esgotado ao gravar a avaliação.")
+    if resultado["erro"] is not None:
+        raise resultado["erro"]
+
+# Função para ler as avaliações recebidas pelo servidor de ingestão local
+def ler_do_servidor_local(nome_filial):
+    try:
+        registro = obter_registro_avaliacoes()
+        with registro["lock_dados"]:
+            estado = registro["filiais"].get(nome_filial)
+            if estado is None:
+                estado = carregar_registro_filial(nome_filial)
+                registro["filiais"][nome_filial] = estado
+            
+            # Os dados em memória só são substituídos quando chegam avaliações; o
+            # objeto fica referenciado pelo memo enquanto sua impressão estiver lá
+            dados = estado["dados"]
+            dados.attrs['impressao_fonte'] = f"servidor:{nome_filial}:{len(dados)}:{id(dados)}"
+            return dados
+    
     except Exception as e:
-        st.error(f"Erro ao processar dados: {e}")
+        avisar_leitura("error", f"Erro ao ler avaliações do servidor local: {e}")
+        return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+
+# Estado do envio do registro local para o Google Sheets (posição já enviada)
+def caminho_estado_espelho(nome_filial):
+    dirs = setup_app_directories()
+    return os.path.join(dirs["data_dir"], f"{nome_filial}.espelho.json")
+
+def ler_estado_espelho(nome_filial):
+    caminho = caminho_estado_espelho(nome_filial)
+    if not os.path.exists(caminho):
+        return {"posicao": 0, "em_envio": False}
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def salvar_estado_espelho(nome_filial, estado):
+    # Grava em arquivo temporário e troca, para nunca deixar o estado pela metade
+    caminho = caminho_estado_espelho(nome_filial)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(estado, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+def espelhar_registro_filial(nome_filial, sheet_id, sheet_name):
+    """
+    Envia ao Google Sheets, em uma única chamada append_rows, as avaliações
+    do registro local ainda não enviadas.
+    
+    Antes do envio, o estado é marcado como "em_envio". Se o envio anterior
+    falhou sem confirmação (a planilha pode ou não ter recebido as linhas),
+    as chaves já presentes na coluna G são consultadas e essas linhas não são
+    enviadas de novo.
+    
+    Returns:
+        Número de avaliações enviadas
+    """
+    registro = obter_registro_avaliacoes()
+    caminho = caminho_registro_avaliacoes(nome_filial)
+    estado = ler_estado_espelho(nome_filial)
+    
+    # Lê apenas o trecho novo do registro (linhas completas, sob o lock do gravador)
+    with registro["lock_dados"]:
+        if not os.path.exists(caminho):
+            return 0
+        with open(caminho, "rb") as f:
+            f.seek(estado["posicao"])
+            trecho = f.read()
+    
+    if not trecho:
+        return 0
+    
+    linhas = list(csv.reader(io.StringIO(trecho.decode("utf-8"), newline="")))
+    if estado["posicao"] == 0 and linhas and linhas[0] == CABECALHO_REGISTRO:
+        linhas = linhas[1:]
+    
+    worksheet = abrir_aba_gspread(sheet_id, sheet_name)
+    
+    if estado.get("em_envio"):
+        chaves_enviadas = set(worksheet.col_values(len(CABECALHO_REGISTRO)))
+        linhas = [linha for linha in linhas if linha[-1] not in chaves_enviadas]
+    
+    if linhas:
+        salvar_estado_espelho(nome_filial, {"posicao": estado["posicao"], "em_envio": True})
+        worksheet.append_rows(linhas, value_input_option="USER_ENTERED")
+    
+    salvar_estado_espelho(nome_filial, {"posicao": estado["posicao"] + len(trecho), "em_envio": False})
+    return len(linhas)
+
+def executar_espelho_planilhas(intervalo):
+    """Laço do envio periódico do registro local de cada filial para o Google Sheets"""
+    registro = obter_registro_avaliacoes()
+    while True:
+        config = carregar_configuracao_planilhas()
+        for filial_config in config.get("filiais", {}).values():
+            nome_filial = filial_config.get("connection_name", "")
+            if not nome_filial or not filial_config.get("sheet_id"):
+                continue
+            
+            try:
+                enviadas = espelhar_registro_filial(nome_filial, filial_config["sheet_id"], filial_config.get("sheet_name", ""))
+                situacao = registro["espelho"].setdefault(nome_filial, {})
+                situacao.update(erro=None, verificado_em=time.time())
+                if enviadas:
+                    situacao.update(enviado_em=time.time(), enviadas=situacao.get("enviadas", 0) + enviadas)
+            except Exception as e:
+                # Tenta de novo no próximo ciclo; as chaves evitam linhas duplicadas
+                descartar_aba_gspread(filial_config["sheet_id"], filial_config.get("sheet_name", ""))
+                registro["espelho"].setdefault(nome_filial, {}).update(erro=str(e), verificado_em=time.time())
+        
+        time.sleep(intervalo)
+
+# Envio em segundo plano para o Google Sheets, iniciado uma única vez por processo
+@st.cache_resource
+def iniciar_espelho_planilhas(intervalo: float) -> threading.Thread:
+    thread = threading.Thread(target=executar_espelho_planilhas, args=(intervalo,), name="ceop-espelho", daemon=True)
+    thread.start()
+    return thread
+
+class ManipuladorAvaliacoes(BaseHTTPRequestHandler):
+    """
+    Recebe avaliações dos formulários com os mesmos parâmetros e respostas do
+    doGet/doPost do script.gs. O caminho da URL indica a filial
+    (ex.: /gsheets_belem?recepcao=...&atendimento=...&recomendacao=...).
+    """
+    
+    def enviar_resposta(self, status, conteudo, tipo="application/json"):
+        corpo = conteudo.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{tipo}; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+        self.wfile.write(corpo)
+    
+    def enviar_json(self, status, dados):
+        self.enviar_resposta(status, json.dumps(dados, ensure_ascii=False))
+    
+    def obter_filial(self):
+        nome_filial = urlparse(self.path).path.strip("/")
+        config = carregar_configuracao_planilhas()
+        nomes = {cfg.get("connection_name", "") for cfg in config.get("filiais", {}).values()}
+        return nome_filial if nome_filial and nome_filial in nomes else None
+    
+    def registrar(self, nome_filial, dados):
+        # Criar o registro com data e hora atual
+        linha = [
+            dados.get("recepcao") or "",
+            datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
+            "",  # Email não é mais coletado
+            dados.get("atendimento"),
+            dados.get("recomendacao"),
+            dados.get("comentario") or "",  # Comentário é opcional
+            uuid.uuid4().hex  # Chave da avaliação
+        ]
+        registrar_avaliacao(nome_filial, [str(valor) for valor in linha])
+    
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Max-Age", "3600")
+        self.end_headers()
+    
+    def do_GET(self):
+        dados = {chave: valores[0] for chave, valores in parse_qs(urlparse(self.path).query).items()}
+        
+        # Resposta padrão quando não há parâmetros (apenas teste)
+        if not dados:
+            self.enviar_resposta(200, "O serviço está funcionando. Este endpoint aceita solicitações GET com parâmetros ou POST.", "text/plain")
+            return
+        
+        nome_filial = self.obter_filial()
+        if nome_filial is None:
+            self.enviar_json(404, {"success": False, "error": "Filial não encontrada."})
+            return
+        
+        # Validar campos obrigatórios
+        if not dados.get("recepcao") or not dados.get("atendimento") or not dados.get("recomendacao"):
+            self.enviar_json(400, {"success": False, "error": "Campos obrigatórios não preenchidos."})
+            return
+        
+        try:
+            self.registrar(nome_filial, dados)
+            self.enviar_resposta(200, "Sucesso! Sua avaliação foi registrada.", "text/html")
+        except Exception as e:
+            self.enviar_resposta(500, f"Erro: {e}", "text/html")
+    
+    def do_POST(self):
+        nome_filial = self.obter_filial()
+        if nome_filial is None:
+            self.enviar_json(404, {"success": False, "error": "Filial não encontrada."})
+            return
+        
+        # Verificar se os dados foram recebidos
+        tamanho = int(self.headers.get("Content-Length") or 0)
+        if tamanho <= 0:
+            self.enviar_json(400, {"success": False, "error": "Dados não recebidos."})
+            return
+        
+        try:
+            dados = json.loads(self.rfile.read(tamanho).decode("utf-8"))
+            if not isinstance(dados, dict):
+                raise ValueError("O corpo da requisição deve ser um objeto JSON.")
+            
+            # Validar campos obrigatórios
+            if not dados.get("recepcao") or not dados.get("atendimento") or not dados.get("recomendacao"):
+                self.enviar_json(400, {"success": False, "error": "Campos obrigatórios não preenchidos."})
+                return
+            
+            self.registrar(nome_filial, dados)
+            self.enviar_json(200, {"success": True, "data": dados})
+        except Exception as e:
+            self.enviar_json(500, {"success": False, "error": str(e)})
+    
+    def log_message(self, format, *args):
+        # Sem registro de cada requisição no console
+        pass
+
+# Servidor de ingestão local, iniciado uma única vez por processo
+@st.cache_resource
+def iniciar_servidor_ingestao(host: str, porta: int) -> ThreadingHTTPServer:
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorAvaliacoes)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="ceop-servidor-ingestao", daemon=True).start()
+    return servidor
+
+# Formatos de data brasileiros aceitos, do mais para o menos específico
+FORMATOS_DATA = ['%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y']
+
+# Padrão que cobre todos os formatos acima de uma só vez
+PADRAO_DATA_BR = r'^(\d{1,2})/(\d{1,2})/(\d{4})(?:\s+(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?)?$'
+
+# Formato de data detectado para cada fonte de dados
+@st.cache_resource
+def obter_formatos_data_por_fonte() -> Dict[str, str]:
+    return {}
+
+def detectar_formato_data(textos, tamanho_amostra=200):
+    """
+    Detecta, a partir de uma amostra, qual dos FORMATOS_DATA reconhece mais
+    valores da coluna de datas.
+    
+    Args:
+        textos: Series de texto com as datas
+        tamanho_amostra: Quantidade de valores testados (início e fim da coluna)
+        
+    Returns:
+        O formato escolhido, ou None se nenhum reconhecer a amostra
+    """
+    amostra = textos.dropna()
+    if len(amostra) > tamanho_amostra:
+        amostra = pd.concat([amostra.head(tamanho_amostra // 2), amostra.tail(tamanho_amostra // 2)])
+    
+    melhor_formato, melhor_contagem = None, 0
+    for formato in FORMATOS_DATA:
+        contagem = converter_com_formato(amostra, formato).notna().sum()
+        if contagem > melhor_contagem:
+            melhor_formato, melhor_contagem = formato, contagem
+    
+    return melhor_formato
+
+# Converte datas que seguem um formato conhecido (strptime vetorizado do Arrow, quando disponível)
+def converter_com_formato(textos, formato):
+    if PYARROW_AVAILABLE:
+        originais = pa.array(textos, type=pa.string(), from_pandas=True)
+        convertidos = pc.strptime(originais, format=formato, unit='s', error_is_null=True)
+        resultado = convertidos.to_pandas().set_axis(textos.index).astype('datetime64[ns]')
+        
+        # O strptime do Arrow aceita datas impossíveis, passando para o mês seguinte
+        # (31/02 vira 02/03): dia e mês convertidos têm de ser os do texto
+        # (todos os FORMATOS_DATA começam por %d/%m)
+        partes = pc.extract_regex(originais, r'^(?P<dia>\d{1,2})/(?P<mes>\d{1,2})/')
+        divergentes = pc.or_(
+            pc.not_equal(pc.day(convertidos), pc.cast(pc.struct_field(partes, 'dia'), pa.int64())),
+            pc.not_equal(pc.month(convertidos), pc.cast(pc.struct_field(partes, 'mes'), pa.int64()))
+        )
+        divergentes = pc.fill_null(divergentes, False).to_numpy(zero_copy_only=False)
+        if divergentes.any():
+            resultado[divergentes] = pd.NaT
+        return resultado
+    return pd.to_datetime(textos, format=formato, errors='coerce').astype('datetime64[ns]')
+
+# Converte datas em formatos brasileiros variados usando o padrão único
+def converter_datas_br_mistas(textos):
+    partes = textos.str.extract(PADRAO_DATA_BR).apply(pd.to_numeric)
+    partes = partes.dropna(subset=[0, 1, 2])
+    if partes.empty:
+        return pd.Series(pd.NaT, index=textos.index, dtype='datetime64[ns]')
+    
+    componentes = pd.DataFrame({
+        'year': partes[2],
+        'month': partes[1],
+        'day': partes[0],
+        'hour': partes[3].fillna(0),
+        'minute': partes[4].fillna(0),
+        'second': partes[5].fillna(0)
+    })
+    
+    return pd.to_datetime(componentes, errors='coerce').reindex(textos.index)
+
+@instrumentar("conversao_datas")
+def converter_timestamps(valores, chave_fonte=None):
+    """
+    Converte a coluna de datas em um único passe vetorizado.
+    
+    O formato é detectado por amostragem na primeira leitura de cada fonte e
+    reaproveitado nas seguintes. Apenas os valores que não seguem esse
+    formato passam pelos formatos alternativos, sempre a partir do texto
+    original.
+    
+    Args:
+        valores: Series com as datas como vieram da fonte
+        chave_fonte: Identificador da fonte para o cache do formato
+        
+    Returns:
+        Tupla (datas convertidas, texto original das datas não reconhecidas)
+    """
+    if pd.api.types.is_datetime64_any_dtype(valores):
+        return valores, pd.Series(pd.NA, index=valores.index, dtype='string')
+    
+    textos = valores.astype('string').str.strip()
+    textos = textos.mask(textos == "")
+    
+    formatos = obter_formatos_data_por_fonte()
+    formato = formatos.get(chave_fonte) if chave_fonte else None
+    if formato is None:
+        formato = detectar_formato_data(textos)
+        if chave_fonte and formato:
+            formatos[chave_fonte] = formato
+    
+    if formato:
+        timestamps = converter_com_formato(textos, formato)
+    else:
+        timestamps = pd.Series(pd.NaT, index=textos.index, dtype='datetime64[ns]')
+    
+    falhas = timestamps.isna() & textos.notna()
+    if falhas.any():
+        # Formato salvo deixou de servir para a maior parte dos dados: detectar de novo
+        if chave_fonte and formato and falhas.mean() > 0.5:
+            formatos.pop(chave_fonte, None)
+        
+        # Somente as linhas que falharam, a partir do texto original
+        alternativos = converter_datas_br_mistas(textos[falhas]).astype('datetime64[ns]')
+        restantes = alternativos.isna()
+        if restantes.any():
+            alternativos[restantes] = pd.to_datetime(textos[falhas][restantes], errors='coerce')
+        timestamps[falhas] = alternativos
+        falhas = timestamps.isna() & textos.notna()
+    
+    return timestamps, valores.astype('string').where(falhas)
+
+# Nomes aceitos para cada coluna normalizada (comparados em minúsculas)
+NOMES_COLUNAS = {
+    'recepcao': ['recepcao', 'recepção', 'recepçao'],
+    'timestamp': ['timestamp', 'data', 'data/hora', 'data e hora'],
+    'email': ['email', 'e-mail'],
+    'atendimento': ['atendimento', 'nota do atendimento', 'avaliação do atendimento'],
+    'recomendacao': ['recomendacao', 'recomendação', 'nota de recomendação'],
+    'comentario': ['comentario', 'comentário', 'observações', 'observacoes'],
+    'chave': ['chave']
+}
+
+# Posição de cada coluna na estrutura real da planilha
+# A: Recepção, B: Timestamp, C: E-mail, D: Atendimento, E: Recomendação, F: Comentário
+POSICOES_COLUNAS = {'recepcao': 0, 'timestamp': 1, 'email': 2, 'atendimento': 3, 'recomendacao': 4, 'comentario': 5}
+
+# Colunas sem as quais o mapeamento por nome não é usado
+COLUNAS_PRINCIPAIS = ['recepcao', 'timestamp', 'atendimento', 'recomendacao']
+
+@dataclass(frozen=True)
+class MapeamentoColunas:
+    """Como as colunas de um cabeçalho de origem viram as colunas normalizadas"""
+    por_nome: bool
+    posicoes: Dict[str, Optional[int]]   # coluna normalizada -> posição na origem (None se ausente)
+    nao_mapeadas: Tuple[str, ...] = ()
+    ambiguas: Tuple[str, ...] = ()
+    avisos: Tuple[Tuple[str, str], ...] = ()   # (tipo, texto), exibidos pela página
+
+# Mapeamentos já resolvidos, por impressão digital do cabeçalho
+@st.cache_resource
+def obter_mapeamentos_colunas() -> Dict[str, MapeamentoColunas]:
+    return {}
+
+def resolver_mapeamento_colunas(colunas):
+    """
+    Resolve (por nome ou, se faltar alguma coluna principal, por posição) o
+    mapeamento de um cabeçalho. O resultado fica em cache pela impressão
+    digital do cabeçalho. Colunas não reconhecidas ou ambíguas viram avisos
+    no próprio mapeamento, em vez de mensagens na tela: a leitura costuma
+    rodar em uma thread sem sessão do Streamlit.
+    
+    Args:
+        colunas: Colunas do DataFrame de origem
+        
+    Returns:
+        MapeamentoColunas
+    """
+    colunas = list(colunas)
+    impressao = hashlib.sha1(repr([(type(c).__name__, c) for c in colunas]).encode('utf-8')).hexdigest()
+    
+    mapeamentos = obter_mapeamentos_colunas()
+    mapeamento = mapeamentos.get(impressao)
+    if mapeamento is not None:
+        return mapeamento
+    
+    destino_por_nome = {nome: destino for destino, nomes in NOMES_COLUNAS.items() for nome in nomes}
+    encontradas, nao_mapeadas = {}, []
+    for posicao, coluna in enumerate(colunas):
+        destino = destino_por_nome.get(coluna.strip().lower()) if isinstance(coluna, str) else None
+        if destino is None:
+            nao_mapeadas.append(str(coluna))
+        else:
+            encontradas.setdefault(destino, []).append(posicao)
+    
+    avisos = []
+    if all(destino in encontradas for destino in COLUNAS_PRINCIPAIS):
+        # A primeira coluna com cada nome é a usada
+        ambiguas = tuple(destino for destino, posicoes in encontradas.items() if len(posicoes) > 1)
+        if nao_mapeadas:
+            avisos.append(("info", f"Colunas ignoradas na leitura: {', '.join(nao_mapeadas)}"))
+        if ambiguas:
+            avisos.append(("warning", f"Mais de uma coluna para {', '.join(ambiguas)}; usando a primeira de cada."))
+        mapeamento = MapeamentoColunas(
+            por_nome=True,
+            posicoes={destino: posicoes[0] for destino, posicoes in encontradas.items()},
+            nao_mapeadas=tuple(nao_mapeadas),
+            ambiguas=ambiguas,
+            avisos=tuple(avisos)
+        )
+    else:
+        if colunas and isinstance(colunas[0], str):
+            avisos.append(("info", "Cabeçalho da planilha não reconhecido; as colunas foram mapeadas pela posição (A: Recepção, B: Data, D: Atendimento, E: Recomendação, F: Comentário)."))
+        mapeamento = MapeamentoColunas(
+            por_nome=False,
+            posicoes={destino: (posicao if posicao < len(colunas) else None) for destino, posicao in POSICOES_COLUNAS.items()},
+            avisos=tuple(avisos)
+        )
+    
+    mapeamentos[impressao] = mapeamento
+    return mapeamento
+
+# Exibe, uma vez por sessão, as mensagens da leitura e do mapeamento de colunas dos dados
+def exibir_avisos_leitura(dados):
+    exibidos = st.session_state.setdefault("avisos_leitura_exibidos", set())
+    for tipo, texto in tuple(dados.get("avisos", ())) + tuple(dados["df"].attrs.get('avisos_colunas', ())):
+        if texto not in exibidos:
+            exibidos.add(texto)
+            getattr(st, tipo)(texto)
+
+# Função para processar o DataFrame independentemente da origem
+@instrumentar("processar_dataframe")
+def processar_dataframe(df_original, chave_fonte=None):
+    """
+    Normaliza os dados de qualquer origem para as colunas usadas pelo dashboard.
+    
+    Args:
+        df_original: DataFrame lido da fonte
+        chave_fonte: Identificador da fonte (planilha, arquivo...), usado para
+            reaproveitar o formato de data detectado em leituras anteriores
+        
+    Returns:
+        DataFrame normalizado
+    """
+    try:
+        # Verificar se há dados na planilha
+        if df_original.empty:
+            avisar_leitura("error", "A planilha não contém dados")
+            return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
+        
+        # Mapeamento das colunas, resolvido uma vez para cada cabeçalho
+        mapeamento = resolver_mapeamento_colunas(df_original.columns)
+        
+        def coluna_origem(destino, padrao):
+            posicao = mapeamento.posicoes.get(destino)
+            if posicao is None:
+                return pd.Series(padrao, index=df_original.index)
+            return df_original.iloc[:, posicao]
+        
+        # Projeção única para as colunas normalizadas
+        df = pd.DataFrame({
+            'recepcao': coluna_origem('recepcao', None).astype('string').fillna('Não informado'),
+            'timestamp': coluna_origem('timestamp', pd.NaT),
+            'atendimento': coluna_origem('atendimento', np.nan),
+            'recomendacao': coluna_origem('recomendacao', np.nan),
+            'comentario': coluna_origem('comentario', "").astype('string')
+        }, index=df_original.index)
+        
+        # Converter timestamp para datetime (formato detectado uma vez por fonte)
+        try:
+            df['timestamp'], df['timestamp_invalido'] = converter_timestamps(df['timestamp'], chave_fonte)
+        except Exception as e:
+            # Em caso de erro, volta para o método padrão
+            avisar_leitura("warning", f"Erro ao processar datas no formato brasileiro: {e}. Tentando formato automático.")
+            df['timestamp_invalido'] = pd.Series(pd.NA, index=df.index, dtype='string')
+            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+        
+        # Converter notas para tipos compactos (Int8 quando todas são inteiras)
+        df['atendimento'] = compactar_notas(df['atendimento'])
+        df['recomendacao'] = compactar_notas(df['recomendacao'])
+        
+        # Colunas de período para facilitar filtragem (ano e mês ficam na chave AAAAMM)
+        ano = df['timestamp'].dt.year.astype('Int32')
+        mes = df['timestamp'].dt.month.astype('Int32')
+        df['mes_nome'] = pd.Categorical.from_codes(
+            (mes - 1).fillna(-1).astype(np.int8), categories=MESES_PT
+        )  # Nome do mês em português
+        df['ano_mes'] = chave_periodo(ano, mes).astype('category')  # Chave AAAAMM
+        
+        # Ordenar por data para que os períodos possam ser recortados por busca binária
+        df = ordenar_por_timestamp(compactar_avaliacoes(df))
+        if mapeamento.avisos:
+            df.attrs['avisos_colunas'] = mapeamento.avisos
+        return df
+        
+    except Exception as e:
+        avisar_leitura("error", f"Erro ao processar dados: {e}")
         # Retornar DataFrame vazio em caso de erro
         return pd.DataFrame(columns=['recepcao', 'timestamp', 'atendimento', 'recomendacao', 'comentario'])
 
-# Função para filtrar dados por período
-def filtrar_por_periodo(df, periodo=None):
+# Ordena o DataFrame normalizado por data (datas ausentes no fim)
+def ordenar_por_timestamp(df):
+    if df['timestamp'].is_monotonic_increasing:
+        return df
+    return df.sort_values('timestamp', kind='stable', na_position='last', ignore_index=True)
+
+# Índice de posições sobre o DataFrame ordenado por timestamp
+@dataclass(frozen=True)
+class IndiceTemporal:
+    """Posições de cada mês e de cada recepção em um DataFrame normalizado"""
+    versao: str
+    timestamps: np.ndarray
+    n_validos: int
+    limites_mes: Dict[int, Tuple[int, int]]
+    posicoes_recepcao: Dict[str, np.ndarray]
+
+@instrumentar("indice_temporal")
+def construir_indice_temporal(df, versao=""):
+    """
+    Constrói o índice temporal de um DataFrame normalizado, que deve estar
+    ordenado por timestamp (datas ausentes no fim).
+    
+    Args:
+        df: DataFrame normalizado e ordenado
+        versao: Versão dos dados indexados
+        
+    Returns:
+        IndiceTemporal com os limites [início, fim) de cada mês e as
+        posições (ordenadas) das linhas de cada recepção
+    """
+    timestamps = df['timestamp'].to_numpy()
+    n_validos = int(df['timestamp'].notna().sum())
+    
+    # Com o DataFrame ordenado, as linhas de cada mês são contíguas
+    chaves = df['ano_mes'].iloc[:n_validos].to_numpy(dtype=np.int64)
+    meses, inicios = np.unique(chaves, return_index=True)
+    fins = np.append(inicios[1:], n_validos)
+    limites_mes = {int(m): (int(i), int(f)) for m, i, f in zip(meses, inicios, fins)}
+    
+    # Posições de cada recepção, agrupadas por código e em ordem crescente
+    codigos, recepcoes = pd.factorize(df['recepcao'])
+    ordem = np.argsort(codigos, kind='stable')
+    contagens = np.bincount(codigos[codigos >= 0], minlength=len(recepcoes))
+    fronteiras = np.concatenate([[0], np.cumsum(contagens)]) + int((codigos < 0).sum())
+    posicoes_recepcao = {
+        str(recepcao): ordem[fronteiras[i]:fronteiras[i + 1]]
+        for i, recepcao in enumerate(recepcoes)
+    }
+    
+    return IndiceTemporal(versao, timestamps, n_validos, limites_mes, posicoes_recepcao)
+
+# Índice temporal compartilhado, reconstruído apenas quando a versão dos dados muda
+@st.cache_resource(max_entries=32)
+def obter_indice_temporal(versao: str, _df: pd.DataFrame) -> IndiceTemporal:
+    return construir_indice_temporal(_df, versao)
+
+# Converte o período selecionado em posições [início, fim) no DataFrame ordenado
+def posicoes_do_periodo(indice, periodo=None):
+    """
+    Args:
+        indice: IndiceTemporal do DataFrame
+        periodo: None/"Todos", "Atual", chave AAAAMM ou tupla (data_inicial, data_final)
+        
+    Returns:
+        Tupla (início, fim) de posições
+    """
+    if not periodo or periodo == "Todos":
+        return 0, len(indice.timestamps)
+    
+    # Intervalo de datas arbitrário (data final inclusiva)
+    if isinstance(periodo, tuple):
+        data_inicial, data_final = periodo
+        limites = np.array([
+            np.datetime64(data_inicial, 'D'),
+            np.datetime64(data_final, 'D') + 1
+        ]).astype(indice.timestamps.dtype)
+        inicio, fim = np.searchsorted(indice.timestamps[:indice.n_validos], limites, side='left')
+        return int(inicio), int(fim)
+    
+    if periodo == "Atual":
+        agora = datetime.datetime.now()
+        periodo = chave_periodo(agora.year, agora.month)
+    
+    return indice.limites_mes.get(int(periodo), (0, 0))
+
+# Filtra por período e recepção usando o índice temporal (fatias, sem varrer as linhas)
+def filtrar_avaliacoes(df, indice, periodo=None, recepcao=None):
+    inicio, fim = posicoes_do_periodo(indice, periodo)
+    
+    if not recepcao or recepcao == 'Todas':
+        return df.iloc[inicio:fim]
+    
+    posicoes = indice.posicoes_recepcao.get(recepcao)
+    if posicoes is None:
+        return df.iloc[0:0]
+    
+    a, b = np.searchsorted(posicoes, [inicio, fim], side='left')
+    return df.take(posicoes[a:b])
+
+# Avaliações exibidas por vez na tabela de últimas avaliações
+TAMANHO_PAGINA_AVALIACOES = 50
+
+def posicoes_mais_recentes(df, quantidade):
+    """
+    Posições das avaliações mais recentes de um DataFrame ordenado por
+    timestamp (datas ausentes no fim), da mais recente para a mais antiga.
+    As avaliações sem data vêm por último. Nada é ordenado: as posições
+    saem da ordem que o DataFrame já tem.
+    """
+    n_validos = int(df['timestamp'].notna().sum())
+    ordem = np.arange(min(quantidade, len(df)))
+    return np.where(ordem < n_validos, n_validos - 1 - ordem, ordem)
+
+# Cor de uma nota na tabela de avaliações
+def color_notas(val):
+    if pd.isna(val) or not isinstance(val, (int, float)):
+        return ''
+    
+    val = float(val)
+    if val >= 9:
+        return 'color: #22c55e; font-weight: bold'  # Verde mais claro
+    elif val >= 7:
+        return 'color: #3b82f6; font-weight: bold'  # Azul mais claro
+    elif val >= 5:
+        return 'color: #eab308; font-weight: bold'  # Amarelo mais claro
+    else:
+        return 'color: #ef4444; font-weight: bold'  # Vermelho mais claro
+
+def formatar_tabela_avaliacoes(pagina):
+    """Formata e aplica as cores às linhas visíveis da tabela de avaliações"""
+    # object: categorias e notas Int8 não aceitam "-" como valor ausente
+    df_display = pd.DataFrame({
+        'Recepção': pagina['recepcao'].astype(object),
+        'Data/Hora': pagina['timestamp'].dt.strftime('%d/%m/%Y %H:%M').astype(object),
+        'Atendimento': pagina['atendimento'].astype(object),
+        'Recomendação': pagina['recomendacao'].astype(object),
+        'Comentário': pagina['comentario'].astype(object)
+    }).fillna("-")
+    
+    # Styler.applymap foi renomeado para Styler.map no pandas 2.1
+    estilo = df_display.style
+    aplicar_estilo = estilo.map if hasattr(estilo, 'map') else estilo.applymap
+    return aplicar_estilo(color_notas, subset=['Atendimento', 'Recomendação'])
+
+# Função para obter lista de períodos disponíveis
+def obter_periodos_disponiveis(df):
+    """
+    Retorna a lista de períodos disponíveis no DataFrame.
+    
+    Args:
+        df: DataFrame com dados
+        
+    Returns:
+        Lista de períodos no formato Mês/Ano
+    """
+    if df.empty or 'ano_mes' not in df.columns:
+        return ["Todos"]
+    
+    return formatar_periodos_disponiveis(df['ano_mes'].dropna().unique())
+
+# Monta as opções do seletor de período a partir das chaves AAAAMM existentes
+def formatar_periodos_disponiveis(chaves):
+    # Obter períodos únicos, mais recentes primeiro
+    periodos = np.sort(np.unique(np.asarray(chaves, dtype=np.int64)))[::-1]
+    periodos = periodos[periodos > 0]
+    
+    # Transformar para formato mais amigável (Mês/Ano)
+    periodos_formatados = [rotulo_periodo(periodo) for periodo in periodos]
+    
+    # Adicionar opções especiais
+    agora = datetime.datetime.now()
+    mes_atual_str = rotulo_periodo(chave_periodo(agora.year, agora.month))
+    
+    # Garantir que não haja duplicação
+    if mes_atual_str not in periodos_formatados:
+        periodos_formatados.insert(0, mes_atual_str)
+    
+    # Adicionar opções "Atual", "Todos" e o intervalo livre no início
+    periodos_formatados = ["Atual", "Todos", "Intervalo personalizado"] + periodos_formatados
+    
+    return periodos_formatados
+
+# Converte período formatado (Mês/Ano) para a chave AAAAMM
+def converter_periodo_para_formato(periodo):
+    if periodo in ["Todos", "Atual"]:
+        return periodo
+    if periodo == "Intervalo personalizado":
+        return None
+    
+    try:
+        mes, ano = periodo.split('/')
+        return chave_periodo(int(ano), MESES_PT.index(mes) + 1)
+    except:
+        return None
+
+# Funções para cálculos
+@dataclass(frozen=True)
+class EstatisticasNotas:
+    """Resumo das notas de um conjunto de avaliações"""
+    n_atendimento: int = 0
+    n_recomendacao: int = 0
+    promotores: int = 0
+    neutros: int = 0
+    detratores: int = 0
+    media_atendimento: float = 0.0
+    media_recomendacao: float = 0.0
+    erro_padrao_atendimento: float = 0.0
+    erro_padrao_recomendacao: float = 0.0
+    nps: float = 0.0
+    erro_padrao_nps: float = 0.0
+    
+    @property
+    def percentual_promotores(self):
+        return (self.promotores / self.n_recomendacao) * 100 if self.n_recomendacao else 0
+    
+    @property
+    def percentual_neutros(self):
+        return (self.neutros / self.n_recomendacao) * 100 if self.n_recomendacao else 0
+    
+    @property
+    def percentual_detratores(self):
+        return (self.detratores / self.n_recomendacao) * 100 if self.n_recomendacao else 0
+
+# Converte uma coleção de notas em vetor float64 (NaN para valores ausentes)
+def notas_para_array(notas):
+    if isinstance(notas, pd.Series):
+        return pd.to_numeric(notas, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    return pd.to_numeric(pd.Series(notas, dtype='object'), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+# Média e erro padrão de um vetor de notas, ignorando NaN
+def media_e_erro_padrao(valores):
+    validos = valores[~np.isnan(valores)]
+    n = len(validos)
+    if n == 0:
+        return 0, 0.0, 0.0
+    media = float(validos.mean())
+    erro_padrao = float(validos.std(ddof=1) / np.sqrt(n)) if n > 1 else 0.0
+    return n, media, erro_padrao
+
+def calcular_estatisticas_notas(atendimento, recomendacao):
+    """
+    Calcula de uma só vez as estatísticas usadas pelo dashboard: contagens,
+    promotores/neutros/detratores, NPS, médias e erros padrão.
+    
+    Todo o cálculo é vetorizado com NumPy, sem laços em Python por elemento.
+    
+    Args:
+        atendimento: Notas de atendimento (Series, array ou lista)
+        recomendacao: Notas de recomendação (Series, array ou lista)
+        
+    Returns:
+        EstatisticasNotas com o resumo
+    """
+    n_atendimento, media_atendimento, ep_atendimento = media_e_erro_padrao(notas_para_array(atendimento))
+    
+    notas_rec = notas_para_array(recomendacao)
+    n_recomendacao, media_recomendacao, ep_recomendacao = media_e_erro_padrao(notas_rec)
+    
+    if n_recomendacao == 0:
+        return EstatisticasNotas(
+            n_atendimento=n_atendimento,
+            media_atendimento=media_atendimento,
+            erro_padrao_atendimento=ep_atendimento
+        )
+    
+    # Comparações com NaN são falsas, então valores ausentes não entram nas contagens
+    promotores = int(np.count_nonzero(notas_rec >= 9))
+    detratores = int(np.count_nonzero(notas_rec <= 6))
+    neutros = int(np.count_nonzero((notas_rec >= 7) & (notas_rec <= 8)))
+    
+    p_promotores = promotores / n_recomendacao
+    p_detratores = detratores / n_recomendacao
+    nps = (p_promotores - p_detratores) * 100
+    variancia_nps = max(p_promotores + p_detratores - (p_promotores - p_detratores) ** 2, 0.0)
+    erro_padrao_nps = float(np.sqrt(variancia_nps / n_recomendacao) * 100)
+    
+    return EstatisticasNotas(
+        n_atendimento=n_atendimento,
+        n_recomendacao=n_recomendacao,
+        promotores=promotores,
+        neutros=neutros,
+        detratores=detratores,
+        media_atendimento=media_atendimento,
+        media_recomendacao=media_recomendacao,
+        erro_padrao_atendimento=ep_atendimento,
+        erro_padrao_recomendacao=ep_recomendacao,
+        nps=nps,
+        erro_padrao_nps=erro_padrao_nps
+    )
+
+def calcular_distribuicao_notas(df, grupo=None):
+    """
+    Calcula a distribuição das notas de atendimento e recomendação (0 a 10)
+    com uma única contagem (np.bincount) sobre as duas colunas.
+    
+    Notas não inteiras são arredondadas para a nota mais próxima; notas fora
+    do intervalo 0-10 são contadas como inválidas e ficam em
+    df.attrs['invalidas']. Valores ausentes são ignorados.
+    
+    Args:
+        df: DataFrame com as colunas 'atendimento' e 'recomendacao'
+        grupo: Coluna opcional (ex.: 'filial') para calcular uma distribuição
+            por grupo na mesma contagem
+        
+    Returns:
+        DataFrame no formato longo (nota, tipo, contagem), pronto para o
+        gráfico de barras; com grupo, a primeira coluna é o grupo
+    """
+    tipos = ['atendimento', 'recomendacao']
+    n_faixas = 12  # notas 0 a 10 + faixa de inválidas
+    
+    if grupo is not None:
+        codigos_grupo, grupos = pd.factorize(df[grupo], sort=True)
+    else:
+        codigos_grupo, grupos = np.zeros(len(df), dtype=np.int64), [None]
+    
+    codigos = []
+    for i, tipo in enumerate(tipos):
+        notas = notas_para_array(df[tipo]) if tipo in df.columns else np.full(len(df), np.nan)
+        validas = ~np.isnan(notas)
+        faixas = np.floor(notas[validas] + 0.5)
+        faixas = np.where((faixas >= 0) & (faixas <= 10), faixas, n_faixas - 1).astype(np.int64)
+        codigos.append((codigos_grupo[validas] * len(tipos) + i) * n_faixas + faixas)
+    
+    contagens = np.bincount(
+        np.concatenate(codigos), minlength=len(grupos) * len(tipos) * n_faixas
+    ).reshape(len(grupos), len(tipos), n_faixas)
+    
+    distribuicao = pd.DataFrame({
+        'nota': np.tile(np.arange(11), len(grupos) * len(tipos)),
+        'tipo': np.tile(np.repeat(tipos, 11), len(grupos)),
+        'contagem': contagens[:, :, :11].ravel()
+    })
+    if grupo is not None:
+        distribuicao.insert(0, grupo, np.repeat(np.asarray(grupos, dtype=object), len(tipos) * 11))
+    distribuicao.attrs['invalidas'] = {tipo: int(contagens[:, i, -1].sum()) for i, tipo in enumerate(tipos)}
+    
+    return distribuicao
+
+# Cubo de agregados por (recepcao, ano_mes, hora)
+COLUNAS_CUBO = [
+    'n_linhas',
+    'n_atendimento', 'soma_atendimento', 'soma2_atendimento',
+    'n_recomendacao', 'soma_recomendacao', 'soma2_recomendacao',
+    'promotores', 'neutros', 'detratores'
+]
+
+@instrumentar("cubo_agregados")
+def calcular_cubo_agregados(df):
+    """
+    Agrega as avaliações por recepção, mês (ano_mes) e hora do dia, guardando
+    contagens, somas, somas dos quadrados e a contagem de cada faixa do NPS.
+    
+    Linhas sem data entram com ano_mes 0 e hora -1, para que continuem
+    contando nas métricas do período "Todos".
+    
+    Args:
+        df: DataFrame normalizado
+        
+    Returns:
+        DataFrame indexado por (recepcao, ano_mes, hora) com COLUNAS_CUBO
+    """
+    if df.empty:
+        indice = pd.MultiIndex.from_arrays([[], [], []], names=['recepcao', 'ano_mes', 'hora'])
+        return pd.DataFrame(0, index=indice, columns=COLUNAS_CUBO)
+    
+    atendimento = pd.Series(notas_para_array(df['atendimento']), index=df.index)
+    recomendacao = pd.Series(notas_para_array(df['recomendacao']), index=df.index)
+    
+    base = pd.DataFrame({
+        'recepcao': df['recepcao'].astype(str),
+        'ano_mes': df['ano_mes'].astype('Int64').fillna(0).to_numpy(dtype=np.int64),
+        'hora': df['timestamp'].dt.hour.fillna(-1).astype(np.int64),
+        'n_linhas': 1,
+        'n_atendimento': atendimento.notna().astype(np.int64),
+        'soma_atendimento': atendimento.fillna(0),
+        'soma2_atendimento': atendimento.fillna(0) ** 2,
+        'n_recomendacao': recomendacao.notna().astype(np.int64),
+        'soma_recomendacao': recomendacao.fillna(0),
+        'soma2_recomendacao': recomendacao.fillna(0) ** 2,
+        'promotores': (recomendacao >= 9).astype(np.int64),
+        'neutros': ((recomendacao >= 7) & (recomendacao <= 8)).astype(np.int64),
+        'detratores': (recomendacao <= 6).astype(np.int64)
+    })
+    
+    return base.groupby(['recepcao', 'ano_mes', 'hora']).sum()
+
+# Soma dois cubos de agregados (usado para incorporar linhas novas)
+def combinar_cubos(cubo, cubo_novo):
+    if cubo_novo.empty:
+        return cubo
+    if cubo.empty:
+        return cubo_novo
+    return cubo.add(cubo_novo, fill_value=0)
+
+# Filtra o cubo pelo período e pela recepção selecionados
+def filtrar_cubo(cubo, periodo=None, recepcao=None):
+    if recepcao and recepcao != 'Todas':
+        cubo = cubo[cubo.index.get_level_values('recepcao') == recepcao]
+    
+    if not periodo or periodo == "Todos":
+        return cubo
+    
+    if periodo == "Atual":
+        agora = datetime.datetime.now()
+        periodo = chave_periodo(agora.year, agora.month)
+    
+    return cubo[cubo.index.get_level_values('ano_mes') == int(periodo)]
+
+# Indicadores (médias, erros padrão, NPS) a partir das somas do cubo
+def calcular_indicadores(somas):
+    """
+    Calcula os indicadores de cada linha de um DataFrame com as COLUNAS_CUBO
+    já somadas (por exemplo, uma linha por filial), de forma vetorizada.
+    
+    Args:
+        somas: DataFrame com as COLUNAS_CUBO
+        
+    Returns:
+        DataFrame com os campos de EstatisticasNotas, os percentuais e
+        'n_linhas', no mesmo índice de somas
+    """
+    indicadores = pd.DataFrame(index=somas.index)
+    indicadores['n_linhas'] = somas['n_linhas'].astype(np.int64)
+    
+    for prefixo in ['atendimento', 'recomendacao']:
+        n = somas[f'n_{prefixo}'].astype('float64')
+        soma = somas[f'soma_{prefixo}'].astype('float64')
+        n_seguro = n.where(n > 0)
+        media = (soma / n_seguro).fillna(0.0)
+        variancia = ((somas[f'soma2_{prefixo}'] - soma * soma / n_seguro) / (n - 1).where(n > 1)).clip(lower=0)
+        
+        indicadores[f'n_{prefixo}'] = n.astype(np.int64)
+        indicadores[f'media_{prefixo}'] = media
+        indicadores[f'erro_padrao_{prefixo}'] = np.sqrt(variancia / n_seguro).fillna(0.0)
+    
+    n_recomendacao = somas['n_recomendacao'].astype('float64').where(somas['n_recomendacao'] > 0)
+    for faixa in ['promotores', 'neutros', 'detratores']:
+        indicadores[faixa] = somas[faixa].astype(np.int64)
+        indicadores[f'percentual_{faixa}'] = (somas[faixa] / n_recomendacao * 100).fillna(0.0)
+    
+    p_promotores = somas['promotores'] / n_recomendacao
+    p_detratores = somas['detratores'] / n_recomendacao
+    indicadores['nps'] = ((p_promotores - p_detratores) * 100).fillna(0.0)
+    variancia_nps = (p_promotores + p_detratores - (p_promotores - p_detratores) ** 2).clip(lower=0)
+    indicadores['erro_padrao_nps'] = (np.sqrt(variancia_nps / n_recomendacao) * 100).fillna(0.0)
+    
+    return indicadores
+
+# Estatísticas das notas a partir de um cubo (já filtrado)
+def estatisticas_do_cubo(cubo):
+    """
+    Calcula as mesmas estatísticas de calcular_estatisticas_notas usando
+    apenas os totais do cubo de agregados.
+    
+    Args:
+        cubo: Cubo de agregados (possivelmente filtrado)
+        
+    Returns:
+        EstatisticasNotas com o resumo
+    """
+    totais = cubo[COLUNAS_CUBO].sum().to_frame().T
+    linha = calcular_indicadores(totais).iloc[0]
+    
+    valores = {}
+    for campo, tipo in EstatisticasNotas.__annotations__.items():
+        valores[campo] = int(linha[campo]) if tipo is int else float(linha[campo])
+    
+    return EstatisticasNotas(**valores)
+
+# Médias mensais a partir do cubo
+def calcular_evolucao_mensal(cubo):
+    mensal = cubo.groupby(level='ano_mes').sum()
+    mensal = mensal[mensal.index != 0]
+    if mensal.empty:
+        return pd.DataFrame()
+    
+    evolucao = pd.DataFrame({
+        'ano_mes': mensal.index,
+        'atendimento': (mensal['soma_atendimento'] / mensal['n_atendimento'].replace(0, np.nan)).to_numpy(),
+        'recomendacao': (mensal['soma_recomendacao'] / mensal['n_recomendacao'].replace(0, np.nan)).to_numpy()
+    })
+    
+    return evolucao.sort_values('ano_mes').reset_index(drop=True)
+
+def calcular_tendencia_diaria(cubo):
+    """
+    Médias por hora do dia a partir do cubo de agregados (já filtrado).
+    
+    Returns:
+        DataFrame com 'periodo' (HH:00), 'atendimento' e 'recomendacao'
+    """
+    if cubo.empty:
+        return pd.DataFrame()
+    
+    por_hora = cubo.groupby(level='hora').sum()
+    por_hora = por_hora[por_hora.index >= 0].sort_index()
+    
+    # Verificar se há valores de timestamp válidos
+    if por_hora.empty:
+        return pd.DataFrame()
+    
+    return pd.DataFrame({
+        'periodo': [f"{hora:02d}:00" for hora in por_hora.index],
+        'atendimento': (por_hora['soma_atendimento'] / por_hora['n_atendimento'].replace(0, np.nan)).to_numpy(),
+        'recomendacao': (por_hora['soma_recomendacao'] / por_hora['n_recomendacao'].replace(0, np.nan)).to_numpy()
+    })
+
+def categoria_de_nps(nps):
+    if nps >= 75:
+        return "Excelente", "#22c55e"
+    if nps >= 50:
+        return "Bom", "#3b82f6"
+    if nps >= 0:
+        return "Regular", "#eab308"
+    return "Crítico", "#ef4444"
+
+def exibir_relatorio_memoria(filiais):
+    """Mostra a memória ocupada pelos dados de cada filial já carregada"""
+    carregadas = {}
+    for nome, filial_config in filiais.items():
+        dados = obter_dados_em_memoria(filial_config)
+        if dados is not None and not dados["df"].empty:
+            carregadas[nome] = (len(dados["df"]), relatorio_memoria(dados["df"]))
+    if not carregadas:
+        return
+    
+    total_mb = sum(relatorio['MB'].sum() for _, relatorio in carregadas.values())
+    with st.sidebar.expander(f"📦 Memória dos dados ({total_mb:.1f} MB)"):
+        for nome, (n_linhas, relatorio) in carregadas.items():
+            st.markdown(
+                f"**{nome}**: {n_linhas} linhas, {relatorio['MB'].sum():.1f} MB "
+                f"({relatorio['Bytes por linha'].sum():.0f} bytes por linha)"
+            )
+            st.dataframe(relatorio.round(2), hide_index=True)
+
+# Opção do seletor de filial que compara todas as filiais lado a lado
+OPCAO_TODAS_FILIAIS = "Todas as filiais"
+
+def carregar_dados_filiais(filiais):
     """
-    Filtra o DataFrame de acordo com o período selecionado.
+    Carrega todas as filiais em paralelo.
     
     Args:
-        df: DataFrame original
-        periodo: Período para filtrar (formato 'YYYY-MM' ou None para todos)
+        filiais: Dicionário {nome da filial: configuração}
+        
+    Returns:
+        Dicionário {nome da filial: dados} com "df", "versao" e "cubo" de uma
+        mesma leitura de cada filial
+    """
+    carregador = obter_carregador_filiais()
+    futuros = {nome: carregador["executor"].submit(obter_dados_filial, cfg) for nome, cfg in filiais.items()}
+    return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+def carregar_cubos_filiais(dados_filiais):
+    """
+    Junta os cubos de agregados de todas as filiais.
     
+    Args:
+        dados_filiais: Dicionário {nome da filial: dados} de carregar_dados_filiais
+        
     Returns:
-        DataFrame filtrado
+        Cubo consolidado, com o nível 'filial' antes de (recepcao, ano_mes, hora)
     """
-    if not periodo or periodo == "Todos":
-        return df
+    cubos = {nome: dados["cubo"] for nome, dados in dados_filiais.items() if not dados["cubo"].empty}
     
-    # Se o período for "Atual", filtra para o mês atual
-    if periodo == "Atual":
-        mes_atual = datetime.datetime.now().month
-        ano_atual = datetime.datetime.now().year
-        return df[(df['mes'] == mes_atual) & (df['ano'] == ano_atual)]
+    if not cubos:
+        return pd.DataFrame(columns=COLUNAS_CUBO)
     
-    # Caso contrário, filtra pelo período específico (formato YYYY-MM)
-    return df[df['ano_mes'] == periodo]
+    return pd.concat(cubos, names=['filial'])
 
-# Função para obter lista de períodos disponíveis
-def obter_periodos_disponiveis(df):
+def carregar_dados_consolidados(dados_filiais, periodo=None):
     """
-    Retorna a lista de períodos disponíveis no DataFrame.
+    Junta as avaliações do período de todas as filiais em um único DataFrame
+    com a coluna categórica 'filial'.
     
     Args:
-        df: DataFrame com dados
+        dados_filiais: Dicionário {nome da filial: dados} de carregar_dados_filiais
+        periodo: Período no formato interno (None/"Todos", "Atual" ou chave AAAAMM)
         
     Returns:
-        Lista de períodos no formato YYYY-MM
+        DataFrame com as avaliações do período de todas as filiais
     """
-    if df.empty or 'ano_mes' not in df.columns:
-        return ["Todos"]
+    # Recorta o período de cada filial pelo seu índice temporal antes de juntar
+    fatias = {}
+    for nome, dados in dados_filiais.items():
+        df = dados["df"]
+        exibir_avisos_leitura(dados)
+        if df.empty:
+            continue
+        indice = obter_indice_temporal(df.attrs.get('versao') or calcular_versao_dados(df), df)
+        fatias[nome] = filtrar_avaliacoes(df, indice, periodo)
     
-    # Obter períodos únicos
-    periodos = df['ano_mes'].unique().tolist()
-    periodos.sort(reverse=True)  # Mais recentes primeiro
+    if not fatias:
+        return pd.DataFrame(columns=['filial'] + COLUNAS_NORMALIZADAS)
     
-    # Transformar para formato mais amigável (Mês/Ano)
-    periodos_formatados = []
-    meses_pt = {
-        '01': 'Janeiro', '02': 'Fevereiro', '03': 'Março', 
-        '04': 'Abril', '05': 'Maio', '06': 'Junho',
-        '07': 'Julho', '08': 'Agosto', '09': 'Setembro',
-        '10': 'Outubro', '11': 'Novembro', '12': 'Dezembro'
-    }
+    df_todas = concatenar_avaliacoes([fatia.assign(filial=nome) for nome, fatia in fatias.items()])
+    df_todas['filial'] = pd.Categorical(df_todas['filial'], categories=list(fatias))
+    df_todas = df_todas[['filial'] + [coluna for coluna in df_todas.columns if coluna != 'filial']]
     
-    for periodo in periodos:
-        if pd.notna(periodo):
-            ano, mes = periodo.split('-')
-            nome_mes = meses_pt.get(mes, mes)
-            periodos_formatados.append(f"{nome_mes}/{ano}")
+    return df_todas
+
+def exibir_visao_consolidada(filiais):
+    """
+    Exibe a comparação lado a lado de todas as filiais configuradas.
     
-    # Adicionar opções especiais
-    mes_atual = datetime.datetime.now().month
-    ano_atual = datetime.datetime.now().year
-    mes_atual_str = f"{meses_pt[f'{mes_atual:02d}']}/{ano_atual}"
+    Returns:
+        Versões dos dados exibidos, na ordem de filiais (a atualização
+        automática compara com elas)
+    """
+    st.sidebar.header("Filtros")
     
-    # Garantir que não haja duplicação
-    if mes_atual_str not in periodos_formatados:
-        periodos_formatados.insert(0, mes_atual_str)
+    # Cubos e linhas vêm da mesma leitura de cada filial
+    dados_filiais = carregar_dados_filiais(filiais)
+    versoes_exibidas = [dados["versao"] for dados in dados_filiais.values()]
     
-    # Adicionar opções "Atual" e "Todos" no início
-    periodos_formatados = ["Atual", "Todos"] + periodos_formatados
+    # Períodos disponíveis em qualquer filial (lidos dos cubos, sem varrer as linhas)
+    cubo_todas = carregar_cubos_filiais(dados_filiais)
+    if cubo_todas.empty:
+        st.warning("Nenhum dado encontrado ou erro na conexão com a fonte de dados.")
+        return versoes_exibidas
     
-    return periodos_formatados
-
-# Converte período formatado (Mês/Ano) para formato YYYY-MM
-def converter_periodo_para_formato(periodo):
-    if periodo in ["Todos", "Atual"]:
-        return periodo
+    periodos_disponiveis = [
+        p for p in formatar_periodos_disponiveis(cubo_todas.index.get_level_values('ano_mes'))
+        if p != "Intervalo personalizado"
+    ]
+    periodo_selecionado = st.sidebar.selectbox("Período de análise:", options=periodos_disponiveis, index=0)
+    periodo_formatado = converter_periodo_para_formato(periodo_selecionado)
     
-    # Converter de "Mês/Ano" para "YYYY-MM"
-    meses_pt_inverso = {
-        'Janeiro': '01', 'Fevereiro': '02', 'Março': '03', 
-        'Abril': '04', 'Maio': '05', 'Junho': '06',
-        'Julho': '07', 'Agosto': '08', 'Setembro': '09',
-        'Outubro': '10', 'Novembro': '11', 'Dezembro': '12'
-    }
+    df_todas = carregar_dados_consolidados(dados_filiais, periodo_formatado)
+    cubo_filtrado = filtrar_cubo(cubo_todas, periodo_formatado)
     
-    try:
-        mes, ano = periodo.split('/')
-        mes_num = meses_pt_inverso.get(mes, mes)
-        return f"{ano}-{mes_num}"
-    except:
-        return None
-
-# Funções para cálculos
-def calcular_nps(notas):
-    # Remover valores NaN, se houver
-    notas = [n for n in notas if not pd.isna(n)]
+    # Indicadores de todas as filiais em uma única agregação
+    somas = cubo_filtrado[COLUNAS_CUBO].groupby(level='filial', sort=False).sum()
+    somas = somas.reindex(list(cubo_todas.index.unique(level='filial')), fill_value=0)
+    indicadores = calcular_indicadores(somas)
     
-    if len(notas) == 0:
-        return 0
+    st.sidebar.metric("Avaliações no período", int(indicadores['n_linhas'].sum()))
     
-    promotores = sum(nota >= 9 for nota in notas)
-    detratores = sum(nota <= 6 for nota in notas)
+    # Resumo por filial
+    st.markdown("### Resumo por Filial")
+    resumo = pd.DataFrame({
+        'Filial': indicadores.index,
+        'Avaliações': indicadores['n_linhas'].to_numpy(),
+        'NPS': indicadores['nps'].round(0).to_numpy(),
+        'Média de Atendimento': indicadores['media_atendimento'].round(1).to_numpy(),
+        'Média de Recomendação': indicadores['media_recomendacao'].round(1).to_numpy(),
+        'Promotores (%)': indicadores['percentual_promotores'].round(1).to_numpy(),
+        'Neutros (%)': indicadores['percentual_neutros'].round(1).to_numpy(),
+        'Detratores (%)': indicadores['percentual_detratores'].round(1).to_numpy()
+    })
+    st.dataframe(resumo, hide_index=True, use_container_width=True)
     
-    return ((promotores / len(notas)) - (detratores / len(notas))) * 100
-
-def calcular_percentual_promotores(notas):
-    # Converter para lista e filtrar valores NaN
-    notas = [n for n in notas if not pd.isna(n)]
+    comp_col1, comp_col2 = st.columns(2)
     
-    if len(notas) == 0:
-        return 0
-    return (sum(nota >= 9 for nota in notas) / len(notas)) * 100
-
-def calcular_percentual_neutros(notas):
-    # Converter para lista e filtrar valores NaN
-    notas = [n for n in notas if not pd.isna(n)]
+    with comp_col1:
+        st.markdown("### Net Promoter Score")
+        fig_nps = go.Figure(go.Bar(
+            x=indicadores.index,
+            y=indicadores['nps'],
+            error_y=dict(type='data', array=indicadores['erro_padrao_nps']),
+            marker_color=[categoria_de_nps(nps)[1] for nps in indicadores['nps']]
+        ))
+        fig_nps.update_layout(yaxis=dict(range=[-100, 100]), yaxis_title="NPS")
+        st.plotly_chart(fig_nps, use_container_width=True)
     
-    if len(notas) == 0:
-        return 0
-    return (sum(7 <= nota <= 8 for nota in notas) / len(notas)) * 100
-
-def calcular_percentual_detratores(notas):
-    # Converter para lista e filtrar valores NaN
-    notas = [n for n in notas if not pd.isna(n)]
+    with comp_col2:
+        st.markdown("### Médias")
+        fig_medias = go.Figure()
+        fig_medias.add_trace(go.Bar(
+            x=indicadores.index, y=indicadores['media_atendimento'], name='Atendimento', marker_color='#3b82f6'
+        ))
+        fig_medias.add_trace(go.Bar(
+            x=indicadores.index, y=indicadores['media_recomendacao'], name='Recomendação', marker_color='#22c55e'
+        ))
+        fig_medias.update_layout(barmode='group', yaxis=dict(range=[0, 10]), yaxis_title="Média")
+        st.plotly_chart(fig_medias, use_container_width=True)
     
-    if len(notas) == 0:
-        return 0
-    return (sum(nota <= 6 for nota in notas) / len(notas)) * 100
+    comp_col3, comp_col4 = st.columns(2)
+    
+    with comp_col3:
+        st.markdown("### Distribuição de Notas de Recomendação")
+        distribuicao_df = calcular_distribuicao_notas(df_todas, grupo='filial')
+        fig_dist = px.bar(
+            distribuicao_df[distribuicao_df['tipo'] == 'recomendacao'],
+            x='nota',
+            y='contagem',
+            color='filial',
+            barmode='group',
+            labels={'contagem': 'Quantidade', 'nota': 'Nota', 'filial': 'Filial'}
+        )
+        fig_dist.update_layout(legend_title_text='')
+        st.plotly_chart(fig_dist, use_container_width=True)
+    
+    with comp_col4:
+        st.markdown("### Evolução do NPS por Período")
+        mensal = cubo_todas[COLUNAS_CUBO].groupby(level=['filial', 'ano_mes'], sort=True).sum()
+        mensal = mensal[mensal.index.get_level_values('ano_mes') != 0]
+        
+        if not mensal.empty:
+            evolucao = calcular_indicadores(mensal).reset_index()
+            fig_evol = go.Figure()
+            for filial, dados_filial in evolucao.groupby('filial', sort=False):
+                fig_evol.add_trace(go.Scatter(
+                    x=[rotulo_periodo(chave, abreviado=True) for chave in dados_filial['ano_mes']],
+                    y=dados_filial['nps'],
+                    name=filial,
+                    mode='lines+markers'
+                ))
+            fig_evol.update_layout(yaxis=dict(range=[-100, 100]), xaxis_title="Período", yaxis_title="NPS")
+            st.plotly_chart(fig_evol, use_container_width=True)
+        else:
+            st.info("Não há dados suficientes para exibir a evolução por período")
+    
+    return versoes_exibidas
+
+# Decorador de fragmento (reexecução parcial da página), conforme a versão do Streamlit
+if hasattr(st, "fragment"):
+    FRAGMENTO_STREAMLIT = st.fragment
+elif hasattr(st, "experimental_fragment"):
+    FRAGMENTO_STREAMLIT = st.experimental_fragment
+else:
+    FRAGMENTO_STREAMLIT = None
 
-def calcular_distribuicao_notas(df):
-    distribuicao = []
+# Versão dos dados de uma filial, usada para saber se há avaliações novas
+def obter_versao_dados(filial_config):
+    """
+    Retorna apenas a versão (contagem + hash) dos dados da filial, lida do
+    gerenciador compartilhado sem copiar o DataFrame.
+    """
+    return obter_dados_filial(filial_config)["versao"]
+
+# Sistema de atualização automática: só recarrega quando os dados mudaram
+def agendar_atualizacao_automatica(atualizar_automaticamente, intervalo_atualizacao, filiais_exibidas, versoes_exibidas):
+    """
+    Verifica periodicamente, dentro de um fragmento, se a versão dos dados
+    exibidos mudou. Só quando há avaliações novas a página é reexecutada
+    (st.rerun), mantendo a sessão e o estado dos filtros.
+    
+    Args:
+        atualizar_automaticamente: Se a verificação periódica está ativa
+        intervalo_atualizacao: Intervalo entre verificações, em segundos
+        filiais_exibidas: Configurações das filiais exibidas na página
+        versoes_exibidas: Versões dos dados no momento em que a página foi montada
+    """
+    if not atualizar_automaticamente:
+        st.info("Atualização automática desativada. Clique em 'Atualizar agora' para atualizar os dados.")
+        return
     
-    for i in range(11):  # 0 a 10
-        atendimento_count = len(df[df['atendimento'] == i])
-        recomendacao_count = len(df[df['recomendacao'] == i])
+    st.markdown("---")
+    
+    if FRAGMENTO_STREAMLIT is not None:
+        @FRAGMENTO_STREAMLIT(run_every=intervalo_atualizacao)
+        def verificar_novos_dados():
+            versoes_atuais = [obter_versao_dados(filial_config) for filial_config in filiais_exibidas]
+            if versoes_atuais != versoes_exibidas:
+                st.rerun()
+            
+            st.info(
+                f"Dados verificados às {time.strftime('%H:%M:%S')}, sem novas avaliações. "
+                f"Nova verificação a cada {intervalo_atualizacao} segundos."
+            )
         
-        distribuicao.append({
-            'nota': i,
-            'atendimento': atendimento_count,
-            'recomendacao': recomendacao_count
-        })
+        verificar_novos_dados()
+        return
     
-    return pd.DataFrame(distribuicao)
+    # Versões antigas do Streamlit, sem fragmentos: recarregar a página inteira
+    atualizacao_info = st.empty()
+    
+    # Exibir informação sobre a próxima atualização
+    tempo_atual = int(time.time())
+    proxima_atualizacao = tempo_atual + intervalo_atualizacao
+    
+    atualizacao_info.info(f"Próxima atualização automática às {time.strftime('%H:%M:%S', time.localtime(proxima_atualizacao))}")
+    
+    # Adicionar script JavaScript para recarregar a página após o intervalo
+    # Isso é mais confiável que usar sleep() que pode bloquear a thread
+    js_code = f"""
+    <script>
+        // Programar recarregamento da página
+        setTimeout(function() {{
+            window.location.reload();
+        }}, {intervalo_atualizacao * 1000});
+    </script>
+    """
+    st.markdown(js_code, unsafe_allow_html=True)
 
-def calcular_tendencia_diaria(df):
-    if len(df) == 0:
-        return pd.DataFrame()
+# API de métricas (JSON) para painéis e intranet, sem abrir uma sessão do Streamlit
+PORTA_API_METRICAS_PADRAO = 8503
+MAX_RESPOSTAS_API = 256
+RECURSOS_API = ["metricas", "distribuicao", "evolucao", "tendencia"]
+
+# Respostas já calculadas, por ETag (versão dos dados + consulta)
+@st.cache_resource
+def obter_respostas_api() -> Dict[str, Any]:
+    return {"lock": threading.Lock(), "respostas": {}}
+
+# Localiza a filial pelo nome exibido ou pelo nome da conexão
+def localizar_filial_api(nome):
+    for nome_filial, filial_config in carregar_configuracao_planilhas().get("filiais", {}).items():
+        if nome and nome in (nome_filial, filial_config.get("connection_name")):
+            return nome_filial, filial_config
+    return None, None
+
+# Converte o parâmetro "periodo" da API (AAAAMM, Mês/Ano, Todos ou Atual) para a chave interna
+def periodo_da_api(valor):
+    if not valor or valor == "Todos":
+        return "Todos"
+    if valor == "Atual":
+        # Resolvido aqui para que a resposta (e o ETag) mude na virada do mês
+        agora = datetime.datetime.now()
+        return chave_periodo(agora.year, agora.month)
+    if valor.isdigit() and len(valor) == 6:
+        return int(valor)
+    periodo = converter_periodo_para_formato(valor)
+    if periodo is None:
+        raise ValueError(f"Período inválido: {valor}. Use AAAAMM, Mês/Ano, Todos ou Atual.")
+    return periodo
+
+# NaN não é um valor JSON válido
+def valor_json(valor):
+    return None if pd.isna(valor) else float(valor)
+
+def calcular_resposta_api(recurso, dados, recepcao, periodo):
+    """
+    Calcula o conteúdo de um recurso da API a partir dos dados da filial no
+    gerenciador (cubo de agregados e, para a distribuição, o índice temporal).
+    """
+    cubo = filtrar_cubo(dados["cubo"], periodo, recepcao)
     
-    # Criar uma cópia do dataframe para não modificar o original
-    df_temp = df.copy()
+    if recurso == "metricas":
+        estatisticas = estatisticas_do_cubo(cubo)
+        return {
+            "avaliacoes": int(cubo['n_linhas'].sum()),
+            **asdict(estatisticas),
+            "percentual_promotores": estatisticas.percentual_promotores,
+            "percentual_neutros": estatisticas.percentual_neutros,
+            "percentual_detratores": estatisticas.percentual_detratores,
+            "categoria_nps": categoria_de_nps(estatisticas.nps)[0]
+        }
     
-    # Verificar se há valores de timestamp válidos
-    if df_temp['timestamp'].isna().all():
-        return pd.DataFrame()
+    if recurso == "distribuicao":
+        df = dados["df"]
+        indice = obter_indice_temporal(dados["versao"], df)
+        distribuicao = calcular_distribuicao_notas(filtrar_avaliacoes(df, indice, periodo, recepcao))
+        return {
+            tipo: distribuicao.loc[distribuicao['tipo'] == tipo, 'contagem'].astype(int).tolist()
+            for tipo in ['atendimento', 'recomendacao']
+        }
+    
+    if recurso == "evolucao":
+        # A evolução mostra todos os meses; o período é ignorado
+        evolucao = calcular_evolucao_mensal(filtrar_cubo(dados["cubo"], None, recepcao))
+        return [
+            {
+                "periodo": int(linha.ano_mes),
+                "rotulo": rotulo_periodo(linha.ano_mes),
+                "atendimento": valor_json(linha.atendimento),
+                "recomendacao": valor_json(linha.recomendacao)
+            }
+            for linha in evolucao.itertuples()
+        ]
+    
+    tendencia = calcular_tendencia_diaria(cubo)
+    return [
+        {"hora": linha.periodo, "atendimento": valor_json(linha.atendimento), "recomendacao": valor_json(linha.recomendacao)}
+        for linha in tendencia.itertuples()
+    ]
+
+class ManipuladorApiMetricas(BaseHTTPRequestHandler):
+    """
+    API somente leitura com as métricas do dashboard, calculadas sobre os
+    mesmos dados em memória usados pelas telas do Streamlit.
     
-    # Extrair apenas a hora do timestamp
-    df_temp['periodo'] = df_temp['timestamp'].dt.strftime('%H:00')
+    GET /filiais
+    GET /metricas?filial=<filial>&recepcao=<recepção>&periodo=<AAAAMM|Todos|Atual>
+    GET /distribuicao, /evolucao e /tendencia, com os mesmos parâmetros
+    GET /metrics: tempos de cada etapa do pipeline, no formato do Prometheus
     
-    # Agrupar por hora
-    result = df_temp.groupby('periodo').agg({
-        'atendimento': 'mean',
-        'recomendacao': 'mean'
-    }).reset_index()
+    Cada resposta leva um ETag derivado da versão dos dados; uma requisição
+    com If-None-Match igual recebe 304, sem corpo, até chegarem avaliações novas.
+    """
+    
+    def enviar_resposta(self, status, corpo=b"", etag=None, tipo="application/json; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        if etag:
+            self.send_header("ETag", etag)
+        if status != 304:
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(corpo)
+    
+    def enviar_erro(self, status, mensagem):
+        self.enviar_resposta(status, json.dumps({"success": False, "error": mensagem}, ensure_ascii=False).encode("utf-8"))
+    
+    def enviar_com_etag(self, etag, calcular):
+        if etag in [valor.strip() for valor in self.headers.get("If-None-Match", "").split(",")]:
+            self.enviar_resposta(304, etag=etag)
+            return
+        
+        cache = obter_respostas_api()
+        with cache["lock"]:
+            corpo = cache["respostas"].get(etag)
+        
+        if corpo is None:
+            corpo = json.dumps(calcular(), ensure_ascii=False).encode("utf-8")
+            with cache["lock"]:
+                # Descarta as respostas mais antigas
+                while len(cache["respostas"]) >= MAX_RESPOSTAS_API:
+                    cache["respostas"].pop(next(iter(cache["respostas"])))
+                cache["respostas"][etag] = corpo
+        
+        self.enviar_resposta(200, corpo, etag)
     
-    # Ordenar por hora
-    result['hora_num'] = result['periodo'].str.split(':').str[0].astype(int)
-    result = result.sort_values('hora_num').drop('hora_num', axis=1)
+    def do_GET(self):
+        url = urlparse(self.path)
+        recurso = url.path.strip("/")
+        parametros = {chave: valores[0] for chave, valores in parse_qs(url.query).items()}
+        
+        if recurso == "filiais":
+            filiais = [
+                {"filial": nome, "conexao": filial_config.get("connection_name", "")}
+                for nome, filial_config in carregar_configuracao_planilhas().get("filiais", {}).items()
+            ]
+            etag = '"' + hashlib.sha1(json.dumps(filiais, sort_keys=True).encode("utf-8")).hexdigest()[:20] + '"'
+            self.enviar_com_etag(etag, lambda: filiais)
+            return
+        
+        if recurso == "metrics":
+            self.enviar_resposta(200, texto_prometheus().encode("utf-8"), tipo="text/plain; version=0.0.4; charset=utf-8")
+            return
+        
+        if recurso not in RECURSOS_API:
+            self.enviar_erro(404, f"Recurso não encontrado. Use /filiais ou /{', /'.join(RECURSOS_API)}.")
+            return
+        
+        nome_filial, filial_config = localizar_filial_api(parametros.get("filial", ""))
+        if filial_config is None:
+            self.enviar_erro(404, "Filial não encontrada.")
+            return
+        
+        try:
+            periodo = periodo_da_api(parametros.get("periodo"))
+        except ValueError as e:
+            self.enviar_erro(400, str(e))
+            return
+        
+        recepcao = parametros.get("recepcao") or "Todas"
+        
+        try:
+            dados = obter_dados_filial(filial_config)
+            consulta = json.dumps([recurso, nome_filial, recepcao, periodo], ensure_ascii=False)
+            etag = '"' + hashlib.sha1(f"{dados['versao']}|{consulta}".encode("utf-8")).hexdigest()[:20] + '"'
+            self.enviar_com_etag(etag, lambda: calcular_resposta_api(recurso, dados, recepcao, periodo))
+        except Exception as e:
+            self.enviar_erro(500, str(e))
     
-    return result
+    def log_message(self, format, *args):
+        # Sem registro de cada requisição no console
+        pass
 
-def categoria_de_nps(nps):
-    if nps >= 75:
-        return "Excelente", "#22c55e"
-    if nps >= 50:
-        return "Bom", "#3b82f6"
-    if nps >= 0:
-        return "Regular", "#eab308"
-    return "Crítico", "#ef4444"
+# API de métricas, iniciada uma única vez por processo
+@st.cache_resource
+def iniciar_api_metricas(host: str, porta: int) -> ThreadingHTTPServer:
+    servidor = ThreadingHTTPServer((host, porta), ManipuladorApiMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="ceop-api-metricas", daemon=True).start()
+    return servidor
 
 # Interface principal
 def main():
@@ -662,11 +3684,50 @@ def main():
         modo_texto = "GSpread API (Online)"
     elif modo_conexao == "public":
         modo_texto = "Planilhas Públicas (Online)"
+    elif modo_conexao == "servidor":
+        modo_texto = "Servidor de Ingestão Local"
     else:
         modo_texto = "Arquivos Locais (Offline)"
     
     st.sidebar.info(f"Modo de conexão: {modo_texto}")
     
+    # Atualização periódica das filiais em segundo plano, independente das páginas
+    iniciar_agendador_atualizacoes()
+    definir_limite_memo_processamento(config)
+    
+    # Log estruturado das etapas (uma linha JSON por etapa), se configurado
+    if config.get("arquivo_log_desempenho"):
+        try:
+            configurar_log_desempenho(os.path.join(dirs["base_dir"], config["arquivo_log_desempenho"]))
+        except Exception as e:
+            st.sidebar.warning(f"Não foi possível abrir o log de desempenho: {e}")
+    
+    # Servidor que recebe as avaliações dos formulários
+    if modo_conexao == "servidor":
+        config_servidor = config.get("servidor_ingestao", {})
+        try:
+            iniciar_servidor_ingestao(
+                config_servidor.get("host", "0.0.0.0"),
+                int(config_servidor.get("porta", PORTA_SERVIDOR_INGESTAO_PADRAO))
+            )
+        except OSError as e:
+            st.sidebar.error(f"Não foi possível iniciar o servidor de ingestão: {e}")
+        
+        # Cópia das avaliações no Google Sheets, enviada em lotes
+        if config_servidor.get("espelhar_planilha", False) and GOOGLE_LIBRARIES_AVAILABLE:
+            iniciar_espelho_planilhas(float(config_servidor.get("intervalo_espelho", INTERVALO_ESPELHO_PADRAO)))
+    
+    # API de métricas para painéis e intranet
+    config_api = config.get("api_metricas", {})
+    if config_api.get("ativa", False):
+        try:
+            iniciar_api_metricas(
+                config_api.get("host", "0.0.0.0"),
+                int(config_api.get("porta", PORTA_API_METRICAS_PADRAO))
+            )
+        except OSError as e:
+            st.sidebar.error(f"Não foi possível iniciar a API de métricas: {e}")
+    
     # Filtro de filial (antes de carregar os dados)
     st.sidebar.header("Filial")
     filiais = config.get("filiais", {})
@@ -675,11 +3736,16 @@ def main():
         st.error("Nenhuma filial configurada. Verifique o arquivo de configuração.")
         st.stop()
     
+    opcoes_filiais = list(filiais.keys())
+    if len(filiais) > 1:
+        opcoes_filiais.append(OPCAO_TODAS_FILIAIS)
+    
     filial_selecionada = st.sidebar.selectbox(
         "Selecione a filial:",
-        options=list(filiais.keys()),
+        options=opcoes_filiais,
         index=0  # Primeira filial por padrão
     )
+    visao_consolidada = filial_selecionada == OPCAO_TODAS_FILIAIS
 
     # Carrega ou baixa logo
     mostrar_logo = True
@@ -716,7 +3782,10 @@ def main():
             st.markdown("##")  # Espaço em branco caso não tenha logo
             
         if st.button("🔄 Atualizar agora"):
-            st.cache_data.clear()
+            # Lê novamente apenas as filiais exibidas, sem afetar as demais
+            filiais_exibidas = filiais.values() if visao_consolidada else [filiais.get(filial_selecionada, {})]
+            for filial_config in filiais_exibidas:
+                obter_dados_filial(filial_config, forcar=True)
             st.rerun()
 
     # Configuração da interface
@@ -730,26 +3799,55 @@ def main():
         
         atualizar_automaticamente = st.checkbox("Atualizar dados automaticamente", value=True)
         
-        st.info("O dashboard será atualizado automaticamente com este intervalo se a opção estiver marcada.")
+        st.info("Com a opção marcada, o dashboard verifica novas avaliações neste intervalo e só é atualizado quando os dados mudam.")
+        
+        mostrar_diagnostico = st.checkbox("Mostrar diagnóstico de desempenho", key="mostrar_diagnostico")
         
         # Botão para salvar dados offline (útil para uso sem conexão)
         if (modo_conexao == "streamlit" or modo_conexao == "gspread") and st.button("💾 Salvar dados para uso offline"):
-            try:
-                # Obter dados atuais
-                filial_config = filiais.get(filial_selecionada, {})
-                df = ler_dados_google_sheets(filial_config)
-                
-                # Salvar como CSV
-                csv_path = os.path.join(dirs["data_dir"], f"{filial_config.get('connection_name', 'dados')}.csv")
-                df.to_csv(csv_path, index=False)
-                
-                st.success(f"Dados salvos com sucesso em {csv_path}")
-            except Exception as e:
-                st.error(f"Erro ao salvar dados: {e}")
+            # Na visão consolidada, salva todas as filiais
+            filiais_para_salvar = list(filiais) if visao_consolidada else [filial_selecionada]
+            for nome_filial in filiais_para_salvar:
+                try:
+                    # Obter dados atuais
+                    filial_config = filiais.get(nome_filial, {})
+                    df = ler_dados_google_sheets(filial_config)
+                    
+                    nome_arquivo = filial_config.get('connection_name', 'dados')
+                    if PYARROW_AVAILABLE:
+                        # Salvar no armazenamento colunar (já normalizado)
+                        salvar_armazenamento_colunar(df, nome_arquivo)
+                        st.success(f"Dados salvos com sucesso em {caminho_armazenamento_colunar(nome_arquivo)}")
+                    else:
+                        # Salvar como CSV
+                        csv_path = os.path.join(dirs["data_dir"], f"{nome_arquivo}.csv")
+                        df.to_csv(csv_path, index=False)
+                        
+                        st.success(f"Dados salvos com sucesso em {csv_path}")
+                except Exception as e:
+                    st.error(f"Erro ao salvar dados: {e}")
+    
+    if mostrar_diagnostico:
+        exibir_diagnostico(st.session_state.get("execucao_anterior"))
 
-    # Carregar dados da filial selecionada
+    # Comparação entre todas as filiais
+    if visao_consolidada:
+        filiais_exibidas = list(filiais.values())
+        versoes_exibidas = exibir_visao_consolidada(filiais)
+        exibir_relatorio_memoria(filiais)
+        agendar_atualizacao_automatica(atualizar_automaticamente, intervalo_atualizacao, filiais_exibidas, versoes_exibidas)
+        return
+    
+    # Pré-carregar as demais filiais em segundo plano (a troca de filial fica imediata)
+    if config.get("pre_carregar_filiais", True) and len(filiais) > 1:
+        aquecer_cache_filiais({nome: cfg for nome, cfg in filiais.items() if nome != filial_selecionada})
+    
+    # Carregar dados da filial selecionada: DataFrame, versão e cubo vêm da
+    # mesma leitura (uma atualização em segundo plano pode trocá-la no meio da página)
     filial_config = filiais.get(filial_selecionada, {})
-    df = ler_dados_google_sheets(filial_config)
+    dados_filial = obter_dados_filial(filial_config)
+    df = dados_filial["df"]
+    exibir_avisos_leitura(dados_filial)
     
     if df.empty:
         st.warning("Nenhum dado encontrado ou erro na conexão com a fonte de dados.")
@@ -759,11 +3857,34 @@ def main():
             st.info("Verifique se a conexão do Streamlit com o Google Sheets está configurada corretamente.")
         elif modo_conexao == "gspread":
             st.info("Verifique se o arquivo de credenciais e os IDs das planilhas estão configurados corretamente.")
+        elif modo_conexao == "servidor":
+            st.info("Nenhuma avaliação recebida ainda. Verifique se os formulários enviam para o endereço do servidor de ingestão (veja a página de configuração).")
         else:
             st.info(f"Verifique se existem arquivos CSV ou Excel para esta filial na pasta {dirs['data_dir']}.")
         
         st.stop()
     
+    # Versão exibida nesta execução (a atualização automática compara com ela)
+    versoes_exibidas = [dados_filial["versao"]]
+    
+    # Memória ocupada pelas filiais já carregadas
+    exibir_relatorio_memoria(filiais)
+    
+    # Avaliações cuja data não pôde ser interpretada
+    if 'timestamp_invalido' in df.columns:
+        datas_invalidas = df[df['timestamp_invalido'].notna()]
+        if not datas_invalidas.empty:
+            with st.sidebar.expander(f"⚠️ {len(datas_invalidas)} avaliações com data não reconhecida"):
+                st.dataframe(
+                    datas_invalidas[['recepcao', 'timestamp_invalido', 'atendimento', 'recomendacao']].rename(columns={
+                        'recepcao': 'Recepção',
+                        'timestamp_invalido': 'Data original',
+                        'atendimento': 'Atendimento',
+                        'recomendacao': 'Recomendação'
+                    }),
+                    hide_index=True
+                )
+    
     # Filtro de período
     st.sidebar.header("Filtros")
     
@@ -783,39 +3904,66 @@ def main():
         index=0  # "Atual" por padrão
     )
     
-    # Converter para formato interno e filtrar dados
+    # Índice temporal (reconstruído apenas quando os dados mudam)
+    indice = obter_indice_temporal(df.attrs.get('versao') or calcular_versao_dados(df), df)
+    
+    # Converter para formato interno
     periodo_formatado = converter_periodo_para_formato(periodo_selecionado)
-    df_filtrado = filtrar_por_periodo(df, periodo_formatado)
     
-    # Aplicar filtro de recepção
-    if recepcao_selecionada != 'Todas':
-        df_filtrado = df_filtrado[df_filtrado['recepcao'] == recepcao_selecionada]
+    # Intervalo de datas livre
+    if periodo_selecionado == "Intervalo personalizado":
+        if indice.n_validos > 0:
+            primeira_data = pd.Timestamp(indice.timestamps[0]).date()
+            ultima_data = pd.Timestamp(indice.timestamps[indice.n_validos - 1]).date()
+        else:
+            primeira_data = ultima_data = datetime.date.today()
+        datas = st.sidebar.date_input("Intervalo de datas:", value=(primeira_data, ultima_data))
+        if isinstance(datas, (tuple, list)) and len(datas) == 2:
+            periodo_formatado = (datas[0], datas[1])
+        elif isinstance(datas, (tuple, list)) and len(datas) == 1:
+            periodo_formatado = (datas[0], datas[0])
+        else:
+            periodo_formatado = (datas, datas)
+    
+    # Filtrar dados por período e recepção
+    df_filtrado = filtrar_avaliacoes(df, indice, periodo_formatado, recepcao_selecionada)
+    
+    # Métricas e gráficos agregados são lidos do cubo, não das linhas
+    cubo = dados_filial["cubo"]
+    cubo_filtrado = None if isinstance(periodo_formatado, tuple) else filtrar_cubo(cubo, periodo_formatado, recepcao_selecionada)
     
     # Exibir informação do período
     if periodo_selecionado == "Todos":
         st.sidebar.info("Visualizando dados de todo o período")
+    elif isinstance(periodo_formatado, tuple):
+        st.sidebar.info(f"Visualizando dados de {periodo_formatado[0]:%d/%m/%Y} a {periodo_formatado[1]:%d/%m/%Y}")
     elif periodo_selecionado == "Atual":
-        mes_atual = datetime.datetime.now().strftime('%B/%Y')
+        agora = datetime.datetime.now()
+        mes_atual = rotulo_periodo(chave_periodo(agora.year, agora.month))
         st.sidebar.info(f"Visualizando dados do mês atual ({mes_atual})")
     else:
         st.sidebar.info(f"Visualizando dados de {periodo_selecionado}")
     
     # Mostrar contagem de avaliações no período selecionado
-    st.sidebar.metric("Avaliações no período", len(df_filtrado))
+    # (o cubo é mensal; intervalos livres são calculados a partir das linhas)
+    if cubo_filtrado is not None:
+        total_periodo = int(cubo_filtrado['n_linhas'].sum())
+        estatisticas = estatisticas_do_cubo(cubo_filtrado)
+    else:
+        total_periodo = len(df_filtrado)
+        estatisticas = calcular_estatisticas_notas(df_filtrado['atendimento'], df_filtrado['recomendacao'])
     
-    # Métricas principais
-    media_atendimento = df_filtrado['atendimento'].mean()
-    media_recomendacao = df_filtrado['recomendacao'].mean()
+    st.sidebar.metric("Avaliações no período", total_periodo)
     
-    # Verificar se as médias são NaN e substituir por 0 se forem
-    if pd.isna(media_atendimento):
-        media_atendimento = 0
-    if pd.isna(media_recomendacao):
-        media_recomendacao = 0
-        
-    nps = calcular_nps(df_filtrado['recomendacao'].dropna().tolist())
+    # Métricas principais (calculadas uma única vez por execução)
+    media_atendimento = estatisticas.media_atendimento
+    media_recomendacao = estatisticas.media_recomendacao
+    
+    nps = estatisticas.nps
     categoria, cor_nps = categoria_de_nps(nps)
     
+    inicio_graficos = time.perf_counter()
+    
     # Cards de métricas principais
     metric_col1, metric_col2, metric_col3 = st.columns(3)
     
@@ -828,9 +3976,9 @@ def main():
         fig_nps = go.Figure(data=[go.Pie(
             labels=['Promotores', 'Neutros', 'Detratores'],
             values=[
-                calcular_percentual_promotores(df_filtrado['recomendacao'].dropna()),
-                calcular_percentual_neutros(df_filtrado['recomendacao'].dropna()),
-                calcular_percentual_detratores(df_filtrado['recomendacao'].dropna())
+                estatisticas.percentual_promotores,
+                estatisticas.percentual_neutros,
+                estatisticas.percentual_detratores
             ],
             hole=.4,
             marker_colors=['#22c55e', '#eab308', '#ef4444']
@@ -841,11 +3989,11 @@ def main():
         # Legenda do gráfico de pizza
         legend_col_p, legend_col_n, legend_col_d = st.columns(3)
         with legend_col_p:
-            st.markdown(f"<div style='text-align:center;'><span style='color:#22c55e; font-weight:500;'>Promotores</span><br>{calcular_percentual_promotores(df_filtrado['recomendacao'].dropna()):.1f}%</div>", unsafe_allow_html=True)
+            st.markdown(f"<div style='text-align:center;'><span style='color:#22c55e; font-weight:500;'>Promotores</span><br>{estatisticas.percentual_promotores:.1f}%</div>", unsafe_allow_html=True)
         with legend_col_n:
-            st.markdown(f"<div style='text-align:center;'><span style='color:#eab308; font-weight:500;'>Neutros</span><br>{calcular_percentual_neutros(df_filtrado['recomendacao'].dropna()):.1f}%</div>", unsafe_allow_html=True)
+            st.markdown(f"<div style='text-align:center;'><span style='color:#eab308; font-weight:500;'>Neutros</span><br>{estatisticas.percentual_neutros:.1f}%</div>", unsafe_allow_html=True)
         with legend_col_d:
-            st.markdown(f"<div style='text-align:center;'><span style='color:#ef4444; font-weight:500;'>Detratores</span><br>{calcular_percentual_detratores(df_filtrado['recomendacao'].dropna()):.1f}%</div>", unsafe_allow_html=True)
+            st.markdown(f"<div style='text-align:center;'><span style='color:#ef4444; font-weight:500;'>Detratores</span><br>{estatisticas.percentual_detratores:.1f}%</div>", unsafe_allow_html=True)
     
     with metric_col2:
         st.markdown("### Média de Atendimento")
@@ -853,7 +4001,7 @@ def main():
         
         # Barra de progresso
         st.progress(float(media_atendimento/10))
-        st.markdown(f"Baseado em {len(df_filtrado['atendimento'].dropna())} avaliações")
+        st.markdown(f"Baseado em {estatisticas.n_atendimento} avaliações")
     
     with metric_col3:
         st.markdown("### Taxa de Recomendação")
@@ -874,18 +4022,9 @@ def main():
         st.markdown("### Distribuição de Notas")
         distribuicao_df = calcular_distribuicao_notas(df_filtrado)
         
-        # Melt para facilitar o uso com plotly
-        distribuicao_melted = pd.melt(
-            distribuicao_df, 
-            id_vars=['nota'], 
-            value_vars=['atendimento', 'recomendacao'],
-            var_name='tipo', 
-            value_name='contagem'
-        )
-        
         # Gráfico de barras para distribuição
         fig_dist = px.bar(
-            distribuicao_melted, 
+            distribuicao_df, 
             x='nota', 
             y='contagem', 
             color='tipo',
@@ -895,35 +4034,23 @@ def main():
         )
         fig_dist.update_layout(legend_title_text='')
         st.plotly_chart(fig_dist, use_container_width=True)
+        
+        notas_invalidas = distribuicao_df.attrs.get('invalidas', {})
+        if any(notas_invalidas.values()):
+            st.caption(
+                f"Notas fora do intervalo 0-10 ignoradas: {notas_invalidas['atendimento']} de atendimento, "
+                f"{notas_invalidas['recomendacao']} de recomendação"
+            )
     
     with detail_col2:
         st.markdown("### Evolução por Período")
         
-        # Agrupar por mês para mostrar evolução
-        if len(df) > 0 and not df['timestamp'].isna().all():
-            # Criar cópia para não modificar o original
-            df_temp = df.copy()
-            
-            # Agrupar por ano-mês
-            df_evolucao = df_temp.groupby('ano_mes').agg({
-                'atendimento': 'mean',
-                'recomendacao': 'mean'
-            }).reset_index()
-            
-            # Ordenar por ano-mês
-            df_evolucao = df_evolucao.sort_values('ano_mes')
-            
+        # Médias mensais a partir do cubo
+        df_evolucao = calcular_evolucao_mensal(cubo)
+        
+        if not df_evolucao.empty:
             # Formatar período
-            meses_pt = {
-                '01': 'Jan', '02': 'Fev', '03': 'Mar', 
-                '04': 'Abr', '05': 'Mai', '06': 'Jun',
-                '07': 'Jul', '08': 'Ago', '09': 'Set',
-                '10': 'Out', '11': 'Nov', '12': 'Dez'
-            }
-            
-            df_evolucao['periodo_formatado'] = df_evolucao['ano_mes'].apply(
-                lambda x: f"{meses_pt.get(x.split('-')[1], x.split('-')[1])}/{x.split('-')[0][2:4]}" if pd.notna(x) else ""
-            )
+            df_evolucao['periodo_formatado'] = [rotulo_periodo(chave, abreviado=True) for chave in df_evolucao['ano_mes']]
             
             # Gráfico de linha para evolução
             fig_evol = go.Figure()
@@ -957,7 +4084,7 @@ def main():
     # Tendência de avaliações (horário/dia)
     if periodo_selecionado == "Atual":
         st.markdown("### Tendência de Avaliações")
-        tendencia_df = calcular_tendencia_diaria(df_filtrado)
+        tendencia_df = calcular_tendencia_diaria(cubo_filtrado)
         
         if not tendencia_df.empty:
             # Gráfico de linha para tendência
@@ -989,71 +4116,33 @@ def main():
         else:
             st.info("Não há dados suficientes para exibir a tendência por hora do dia")
     
-    # Tabela de últimas avaliações
+    registrar_tempo_etapa("graficos", inicio_graficos, linhas=len(df_filtrado))
+    
+    # Tabela de últimas avaliações (só as linhas exibidas são formatadas)
+    inicio_tabela = time.perf_counter()
     st.markdown("### Últimas Avaliações")
     
-    # Criar cópia do DataFrame e formatar
-    df_display = df_filtrado.copy()
-    df_display['timestamp'] = df_display['timestamp'].dt.strftime('%d/%m/%Y %H:%M')
-    df_display.rename(columns={
-        'timestamp': 'Data/Hora',
-        'atendimento': 'Atendimento',
-        'recomendacao': 'Recomendação',
-        'comentario': 'Comentário'
-    }, inplace=True)
-    
-    # Remover colunas de filtro
-    df_display = df_display.drop(columns=['ano', 'mes', 'mes_nome', 'ano_mes'], errors='ignore')
-    
-    # Aplicar estilo à tabela
-    def color_notas(val):
-        if pd.isna(val) or not isinstance(val, (int, float)):
-            return ''
-        
-        val = float(val)
-        if val >= 9:
-            return 'color: #22c55e; font-weight: bold'  # Verde mais claro
-        elif val >= 7:
-            return 'color: #3b82f6; font-weight: bold'  # Azul mais claro
-        elif val >= 5:
-            return 'color: #eab308; font-weight: bold'  # Amarelo mais claro
-        else:
-            return 'color: #ef4444; font-weight: bold'  # Vermelho mais claro
+    # Volta para a primeira página quando os filtros mudam
+    filtro_tabela = (filial_selecionada, recepcao_selecionada, str(periodo_formatado))
+    tabela = st.session_state.get('tabela_avaliacoes')
+    if tabela is None or tabela['filtro'] != filtro_tabela:
+        tabela = {'filtro': filtro_tabela, 'linhas': TAMANHO_PAGINA_AVALIACOES}
+        st.session_state['tabela_avaliacoes'] = tabela
     
-    # Exibir tabela estilizada
+    posicoes = posicoes_mais_recentes(df_filtrado, tabela['linhas'])
     st.dataframe(
-        df_display.sort_values('Data/Hora', ascending=False).fillna("-").style.applymap(
-            color_notas, subset=['Atendimento', 'Recomendação']
-        ),
+        formatar_tabela_avaliacoes(df_filtrado.take(posicoes)),
         hide_index=True,
         use_container_width=True
     )
     
-    # Sistema de atualização automática mais seguro
-    if atualizar_automaticamente:
-        # Usar um método mais compatível com diferentes ambientes
-        st.markdown("---")
-        atualizacao_info = st.empty()
-        
-        # Exibir informação sobre a próxima atualização
-        tempo_atual = int(time.time())
-        proxima_atualizacao = tempo_atual + intervalo_atualizacao
-        
-        atualizacao_info.info(f"Próxima atualização automática às {time.strftime('%H:%M:%S', time.localtime(proxima_atualizacao))}")
-        
-        # Adicionar script JavaScript para recarregar a página após o intervalo
-        # Isso é mais confiável que usar sleep() que pode bloquear a thread
-        js_code = f"""
-        <script>
-            // Programar recarregamento da página
-            setTimeout(function() {{
-                window.location.reload();
-            }}, {intervalo_atualizacao * 1000});
-        </script>
-        """
-        st.markdown(js_code, unsafe_allow_html=True)
-    else:
-        st.info("Atualização automática desativada. Clique em 'Atualizar agora' para atualizar os dados.")
+    st.caption(f"Mostrando {len(posicoes)} de {len(df_filtrado)} avaliações, das mais recentes para as mais antigas")
+    registrar_tempo_etapa("tabela", inicio_tabela, linhas=len(posicoes))
+    if len(posicoes) < len(df_filtrado) and st.button("Carregar mais avaliações"):
+        tabela['linhas'] += TAMANHO_PAGINA_AVALIACOES
+        st.rerun()
+    
+    agendar_atualizacao_automatica(atualizar_automaticamente, intervalo_atualizacao, [filial_config], versoes_exibidas)
 
 # Página de configuração para quando o usuário clica em "Configurações" no sidebar
 def pagina_configuracao():
@@ -1068,7 +4157,7 @@ def pagina_configuracao():
     st.markdown("### Modo de Conexão")
     
     # Opções de modo de conexão
-    modos_disponiveis = ["public", "file"]  # Modos sem dependências externas
+    modos_disponiveis = ["public", "file", "servidor"]  # Modos sem dependências externas
     
     # Verificar disponibilidade do Streamlit Sheets
     if STREAMLIT_GSHEETS_AVAILABLE:
@@ -1083,7 +4172,8 @@ def pagina_configuracao():
         "file": "Arquivos Locais (offline)",
         "streamlit": "Streamlit Google Sheets (online)",
         "gspread": "Google Sheets API (online)",
-        "public": "Planilhas Públicas (online, sem autenticação)"
+        "public": "Planilhas Públicas (online, sem autenticação)",
+        "servidor": "Servidor de Ingestão Local (formulários enviam direto ao dashboard)"
     }
     
     modo_atual = config.get("modo_conexao", "public")
@@ -1153,17 +4243,25 @@ def pagina_configuracao():
                             st.error("URL da planilha inválida")
                         else:
                             # Construir URL para exportação como CSV
-                            csv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={novo_sheet_gid}"
+                            csv_url = URL_EXPORTACAO_PLANILHA.format(sheet_id=sheet_id, gid=novo_sheet_gid)
                             
-                            # Fazer requisição para a URL
+                            # Fazer requisição condicional para a URL (usa o cache em disco da exportação)
                             try:
-                                response = requests.get(csv_url)
-                                if response.status_code == 200:
-                                    # Tentar ler os dados
-                                    df = pd.read_csv(io.StringIO(response.content.decode('utf-8')))
-                                    st.success(f"Conexão bem-sucedida! A planilha tem {len(df)} linhas e {len(df.columns)} colunas.")
+                                chave_cache = f"{sheet_id}_{novo_sheet_gid}"
+                                resposta = baixar_exportacao(csv_url, chave_cache, obter_timeout(filial_config))
+                                if resposta.status == 200:
+                                    if resposta.inalterado and "linhas" in resposta.metadados:
+                                        # Planilha inalterada: dispensa a leitura do CSV
+                                        n_linhas, n_colunas = resposta.metadados["linhas"], resposta.metadados["colunas"]
+                                    else:
+                                        # Tentar ler os dados
+                                        conteudo = resposta.conteudo if resposta.conteudo is not None else ler_corpo_cache_http(chave_cache)
+                                        df = pd.read_csv(io.StringIO(conteudo.decode('utf-8')))
+                                        n_linhas, n_colunas = len(df), len(df.columns)
+                                        atualizar_cache_http(chave_cache, linhas=n_linhas, colunas=n_colunas)
+                                    st.success(f"Conexão bem-sucedida! A planilha tem {n_linhas} linhas e {n_colunas} colunas.")
                                 else:
-                                    st.error(f"Erro ao acessar planilha: {response.status_code}")
+                                    st.error(f"Erro ao acessar planilha: {resposta.status}")
                             except Exception as e:
                                 st.error(f"Erro ao testar conexão: {e}")
             
@@ -1330,7 +4428,9 @@ def pagina_configuracao():
             csv_path = os.path.join(dirs["data_dir"], f"{novo_nome_arquivo}.csv")
             excel_path = os.path.join(dirs["data_dir"], f"{novo_nome_arquivo}.xlsx")
             
-            if os.path.exists(csv_path):
+            if existe_armazenamento_colunar(novo_nome_arquivo):
+                st.success(f"Armazenamento colunar encontrado: {caminho_armazenamento_colunar(novo_nome_arquivo)}")
+            elif os.path.exists(csv_path):
                 st.success(f"Arquivo CSV encontrado: {csv_path}")
             elif os.path.exists(excel_path):
                 st.success(f"Arquivo Excel encontrado: {excel_path}")
@@ -1362,6 +4462,108 @@ def pagina_configuracao():
             
             st.markdown("---")
     
+    elif modo_selecionado == "servidor":
+        st.markdown("### Configuração do Servidor de Ingestão Local")
+        st.info("""
+        Neste modo o próprio dashboard recebe as avaliações dos formulários, no lugar do Apps Script.
+        As avaliações são gravadas em um registro local na pasta de dados e aparecem no dashboard em poucos segundos.
+        
+        Nos formulários (index.html, castanhal.html, barcarena.html), troque a URL do script.google.com
+        pelo endereço da filial mostrado abaixo.
+        """)
+        
+        config_servidor = config.setdefault("servidor_ingestao", {})
+        nova_porta = st.number_input(
+            "Porta do servidor:",
+            value=int(config_servidor.get("porta", PORTA_SERVIDOR_INGESTAO_PADRAO)),
+            min_value=1,
+            max_value=65535
+        )
+        
+        if nova_porta != config_servidor.get("porta", PORTA_SERVIDOR_INGESTAO_PADRAO):
+            config_servidor["porta"] = int(nova_porta)
+            
+            # Salvar configuração
+            try:
+                config_file = os.path.join(dirs["config_dir"], "sheets_config.json")
+                with open(config_file, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=4, ensure_ascii=False)
+                st.success("Porta do servidor atualizada! Reinicie o dashboard para aplicar.")
+            except Exception as e:
+                st.error(f"Erro ao salvar configuração: {e}")
+        
+        # Cópia opcional no Google Sheets (usa as credenciais e IDs do modo Google Sheets API)
+        espelhar = st.checkbox(
+            "Enviar também para o Google Sheets (em lotes, em segundo plano)",
+            value=bool(config_servidor.get("espelhar_planilha", False)),
+            disabled=not GOOGLE_LIBRARIES_AVAILABLE,
+            help="Usa as credenciais e os IDs de planilha configurados no modo Google Sheets API"
+        )
+        
+        if espelhar != bool(config_servidor.get("espelhar_planilha", False)):
+            config_servidor["espelhar_planilha"] = espelhar
+            
+            # Salvar configuração
+            try:
+                config_file = os.path.join(dirs["config_dir"], "sheets_config.json")
+                with open(config_file, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=4, ensure_ascii=False)
+                st.success("Configuração do servidor atualizada!")
+            except Exception as e:
+                st.error(f"Erro ao salvar configuração: {e}")
+        
+        situacao_espelho = obter_registro_avaliacoes()["espelho"]
+        
+        for filial, filial_config in config.get("filiais", {}).items():
+            nome_conexao = filial_config.get("connection_name", "")
+            st.markdown(f"**{filial}:** `http://<endereço do servidor>:{int(nova_porta)}/{nome_conexao}`")
+            
+            caminho_registro = caminho_registro_avaliacoes(nome_conexao)
+            if os.path.exists(caminho_registro):
+                st.caption(f"Registro local: {caminho_registro}")
+            
+            situacao = situacao_espelho.get(nome_conexao)
+            if espelhar and situacao is not None:
+                if situacao.get("erro"):
+                    st.warning(f"Último envio ao Google Sheets falhou (será repetido): {situacao['erro']}")
+                elif situacao.get("enviado_em"):
+                    st.caption(f"{situacao.get('enviadas', 0)} avaliações enviadas ao Google Sheets; último envio às {time.strftime('%H:%M:%S', time.localtime(situacao['enviado_em']))}")
+        
+        st.markdown("---")
+    
+    st.markdown("### API de Métricas")
+    config_api = config.setdefault("api_metricas", {})
+    api_ativa = st.checkbox(
+        "Disponibilizar as métricas em JSON (para painéis de TV e intranet)",
+        value=bool(config_api.get("ativa", False)),
+        help="Serve NPS, distribuição das notas e evolução mensal por filial, recepção e período, sem abrir o dashboard"
+    )
+    porta_api = st.number_input(
+        "Porta da API:",
+        value=int(config_api.get("porta", PORTA_API_METRICAS_PADRAO)),
+        min_value=1,
+        max_value=65535
+    )
+    
+    if api_ativa != bool(config_api.get("ativa", False)) or porta_api != config_api.get("porta", PORTA_API_METRICAS_PADRAO):
+        config_api["ativa"] = api_ativa
+        config_api["porta"] = int(porta_api)
+        
+        # Salvar configuração
+        try:
+            config_file = os.path.join(dirs["config_dir"], "sheets_config.json")
+            with open(config_file, 'w', encoding='utf-8') as f:
+                json.dump(config, f, indent=4, ensure_ascii=False)
+            st.success("Configuração da API atualizada! Uma mudança de porta vale após reiniciar o dashboard.")
+        except Exception as e:
+            st.error(f"Erro ao salvar configuração: {e}")
+    
+    if api_ativa:
+        st.markdown(f"`http://<endereço do servidor>:{int(porta_api)}/metricas?filial=<filial>&periodo=Atual`")
+        st.caption("Recursos: /filiais, /metricas, /distribuicao, /evolucao e /tendencia; parâmetros filial, recepcao e periodo (AAAAMM, Todos ou Atual).")
+    
+    st.markdown("---")
+    
     st.markdown("### Gerenciamento de Filiais")
     
     # Adicionar nova filial
@@ -1427,8 +4629,13 @@ if __name__ == "__main__":
     if st.sidebar.button("⚙️ Configurar Fontes de Dados"):
         st.session_state.pagina = "config"
     
+    # Cada execução da página agrupa as etapas medidas; a anterior aparece no diagnóstico
+    st.session_state.execucao_anterior = st.session_state.get("execucao_atual")
+    st.session_state.execucao_atual = iniciar_execucao_instrumentada()
+    
     # Exibe a página apropriada
     if st.session_state.pagina == "dashboard":
-        main()
+        with medir_etapa("pagina"):
+            main()
     elif st.session_state.pagina == "config":
         pagina_configuracao()
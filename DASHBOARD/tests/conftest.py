@@ -0,0 +1,5 @@
+import os
+import sys
+
+# O dashboard é um módulo único na pasta DASHBOARD
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
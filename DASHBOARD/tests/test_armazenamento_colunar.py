@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import ceop_dashboard as dashboard
+
+pytestmark = pytest.mark.skipif(not dashboard.PYARROW_AVAILABLE, reason="pyarrow não instalado")
+
+
+def avaliacoes(atendimento):
+    bruto = pd.DataFrame({
+        "Recepção": ["Recepção 1"] * len(atendimento),
+        "Timestamp": ["05/01/2026 10:00:00", "10/02/2026 11:30:00", "15/03/2026 09:15:00"][:len(atendimento)],
+        "Atendimento": atendimento,
+        "Recomendação": ["9", "10", "7"][:len(atendimento)],
+        "Comentário": ["", "ok", ""][:len(atendimento)],
+    })
+    return dashboard.processar_dataframe(bruto, "teste:armazenamento")
+
+
+@pytest.fixture
+def nome_filial(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "caminho_armazenamento_colunar", lambda nome: str(tmp_path / f"{nome}.parquet"))
+    return "teste"
+
+
+def test_notas_inteiras_voltam_como_int8(nome_filial):
+    df = avaliacoes(["8", "10", "5"])
+    dashboard.salvar_armazenamento_colunar(df, nome_filial)
+    
+    lido = dashboard.ler_armazenamento_colunar(nome_filial)
+    
+    assert str(lido["atendimento"].dtype) == "Int8"
+    assert str(lido["recomendacao"].dtype) == "Int8"
+    assert lido["atendimento"].tolist() == [8, 10, 5]
+
+
+def test_notas_fracionarias_e_fora_da_faixa_sao_preservadas(nome_filial):
+    df = avaliacoes(["8.5", "300", "5"])
+    dashboard.salvar_armazenamento_colunar(df, nome_filial)
+    
+    lido = dashboard.ler_armazenamento_colunar(nome_filial)
+    
+    assert str(lido["atendimento"].dtype) == "float32"
+    assert str(lido["recomendacao"].dtype) == "Int8"
+    assert lido["atendimento"].tolist() == [8.5, 300.0, 5.0]
+    assert dashboard.calcular_distribuicao_notas(lido).attrs["invalidas"]["atendimento"] == 1
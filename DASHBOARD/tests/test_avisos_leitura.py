@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+import ceop_dashboard as dashboard
+
+
+@pytest.fixture
+def pasta_dados(tmp_path, monkeypatch):
+    dirs = {"base_dir": str(tmp_path), "config_dir": str(tmp_path), "data_dir": str(tmp_path)}
+    monkeypatch.setattr(dashboard, "setup_app_directories", lambda: dirs)
+    monkeypatch.setattr(dashboard, "caminho_armazenamento_colunar", lambda nome: str(tmp_path / f"{nome}.parquet"))
+    return tmp_path
+
+
+def buscar_em_thread(filial_config, modo_conexao):
+    """Lê como o gerenciador de dados: em uma thread sem sessão do Streamlit"""
+    resultado = {}
+    thread = threading.Thread(target=lambda: resultado.update(dados=dashboard.buscar_dados_filial(filial_config, modo_conexao)))
+    thread.start()
+    thread.join()
+    return resultado["dados"]
+
+
+def test_mensagens_da_leitura_voltam_com_os_dados(pasta_dados):
+    dados = buscar_em_thread({"connection_name": "inexistente"}, "file")
+    
+    assert dados["df"].empty
+    assert dados["avisos"] == (("warning", "Arquivo de dados para inexistente não encontrado."),)
+
+
+def test_mensagens_do_processamento_voltam_com_os_dados(pasta_dados):
+    (pasta_dados / "sem_linhas.csv").write_text("Recepção,Timestamp,Atendimento,Recomendação,Comentário\n", encoding="utf-8")
+    
+    dados = buscar_em_thread({"connection_name": "sem_linhas"}, "file")
+    
+    assert ("error", "A planilha não contém dados") in dados["avisos"]
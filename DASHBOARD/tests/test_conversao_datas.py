@@ -0,0 +1,25 @@
+import pandas as pd
+
+import ceop_dashboard as dashboard
+
+
+def test_datas_impossiveis_sao_invalidas():
+    valores = pd.Series([
+        "31/02/2024 10:00:00",   # fevereiro não tem dia 31
+        "29/02/2023 08:00:00",   # 2023 não é bissexto
+        "29/02/2024 08:00:00",
+        "01/03/2024 10:00:00",
+    ])
+    timestamps, invalidas = dashboard.converter_timestamps(valores, "teste:datas_impossiveis")
+    
+    assert timestamps.isna().tolist() == [True, True, False, False]
+    assert invalidas.tolist()[:2] == ["31/02/2024 10:00:00", "29/02/2023 08:00:00"]
+    assert timestamps[2] == pd.Timestamp("2024-02-29 08:00:00")
+
+
+def test_formato_conhecido_rejeita_datas_impossiveis():
+    textos = pd.Series(["31/02/2024", "29/02/2023", "28/02/2023", "1/2/2024"], dtype="string")
+    convertidos = dashboard.converter_com_formato(textos, "%d/%m/%Y")
+    
+    assert convertidos.isna().tolist() == [True, True, False, False]
+    assert convertidos[3] == pd.Timestamp("2024-02-01")
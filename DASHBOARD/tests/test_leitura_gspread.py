@@ -0,0 +1,35 @@
+import re
+
+import ceop_dashboard as dashboard
+
+
+class AbaFalsa:
+    """Simula uma aba do gspread: get_values omite as linhas vazias no fim do intervalo"""
+    
+    def __init__(self, linhas, row_count):
+        self.linhas = linhas
+        self.row_count = row_count
+        self.intervalos = []
+    
+    def row_values(self, numero):
+        return self.linhas[numero - 1]
+    
+    def get_values(self, intervalo):
+        self.intervalos.append(intervalo)
+        inicio, fim = map(int, re.match(r"^A(\d+):[A-Z]+(\d+)$", intervalo).groups())
+        valores = [list(linha) for linha in self.linhas[inicio - 1:fim]]
+        while valores and not any(valores[-1]):
+            valores.pop()
+        return valores
+
+
+def test_linhas_vazias_no_fim_de_um_bloco_nao_encerram_a_leitura():
+    cabecalho = ["Recepção", "Timestamp", "Email", "Atendimento", "Recomendação", "Comentário"]
+    vazia = [""] * 6
+    linhas = [cabecalho] + [["R1", "01/02/2026", "", "8", "9", "a"]] * 3 + [vazia, vazia] + [["R2", "02/02/2026", "", "7", "6", "b"]] * 4
+    aba = AbaFalsa(linhas, row_count=len(linhas) + 5)
+    
+    df = dashboard.ler_aba_em_blocos(aba, tamanho_bloco=5)
+    
+    assert df["Recepção"].dropna().tolist() == ["R1"] * 3 + ["R2"] * 4
+    assert aba.intervalos[-1] == f"A12:F{aba.row_count}"
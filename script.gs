@@ -49,7 +49,9 @@ function doGet(e) {
     try {
       // Adquirir um bloqueio para evitar conflitos de acesso concorrente
       const lock = LockService.getScriptLock();
-      lock.tryLock(10000); // Tenta adquirir lock por 10 segundos
+      if (!lock.tryLock(10000)) { // Tenta adquirir lock por 10 segundos
+        return HtmlService.createHtmlOutput("Erro: Servidor ocupado. Tente enviar novamente.");
+      }
       
       // Obter os parâmetros
       var data = e.parameter;
@@ -125,7 +127,16 @@ function doPost(e) {
   try {
     // Adquirir um bloqueio para evitar conflitos de acesso concorrente
     const lock = LockService.getScriptLock();
-    lock.tryLock(10000); // Tenta adquirir lock por 10 segundos
+    if (!lock.tryLock(10000)) { // Tenta adquirir lock por 10 segundos
+      return ContentService.createTextOutput(JSON.stringify({
+        success: false,
+        error: "Servidor ocupado. Tente enviar novamente."
+      }))
+      .setMimeType(ContentService.MimeType.JSON)
+      .setHeader('Access-Control-Allow-Origin', '*')
+      .setHeader('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+      .setHeader('Access-Control-Allow-Headers', 'Content-Type');
+    }
     
     // Verificar se os dados foram recebidos
     if (!e || !e.postData || !e.postData.contents) {